@@ -3,7 +3,12 @@ import os
 import multiprocessing
 from mvc import converter
 from mvc import conversion
+from mvc import logqueue
+from mvc import settings
 from mvc import signals
+from mvc import streaming
+from mvc import throughput
+from mvc import tracing
 from mvc import video
 
 VERSION = '1.0a'
@@ -12,13 +17,23 @@ class Application(signals.SignalEmitter):
 
     def __init__(self, simultaneous=None):
 	signals.SignalEmitter.__init__(self)
+        log_queue = settings.get_log_queue()
+        if log_queue is not None:
+            logqueue.enable(json_format=(log_queue == 'json'))
+        trace_path = settings.get_trace_path()
+        if trace_path is not None:
+            tracing.enable(trace_path)
         if simultaneous is None:
             try:
                 simultaneous = multiprocessing.cpu_count()
             except NotImplementedError:
                 pass
         self.converter_manager = converter.ConverterManager()
-        self.conversion_manager = conversion.ConversionManager(simultaneous)
+        throughput_path = os.path.join(settings.get_data_directory(),
+                                       'throughput.json')
+        self.conversion_manager = conversion.ConversionManager(
+            simultaneous, throughput.ThroughputModel(throughput_path),
+            settings.get_scratch_directory())
         self.started = False
 
     def startup(self):
@@ -27,11 +42,34 @@ class Application(signals.SignalEmitter):
         self.converter_manager.startup()
         self.started = True
 
-    def start_conversion(self, filename, converter_id):
+    def get_conversion(self, filename, converter_id):
         self.startup()
         converter = self.converter_manager.get_by_id(converter_id)
         v = video.VideoFile(filename)
-        return self.conversion_manager.start_conversion(v, converter)
+        return self.conversion_manager.get_conversion(v, converter)
+
+    def get_stream_conversion(self, filename, converter_id, output_stream,
+                              input_stream=None):
+        """Get a conversion that writes its output to output_stream.
+
+        :param filename: file to convert, or '-' to convert what's read
+        from input_stream
+        """
+        self.startup()
+        converter = self.converter_manager.get_by_id(converter_id)
+        if filename == '-':
+            v = video.StreamVideoFile(streaming.read_head(input_stream))
+        else:
+            v = video.VideoFile(filename)
+            input_stream = None
+        return streaming.StreamConversion(v, converter,
+                                          self.conversion_manager,
+                                          output_stream,
+                                          input_stream=input_stream)
+
+    def start_conversion(self, filename, converter_id):
+        return self.conversion_manager.run_conversion(
+            self.get_conversion(filename, converter_id))
 
     def run(self):
         raise NotImplementedError
@@ -1,4 +1,5 @@
 import logging
+import os
 import re
 
 from mvc import converter
@@ -107,6 +108,56 @@ class NullConverter(converter.FFmpegConverterInfo):
             container = video.container
         return ['-f', container]
 
+class HLS(converter.SegmentedConverterInfo):
+    """HTTP Live Streaming: MPEG-TS segments, a playlist per rendition and
+    master.m3u8 listing them.
+    """
+    # HLS renditions are self-contained, each with its own copy of the audio
+    audio_per_rendition = True
+
+    def get_muxer_arguments(self, video, video_streams, has_audio, output):
+        if video_streams:
+            streams = []
+            for i in range(video_streams):
+                if has_audio:
+                    streams.append('v:%i,a:%i' % (i, i))
+                else:
+                    streams.append('v:%i' % (i,))
+            stream_map = ' '.join(streams)
+        else:
+            stream_map = 'a:0'
+        # the playlists are an "event" playlist, which players can start on
+        # right away.  temp_file makes ffmpeg write each segment and
+        # playlist under a temporary name and rename it into place.
+        return ['-f', 'hls',
+                '-hls_time', str(self.segment_duration),
+                '-hls_playlist_type', 'event',
+                '-hls_flags', 'independent_segments+temp_file',
+                '-hls_segment_filename', self.convert_output_path(
+                os.path.join(output, 'stream_%v_%05d.ts')),
+                '-master_pl_name', 'master.m3u8',
+                '-var_stream_map', stream_map,
+                self.convert_output_path(
+                os.path.join(output, 'stream_%v.m3u8'))]
+
+class DASH(converter.SegmentedConverterInfo):
+    """MPEG-DASH: fragmented MP4 segments and a manifest.mpd that's updated
+    as they're written.
+    """
+    def get_muxer_arguments(self, video, video_streams, has_audio, output):
+        adaptation_sets = []
+        if video_streams:
+            adaptation_sets.append('id=0,streams=v')
+        if has_audio:
+            adaptation_sets.append('id=%i,streams=a' % len(adaptation_sets))
+        return ['-f', 'dash',
+                '-seg_duration', str(self.segment_duration),
+                '-use_template', '1',
+                '-use_timeline', '1',
+                '-adaptation_sets', ' '.join(adaptation_sets),
+                self.convert_output_path(
+                os.path.join(output, 'manifest.mpd'))]
+
 mp3 = MP3('MP3')
 ogg_vorbis = OggVorbis('Ogg Vorbis')
 
@@ -129,6 +180,12 @@ avc_intra_720 = PRORES_720('AVC Intra 720p')
 ingest_formats = ('Ingest Formats', [dnxhd_1080, dnxhd_720, prores_1080,
                                      prores_720, avc_intra_1080, avc_intra_720])
 
+hls = HLS('HLS')
+dash = DASH('DASH')
+
+streaming_formats = ('Adaptive Streaming', [hls, dash])
+
 null_converter = NullConverter('Same Format')
 
-converters = [video_formats, audio_formats, ingest_formats, null_converter]
+converters = [video_formats, audio_formats, ingest_formats,
+              streaming_formats, null_converter]
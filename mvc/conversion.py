@@ -6,33 +6,100 @@ import tempfile
 import threading
 import shutil
 import logging
+import sys
+import uuid
 
 from mvc import execute
-from mvc.utils import line_reader
+from mvc import tracing
+from mvc.logqueue import logs_for_conversion
+from mvc.logbuffer import LogBuffer
+from mvc.notifications import NotificationQueue
+from mvc.throughput import ThroughputModel, schedule_finish_times
+from mvc.utils import (line_reader, get_available_space, get_filesystem_id,
+                       size_string)
 from mvc.video import get_thumbnail_synchronous
 from mvc.widgets import get_conversion_directory
+from mvc.writebehind import WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
+# fraction of a conversion that must be done before we trust extrapolating
+# the ETA from its own progress over the throughput model's prediction.
+EXTRAPOLATE_AFTER = 0.05
+
+# number of finished conversions that are moved to their destination at once
+WRITE_BEHIND_WORKERS = 2
+
+# output size estimates are rough, so reserve this much more than the guess
+SPACE_MARGIN = 1.2
+# bytes to leave free on each filesystem we write to
+MIN_FREE_SPACE = 50 * 1024 * 1024
+
 class Conversion(object):
-    def __init__(self, video, converter, manager, output_dir=None):
+    # attributes that a worker reports back to the coordinator for jobs run
+    # on other machines, see get_report()
+    REPORTED_ATTRIBUTES = ('status', 'output', 'duration', 'progress',
+                           'progress_percent', 'eta', 'output_size', 'error',
+                           'error_context', 'started_at', 'finished_at',
+                           'phase_times', 'cpu_user', 'cpu_system', 'max_rss',
+                           'frames', 'input_bytes', 'output_bytes')
+
+    def __init__(self, video, converter, manager, output_dir=None,
+                 priority=0):
         self.video = video
         self.manager = manager
+        # identifies this conversion in structured logs, see mvc.logqueue
+        self.id = uuid.uuid4().hex[:12]
+        # conversions with a higher priority start first, and can preempt
+        # running conversions with a lower one
+        self.priority = priority
         if output_dir is None:
             output_dir = get_conversion_directory()
         self.output_dir = output_dir
-        self.lines = []
+        self.log = LogBuffer()
         self.thread = None
         self.popen = None
         self.status = 'initialized'
         self.temp_output = None
         self.error = None
+        # the last few messages from the converter when it failed
+        self.error_context = None
+        self.queued_at = None
         self.started_at = None
+        self.paused_at = None
+        # seconds spent paused, not counting the current pause
+        self.paused_time = 0.0
+        # paused by the manager to make room for a higher priority conversion
+        self.preempted = False
+        self.staged_at = None
+        self.finished_at = None
         self.duration = None
         self.progress = None
         self.progress_percent = None
         self.create_thumbnail = False
         self.eta = None
+        self.queue_eta = None
+        # estimate from converting a few samples, see mvc.preflight
+        self.sample_estimate = None
+        # why a queued conversion hasn't been started, or None
+        self.waiting_reason = None
+        # process priority for this conversion; None means use the
+        # manager's setting.  See execute.set_priority().
+        self.nice = None
+        self.io_class = None
+        self.cpus = None
+        # CPUs the manager pinned us to
+        self.cpu_group = None
+        # bytes written so far, as reported by the converter
+        self.output_size = None
+        # resource accounting, see get_stats()
+        self.phase_times = {}
+        self.cpu_user = None
+        self.cpu_system = None
+        self.max_rss = None
+        self.frames = None
+        self.input_bytes = None
+        self.output_bytes = None
         self.listeners = set()
         self.set_converter(converter)
         logger.info('created %r', self)
@@ -55,6 +122,34 @@ class Conversion(object):
         return u'<Conversion (%s) %r -> %r>' % (
             self.converter.name, self.video.filename, self.output)
 
+    @property
+    def lines(self):
+        """Output from the converter, for debugging.
+
+        Only the start and end of long outputs are kept; see LogBuffer.
+        """
+        return self.log.get_lines()
+
+    def estimate_output_size(self):
+        """Guess how big the output will be.
+
+        An estimate from converting samples is used first.  Then the
+        converter's guess, and when the converter can't tell, assume the
+        output is the size of the input.
+
+        :returns: bytes, or None if we can't tell
+        """
+        if (self.sample_estimate is not None and
+            self.sample_estimate['output_size']):
+            return self.sample_estimate['output_size']
+        size = self.converter.get_output_size_guess(self.video)
+        if size is None:
+            try:
+                size = os.path.getsize(self.video.filename)
+            except EnvironmentError:
+                return None
+        return int(size)
+
     def listen(self, f):
         self.listeners.add(f)
 
@@ -62,13 +157,33 @@ class Conversion(object):
         self.listeners.remove(f)
 
     def notify_listeners(self):
-        self.manager.notify_queue.add(self)
+        self.manager.notify_queue.post(self)
+
+    def record_queued(self):
+        """Note how long we waited in the queue, when starting."""
+        if self.queued_at is not None:
+            now = time.time()
+            self.phase_times['queued'] = now - self.queued_at
+            tracing.record('queued', self.queued_at, now, self)
 
+    @logs_for_conversion
     def run(self):
         logger.info('starting %r', self)
+        self.record_queued()
+        try:
+            self.input_bytes = os.path.getsize(self.video.filename)
+        except EnvironmentError:
+            pass
+        if self.manager.save_logs:
+            self.log = LogBuffer(spill_path=self.output + '.log.gz')
+        temp_dir = self.manager.scratch_dir
+        if temp_dir is None:
+            temp_dir = os.path.dirname(self.output)
         try:
-            self.temp_output = tempfile.mktemp(
-                dir=os.path.dirname(self.output))
+            if self.converter.segmented:
+                self.temp_output = self.make_segment_directory()
+            else:
+                self.temp_output = tempfile.mktemp(dir=temp_dir)
         except EnvironmentError,e :
             logger.exception('while creating temp file for %r',
                              self.output)
@@ -82,7 +197,24 @@ class Conversion(object):
         self.thread.setDaemon(True)
         self.thread.start()
 
+    def make_segment_directory(self):
+        """Create the directory for a segmented converter's output.
+
+        Players can start on the segments while we're converting, so
+        they're written straight to the destination rather than to a temp
+        file.  Output from an earlier conversion is replaced.
+        """
+        if os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        os.makedirs(self.output)
+        return self.output
+
+    @logs_for_conversion
     def stop(self):
+        if self.status == 'staging':
+            # the converter is done; let the move to the destination finish
+            logger.info('not stopping %r, already staging', self)
+            return
         logger.info('stopping %r', self)
         self.error = 'manually stopped'
         if self.popen is None:
@@ -98,6 +230,7 @@ class Conversion(object):
             try:
                 self.popen.kill()
                 self.popen.wait()
+                self.collect_rusage(self.popen)
                 # set the status transition last, if we had hit an exception
                 # then we will transition the next state to 'failed' in
                 # finalize()
@@ -108,15 +241,71 @@ class Conversion(object):
         self.popen = None
         self.manager.conversion_finished(self)
 
+    def pause(self):
+        """Suspend the converter process.
+
+        Use ConversionManager.pause() rather than calling this directly, so
+        that the conversion doesn't count against the simultaneous limit.
+
+        :returns: True if the conversion was paused
+        """
+        popen = self.popen
+        if self.status != 'converting' or popen is None:
+            return False
+        try:
+            popen.suspend()
+        except EnvironmentError:
+            logger.exception('while pausing %s' % (self,))
+            return False
+        logger.info('paused %r', self)
+        self.paused_at = time.time()
+        self.status = 'paused'
+        self.eta = None
+        self.notify_listeners()
+        return True
+
+    def resume(self):
+        """Continue a conversion stopped with pause()."""
+        popen = self.popen
+        if self.status != 'paused' or popen is None:
+            return False
+        try:
+            popen.resume()
+        except EnvironmentError:
+            logger.exception('while resuming %s' % (self,))
+            return False
+        logger.info('resumed %r', self)
+        now = time.time()
+        tracing.record('paused', self.paused_at, now, self)
+        self.paused_time += now - self.paused_at
+        self.paused_at = None
+        self.preempted = False
+        self.status = 'converting'
+        self.notify_listeners()
+        return True
+
+    @logs_for_conversion
     def _thread(self):
         try:
             commandline = self.get_subprocess_arguments(self.temp_output)
-            self.popen = execute.Popen(commandline, bufsize=1)
+            self.popen = execute.Popen(commandline, bufsize=1,
+                                       **self.get_popen_kwargs())
+            self.set_priority(self.popen.pid)
             self.process_output()
-            if self.popen:
+            popen = self.popen
+            if popen:
                 # if we stop the thread, we can get here after `.stop()`
                 # finishes.
-                self.popen.wait()
+                popen.wait()
+                self.collect_rusage(popen)
+            now = time.time()
+            self.phase_times['encode'] = (now - self.started_at -
+                                          self.paused_time)
+            tracing.record('encode', self.started_at, now, self,
+                           converter=self.converter.identifier,
+                           paused=self.paused_time)
+            if self.paused_time:
+                self.phase_times['paused'] = self.paused_time
         except OSError, e:
             if e.errno == errno.ENOENT:
                 self.error = '%r does not exist' % (
@@ -129,8 +318,48 @@ class Conversion(object):
             self.error = str(e)
 
         if self.create_thumbnail:
-            self.write_thumbnail_file()
-        self.finalize()
+            start = time.time()
+            with tracing.span('thumbnail', self):
+                self.write_thumbnail_file()
+            self.phase_times['thumbnail'] = time.time() - start
+        if self.error is None:
+            # hand the move to the destination off to the write-behind
+            # queue, which frees our slot for the next conversion.
+            self.status = 'staging'
+            self.staged_at = time.time()
+            self.notify_listeners()
+            self.manager.write_behind.submit(self.finalize)
+        else:
+            self.finalize()
+
+    def get_popen_kwargs(self):
+        """Get the extra arguments to start the converter with."""
+        return {}
+
+    def set_priority(self, pid):
+        """Set the priority and CPU affinity of the converter, once it's
+        started.
+        """
+        nice = self.nice
+        if nice is None:
+            nice = self.manager.nice
+        io_class = self.io_class
+        if io_class is None:
+            io_class = self.manager.io_class
+        execute.set_priority(pid, nice=nice, io_class=io_class,
+                             cpus=self.cpus or self.cpu_group)
+
+    def collect_rusage(self, popen):
+        """Store the CPU time and peak memory use of our child process."""
+        rusage = popen.rusage
+        if rusage is None:
+            return
+        self.cpu_user = rusage.ru_utime
+        self.cpu_system = rusage.ru_stime
+        if sys.platform == 'darwin':
+            self.max_rss = rusage.ru_maxrss # already in bytes on OS X
+        else:
+            self.max_rss = rusage.ru_maxrss * 1024
 
     def write_thumbnail_file(self):
         try:
@@ -183,19 +412,32 @@ class Conversion(object):
     def process_output(self):
         self.started_at = time.time()
         self.status = 'converting'
+        # converters normally write their messages to stdout, but ones that
+        # stream their output there (see mvc.streaming) use stderr
+        if self.popen.stdout is not None:
+            pipe = self.popen.stdout
+        else:
+            pipe = self.popen.stderr
         # We use line_reader, rather than just iterating over the file object,
         # because iterating over the file object gives us all the lines when
         # the process ends, and we're looking for real-time updates.
-        for line in line_reader(self.popen.stdout):
-            self.lines.append(line) # for debugging, if needed
+        for line in line_reader(pipe):
             try:
                 status = self.converter.process_status_line(self.video, line)
             except StandardError:
                 logging.warn("error in process_status_line()", exc_info=True)
+                self.log.append(line)
                 continue
             if status is None:
+                self.log.append(line)
                 continue
+            self.log.append(line, progress='progress' in status)
             updated = set()
+            if 'frame' in status:
+                self.frames = int(status['frame'])
+            if 'size' in status:
+                updated.add('size')
+                self.output_size = int(status['size'])
             if 'finished' in status:
                 self.error = status.get('error', None)
                 break
@@ -215,9 +457,21 @@ class Conversion(object):
             if updated:
                 self.progress_percent = self.calc_progress_percent()
                 if 'eta' not in updated:
-                    if self.duration and 0 < self.progress_percent < 1.0:
+                    if (self.duration and
+                        self.progress_percent < EXTRAPOLATE_AFTER):
+                        # too early to extrapolate from what we've seen,
+                        # use the speed we expect for the media that's left
+                        speed = self.manager.throughput.get_conversion_speed(
+                            self)
+                        if speed:
+                            self.eta = ((self.duration - (self.progress or 0))
+                                        / speed)
+                        else:
+                            self.eta = None # unknown, not done
+                    elif self.duration and 0 < self.progress_percent < 1.0:
                         progress = self.progress_percent * 100
-                        elapsed = time.time() - self.started_at
+                        elapsed = (time.time() - self.started_at -
+                                   self.paused_time)
                         time_per_percent = elapsed / progress
                         self.eta = float(
                             time_per_percent * (100 - progress))
@@ -226,15 +480,19 @@ class Conversion(object):
 
                 self.notify_listeners()
 
+    @logs_for_conversion
     def finalize(self):
         self.progress = self.duration
         self.progress_percent = 1.0
         self.eta = 0
         if self.error is None:
-            self.status = 'staging'
-            self.notify_listeners()
+            start = time.time()
+            if self.staged_at is not None:
+                self.phase_times['staging_wait'] = start - self.staged_at
+                tracing.record('staging_wait', self.staged_at, start, self)
             try:
-                self.converter.finalize(self.temp_output, self.output)
+                with tracing.span('finalize', self):
+                    self.move_to_destination()
             except EnvironmentError, e:
                 logger.exception('while trying to move %r to %r after %s',
                                   self.temp_output, self.output, self)
@@ -242,74 +500,523 @@ class Conversion(object):
                 self.status = 'failed'
             else:
                 self.status = 'finished'
+                self.output_bytes = self.get_output_bytes()
+                if self.output_bytes is not None:
+                    self.output_size = self.output_bytes
+                self.record_throughput()
+            self.phase_times['finalize'] = time.time() - start
         else:
             if self.temp_output is not None:
                 try:
-                    os.unlink(self.temp_output)
+                    if os.path.isdir(self.temp_output):
+                        # partial segmented output
+                        shutil.rmtree(self.temp_output)
+                    else:
+                        os.unlink(self.temp_output)
                 except EnvironmentError:
                     pass # ignore errors removing temp files; they may not have
                          # been created
             if self.status != 'canceled':
                 self.status = 'failed'
+        self.log.close()
+        if self.error is not None:
+            self.error_context = self.log.get_error_context()
+        self.finished_at = time.time()
         if self.status != 'canceled':
             self.notify_listeners()
         logger.info('finished %r; status: %s', self, self.status)
 
+    def move_to_destination(self):
+        if self.temp_output == self.output:
+            return # segmented output is written in place
+        output_dir = os.path.dirname(self.output)
+        if os.path.dirname(self.temp_output) == output_dir:
+            self.converter.finalize(self.temp_output, self.output)
+            return
+        # the output was written to the scratch directory.  Copy it to a
+        # temporary name first, so that a partly copied file never shows up
+        # under the real name.
+        staged_output = tempfile.mktemp(dir=output_dir)
+        try:
+            self.converter.finalize(self.temp_output, staged_output)
+            if os.path.exists(self.output) and os.name == 'nt':
+                os.remove(self.output) # rename() doesn't replace on windows
+            os.rename(staged_output, self.output)
+        except EnvironmentError:
+            try:
+                os.unlink(staged_output)
+            except EnvironmentError:
+                pass # finalize() may have already cleaned up
+            raise
+
+    def get_output_bytes(self):
+        """Get the size of the finished output, or None if we can't tell."""
+        try:
+            if not os.path.isdir(self.output):
+                return os.path.getsize(self.output)
+            return sum(os.path.getsize(os.path.join(self.output, name))
+                       for name in os.listdir(self.output))
+        except EnvironmentError:
+            return None
+
+    def record_throughput(self):
+        encode_time = self.phase_times.get('encode')
+        if not encode_time or not self.duration:
+            return
+        self.manager.throughput.record(self.converter, self.video,
+                                       self.duration, encode_time)
+
+    def get_stats(self):
+        """Get resource accounting information for this conversion.
+
+        Values that weren't measured (for example CPU time on platforms
+        without wait4()) are None.
+
+        :returns: dict of statistics
+        """
+        encode_time = self.phase_times.get('encode')
+        if self.frames and encode_time:
+            fps = self.frames / encode_time
+        else:
+            fps = None
+        if self.input_bytes and self.output_bytes is not None:
+            compression_ratio = float(self.output_bytes) / self.input_bytes
+        else:
+            compression_ratio = None
+        if self.finished_at is not None and self.started_at is not None:
+            wall_time = self.finished_at - self.started_at
+        else:
+            wall_time = None
+        return {
+            'converter': self.converter.identifier,
+            'status': self.status,
+            'wall_time': wall_time,
+            'phases': dict(self.phase_times),
+            'cpu_user': self.cpu_user,
+            'cpu_system': self.cpu_system,
+            'max_rss': self.max_rss,
+            'frames': self.frames,
+            'fps': fps,
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+            'compression_ratio': compression_ratio,
+        }
+
+    def get_job_description(self):
+        """Describe this conversion so that a worker can run it.
+
+        See mvc.worker.Worker.
+        """
+        return {
+            'id': uuid.uuid4().hex,
+            'filename': self.video.filename,
+            'converter': self.converter.identifier,
+            'width': self.converter.width,
+            'height': self.converter.height,
+            'dont_upsize': self.converter.dont_upsize,
+            'output_dir': self.output_dir,
+            'priority': self.priority,
+            'nice': self.nice,
+            'io_class': self.io_class,
+            }
+
+    def get_report(self):
+        """Get the state of this conversion, to send to a coordinator."""
+        return dict((name, getattr(self, name))
+                    for name in self.REPORTED_ATTRIBUTES)
+
+    def apply_report(self, report):
+        """Update this conversion from a worker's report."""
+        for name in self.REPORTED_ATTRIBUTES:
+            if name in report:
+                setattr(self, name, report[name])
+
     def get_subprocess_arguments(self, output):
         return ([self.converter.get_executable()] +
                 list(self.converter.get_arguments(self.video, output)))
 
 
 class ConversionManager(object):
-    def __init__(self, simultaneous=None):
-        self.notify_queue = set()
+    def __init__(self, simultaneous=None, throughput=None, scratch_dir=None):
+        if throughput is None:
+            throughput = ThroughputModel()
+        self.throughput = throughput
+        self.notify_queue = NotificationQueue()
         self.in_progress = set()
+        # conversions whose converter is suspended.  Preempted ones are also
+        # in waiting, to be resumed when there's room.
+        self.paused = set()
+        # conversions that are done converting, but are being moved to their
+        # destination.  They don't count against simultaneous.
+        self.staging = set()
+        self.scratch_dir = scratch_dir
+        self.write_behind = WriteBehindQueue(WRITE_BEHIND_WORKERS)
         self.waiting = collections.deque()
         self.simultaneous = simultaneous
         self.running = False
         self.create_thumbnails = False
+        # write the complete converter output next to each output file
+        self.save_logs = False
+        # priority for converter processes, see execute.set_priority()
+        self.nice = None
+        self.io_class = None
+        # pin each running conversion to its own group of CPUs
+        self.pin_cpus = False
+        # pause running conversions to start higher priority ones
+        self.preempt = True
+        # bumped whenever a conversion is queued, started, paused, finished
+        # or removed, so callers can tell when to update_queue_estimates()
+        self.queue_changes = 0
 
     def get_conversion(self, video, converter, **kwargs):
         return Conversion(video, converter, self, **kwargs)
 
+    def close(self):
+        """Release the file descriptors of our notification queue.
+
+        Call this when the manager won't be used any more.
+        """
+        self.notify_queue.close()
+
     def remove(self, conversion):
         self.waiting.remove(conversion)
+        self.queue_changes += 1
 
     def start_conversion(self, video, converter):
         return self.run_conversion(self.get_conversion(video, converter))
 
     def run_conversion(self, conversion):
-        if (self.simultaneous is not None and
-            len(self.in_progress) >= self.simultaneous):
-            self.waiting.append(conversion)
-        else:
-            self._start_conversion(conversion)
-            self.running = True
+        conversion.queued_at = time.time()
+        self._enqueue(conversion)
+        self.running = True
+        self._preempt()
+        self._start_waiting()
         return conversion
 
+    def _enqueue(self, conversion):
+        """Add conversion to waiting, behind conversions with the same or
+        higher priority.
+
+        Preempted conversions go ahead of the others with the same priority,
+        since they've already done some of their work.
+        """
+        self.queue_changes += 1
+        if not self.waiting or (
+            not conversion.preempted and
+            self.waiting[-1].priority >= conversion.priority):
+            # the usual case, and the only cheap one for long queues
+            self.waiting.append(conversion)
+            return
+        index = len(self.waiting)
+        for i, c in enumerate(self.waiting):
+            if (c.priority < conversion.priority or
+                (conversion.preempted and c.priority == conversion.priority
+                 and not c.preempted)):
+                index = i
+                break
+        self.waiting.rotate(-index)
+        self.waiting.appendleft(conversion)
+        self.waiting.rotate(index)
+
+    def _preempt(self):
+        """Pause running conversions that have a lower priority than the
+        first waiting one, until there's a free slot for it.
+
+        The conversion with the most work left is paused first.
+        """
+        if not self.preempt or self.simultaneous is None:
+            return
+        while self.waiting and len(self.in_progress) >= self.simultaneous:
+            urgent = self.waiting[0]
+            candidates = [c for c in self.in_progress
+                          if c.priority < urgent.priority and
+                          c.status == 'converting']
+            if not candidates:
+                return
+            predict = self.throughput.predict_remaining
+            victim = min(candidates,
+                         key=lambda c: (c.priority, -(predict(c) or 0)))
+            if not self.pause(victim):
+                return
+            victim.preempted = True
+            self._enqueue(victim)
+
+    def pause(self, conversion):
+        """Pause a running conversion.
+
+        Paused conversions don't count against simultaneous, so a waiting
+        conversion will start in its place.
+
+        :returns: True if the conversion was paused
+        """
+        if conversion not in self.in_progress or not conversion.pause():
+            return False
+        self.in_progress.discard(conversion)
+        self.paused.add(conversion)
+        self.queue_changes += 1
+        self._start_waiting()
+        return True
+
+    def resume(self, conversion):
+        """Resume a paused conversion.
+
+        If the simultaneous limit is reached, the conversion is queued ahead
+        of conversions that haven't started, and resumes when there's room.
+        """
+        if conversion not in self.paused:
+            return
+        if conversion in self.waiting:
+            return # already queued to resume
+        conversion.preempted = True
+        self._enqueue(conversion)
+        self._start_waiting()
+
+    def _resume_conversion(self, conversion):
+        self.paused.discard(conversion)
+        self.in_progress.add(conversion)
+        if not conversion.resume():
+            # the converter probably exited while it was paused; let
+            # process_output() finish it off.
+            logger.warn('could not resume %r', conversion)
+
     def _start_conversion(self, conversion):
+        if self.pin_cpus and conversion.cpus is None:
+            conversion.cpu_group = self._choose_cpu_group()
         self.in_progress.add(conversion)
         conversion.create_thumbnail = self.create_thumbnails
         conversion.run()
 
+    def _choose_cpu_group(self):
+        """Pick CPUs that no other running conversion is pinned to.
+
+        The CPUs are split into one group per simultaneous conversion.
+
+        :returns: list of CPUs, or None to not pin the conversion
+        """
+        if not self.simultaneous:
+            return None
+        groups = execute.split_cpus(execute.get_available_cpus(),
+                                    self.simultaneous)
+        in_use = [c.cpu_group for c in self.in_progress]
+        for group in groups:
+            if group and group not in in_use:
+                return group
+        return None
+
+    def wait_for_notifications(self, timeout=None):
+        """Block until a conversion has changed, or timeout seconds pass.
+
+        Call check_notifications() afterwards to handle the changes.
+        """
+        return self.notify_queue.wait(timeout)
+
     def check_notifications(self):
-        if not self.running:
-            # don't bother checking if we're not running
+        changed = self.notify_queue.take()
+        if not changed:
             return
 
-        self.notify_queue, changed = set(), self.notify_queue
+        with tracing.span('notifications', count=len(changed)):
+            for conversion in changed:
+                if conversion.status in ('canceled', 'finished', 'failed'):
+                    self.conversion_finished(conversion)
+                elif conversion.status == 'staging':
+                    self.conversion_staged(conversion)
+                for listener in list(conversion.listeners):
+                    listener(conversion)
+            self.notify_queue.dispatch(changed)
+
+    def estimate_finish_times(self, pending=()):
+        """Predict when each conversion in the queue will be done.
 
-        for conversion in changed:
-            if conversion.status in ('canceled', 'finished', 'failed'):
-                self.conversion_finished(conversion)
-            for listener in conversion.listeners:
-                listener(conversion)
+        :param pending: conversions that haven't been passed to
+        run_conversion() yet, but will be queued after everything else.
+
+        :returns: dict mapping conversions to the seconds from now until they
+        finish, or None if we can't tell.
+        """
+        queued = list(self.waiting)
+        waiting = set(queued)
+        queued.extend(c for c in pending
+                      if c.status == 'initialized' and c not in waiting)
+        return schedule_finish_times(self.in_progress, queued,
+                                     self.simultaneous,
+                                     self.throughput.predict_remaining)
+
+    def update_queue_estimates(self, pending=()):
+        """Set queue_eta on each queued conversion.
+
+        This goes through the whole queue, so callers should only call it
+        again once queue_changes has changed.
+
+        :returns: seconds until the whole queue is finished, or None if we
+        can't tell.
+        """
+        finish_times = self.estimate_finish_times(pending)
+        for conversion, finish in finish_times.items():
+            conversion.queue_eta = finish
+        if not finish_times or None in finish_times.values():
+            return None
+        return max(finish_times.values())
+
+    def conversion_staged(self, conversion):
+        if conversion not in self.in_progress:
+            return
+        self.in_progress.discard(conversion)
+        self.staging.add(conversion)
+        self.queue_changes += 1
+        self._start_waiting()
 
     def conversion_finished(self, conversion):
         self.in_progress.discard(conversion)
-        while (self.waiting and self.simultaneous is not None and
-               len(self.in_progress) < self.simultaneous):
-            c = self.waiting.popleft()
-            self._start_conversion(c)
-        if not self.in_progress:
+        self.staging.discard(conversion)
+        self.paused.discard(conversion)
+        if conversion in self.waiting:
+            # stopped while it was preempted
+            self.waiting.remove(conversion)
+        self.queue_changes += 1
+        self._start_waiting()
+        if not self.in_progress and not self.staging and not self.paused:
             self.running = False
+
+    def _start_waiting(self):
+        while self.waiting and (self.simultaneous is None or
+                                len(self.in_progress) < self.simultaneous):
+            c = self.waiting[0]
+            if c.status == 'paused':
+                # it already has its space
+                reason = None
+            else:
+                reason = self.check_space(c)
+            if reason is None:
+                self.waiting.popleft()
+                self.queue_changes += 1
+                c.waiting_reason = None
+                if c.status == 'paused':
+                    self._resume_conversion(c)
+                else:
+                    self._start_conversion(c)
+            elif self.in_progress or self.staging:
+                # the space may be there once the running conversions are
+                # done, keep the queue in order until then
+                if c.waiting_reason != reason:
+                    c.waiting_reason = reason
+                    c.notify_listeners()
+                break
+            else:
+                # nothing is going to free up space, don't wait forever
+                self.waiting.popleft()
+                self.queue_changes += 1
+                c.waiting_reason = None
+                c.error = reason
+                c.finalize()
+
+    def get_space_needed(self, conversion):
+        """Estimate the disk space conversion still needs.
+
+        Conversions that are running only need room for the part of their
+        output that they haven't written yet.
+
+        :returns: dict mapping filesystem ids to (directory, bytes) tuples
+        """
+        size = conversion.estimate_output_size()
+        if not size:
+            return {}
+        size = int(size * SPACE_MARGIN)
+        output_dir = os.path.dirname(conversion.output)
+        if conversion.temp_output is not None:
+            temp_dir = os.path.dirname(conversion.temp_output)
+        elif (self.scratch_dir is not None and
+              not conversion.converter.segmented):
+            temp_dir = self.scratch_dir
+        else:
+            temp_dir = output_dir
+        needed = {}
+        def add(directory, nbytes):
+            fs_id = get_filesystem_id(directory)
+            total = needed.get(fs_id, (directory, 0))[1] + nbytes
+            needed[fs_id] = (directory, total)
+        if conversion.status != 'staging':
+            add(temp_dir, max(size - (conversion.output_size or 0), 0))
+        if temp_dir != output_dir or conversion.converter.rewrites_output():
+            # finalize() writes a second copy
+            add(output_dir, size)
+        return needed
+
+    def check_space(self, conversion):
+        """Check that there's room to run conversion.
+
+        Space that running conversions still need is counted as used.
+
+        :returns: None if conversion can start, otherwise a string saying
+        why it can't
+        """
+        needed = self.get_space_needed(conversion)
+        if not needed:
+            return None
+        reserved = collections.defaultdict(int)
+        for c in self.in_progress | self.staging | self.paused:
+            if c is conversion:
+                continue
+            for fs_id, (directory, nbytes) in self.get_space_needed(c).items():
+                reserved[fs_id] += nbytes
+        for fs_id, (directory, nbytes) in needed.items():
+            available = get_available_space(directory)
+            if available is None:
+                continue
+            free = available - reserved[fs_id] - MIN_FREE_SPACE
+            if nbytes > free:
+                return 'not enough disk space in %s (need %s, %s free)' % (
+                    directory, size_string(nbytes),
+                    size_string(free) if free > 0 else '0 B')
+        return None
+
+
+def summarize_stats(conversions):
+    """Sum up the resource accounting of a batch of conversions.
+
+    :param conversions: iterable of Conversion objects
+    :returns: dict with totals for the whole batch and, under the
+    "converters" key, the same totals for each converter
+    """
+    def new_totals():
+        return {'conversions': 0, 'failed': 0, 'wall_time': 0.0,
+                'cpu_time': 0.0, 'max_rss': 0, 'frames': 0,
+                'encode_time': 0.0, 'input_bytes': 0, 'output_bytes': 0}
+
+    def add(totals, stats):
+        totals['conversions'] += 1
+        if stats['status'] != 'finished':
+            totals['failed'] += 1
+        totals['wall_time'] += stats['wall_time'] or 0.0
+        totals['cpu_time'] += ((stats['cpu_user'] or 0.0) +
+                               (stats['cpu_system'] or 0.0))
+        totals['max_rss'] = max(totals['max_rss'], stats['max_rss'] or 0)
+        if stats['frames'] and stats['phases'].get('encode'):
+            totals['frames'] += stats['frames']
+            totals['encode_time'] += stats['phases']['encode']
+        if stats['output_bytes'] is not None and stats['input_bytes']:
+            totals['input_bytes'] += stats['input_bytes']
+            totals['output_bytes'] += stats['output_bytes']
+
+    def finish(totals):
+        encode_time = totals.pop('encode_time')
+        frames = totals['frames']
+        totals['fps'] = frames / encode_time if encode_time else None
+        if totals['input_bytes']:
+            totals['compression_ratio'] = (float(totals['output_bytes']) /
+                                           totals['input_bytes'])
+        else:
+            totals['compression_ratio'] = None
+        return totals
+
+    summary = new_totals()
+    per_converter = {}
+    for conversion in conversions:
+        stats = conversion.get_stats()
+        add(summary, stats)
+        add(per_converter.setdefault(stats['converter'], new_totals()), stats)
+    summary = finish(summary)
+    summary['converters'] = dict((identifier, finish(totals))
+                                 for identifier, totals
+                                 in per_converter.items())
+    return summary
@@ -14,6 +14,13 @@ logger = logging.getLogger(__name__)
 
 NON_WORD_CHARS = re.compile(r"[^a-zA-Z0-9]+")
 
+# output extensions for containers that support the faststart muxer flag
+FASTSTART_EXTENSIONS = ('mp4', 'm4v', 'mov')
+
+# muxers that need to write fragments to send their output to a pipe.  The
+# others we use (webm, matroska, mp3, ogg) write their output in order.
+FRAGMENTED_MUXERS = ('mp4', 'mov', 'ipod')
+
 class ConverterInfo(object):
     """Describes a particular output converter
 
@@ -28,11 +35,15 @@ class ConverterInfo(object):
     :attribute height: output height for this converter.  Works just like
     width
     :attribute dont_upsize: should we allow upsizing for conversions? 
+    :attribute segmented: does the converter write a directory of segments
+    and playlists, rather than a single file?  Segmented output is written
+    straight to its destination, so it can be played while it's converting.
     """
     media_type = None
     bitrate = None
     extension = None
     audio_only = False
+    segmented = False
 
     def __init__(self, name, width=None, height=None, dont_upsize=True):
         self.name = name
@@ -47,6 +58,28 @@ class ConverterInfo(object):
     def get_arguments(self, video, output):
         raise NotImplementedError
 
+    def get_stream_arguments(self, video, input_path=None):
+        """Get the arguments to convert a video and write the output to
+        stdout.
+
+        :param input_path: file to read, or None to read from stdin
+        :raises ValueError: if this converter can't write to a pipe
+        """
+        raise ValueError("%s can't write to a pipe" % (self.name,))
+
+    def get_sample_arguments(self, video, output, start, length):
+        """Get the arguments to convert part of a video.
+
+        mvc.preflight converts a few of these samples to estimate the size
+        and encode time of the whole conversion.
+
+        :param start: seconds into the video to start the sample at
+        :param length: seconds of the video to convert
+        :raises NotImplementedError: if this converter can't convert part of
+        a video
+        """
+        raise NotImplementedError
+
     def get_output_filename(self, video):
         basename = os.path.basename(video.filename)
         name, ext = os.path.splitext(basename)
@@ -61,10 +94,24 @@ class ConverterInfo(object):
         if video.duration:
             return self.bitrate * video.duration / 8
 
+    def muxer_faststart(self):
+        """Does the converter write the moov atom at the start of the file
+        itself?
+        """
+        return False
+
+    def rewrites_output(self):
+        """Does finalize() write a new copy of the output?
+
+        If not, it just moves the file into place.
+        """
+        return (self.media_type == 'format' and self.extension == 'mp4' and
+                not self.muxer_faststart())
+
     def finalize(self, temp_output, output):
         err = None
         needs_remove = False
-        if self.media_type == 'format' and self.extension == 'mp4':
+        if self.rewrites_output():
             needs_remove = True
             logging.debug('generic mp4 format detected.  '
                           'Running qtfaststart...')
@@ -115,20 +162,105 @@ class FFmpegConverterInfo(ConverterInfo):
     """
     DURATION_RE = re.compile(r'\W*Duration: (\d\d):(\d\d):(\d\d)\.(\d\d)'
                              '(, start:.*)?(, bitrate:.*)?')
-    PROGRESS_RE = re.compile(r'(?:frame=.* fps=.* q=.* )?size=.* time=(.*) '
-                             'bitrate=(.*)')
-    LAST_PROGRESS_RE = re.compile(r'frame=.* fps=.* q=.* Lsize=.* time=(.*) '
-                                  'bitrate=(.*)')
+    PROGRESS_RE = re.compile(r'(?:frame=\s*(?P<frame>\d+) fps=.* q=.* )?'
+                             r'size=\s*(?:(?P<size>\d+)\s*[kK]i?B|\S*)\s+'
+                             r'time=(?P<time>.*) bitrate=(.*)')
+    LAST_PROGRESS_RE = re.compile(r'frame=\s*(?P<frame>\d+) fps=.* q=.* '
+                                  r'Lsize=\s*(?:(?P<size>\d+)\s*[kK]i?B|\S*)'
+                                  r'\s+time=(.*) bitrate=(.*)')
 
     extension = None
     parameters = None
 
+    # bitrate to assume for audio when the parameters don't set one
+    DEFAULT_AUDIO_BITRATE = 128000
+
     def get_executable(self):
         return settings.get_ffmpeg_executable_path()
 
+    def get_output_size_guess(self, video):
+        """Guess the output size from the bitrates in our parameters.
+
+        Converters that use a constant quality setting (-crf, -aq) rather
+        than a bitrate can't be guessed, and None is returned.
+        """
+        size = ConverterInfo.get_output_size_guess(self, video)
+        if size is not None or not video.duration:
+            return size
+        try:
+            params = self.get_parameters(video)
+        except ValueError:
+            return None
+        audio_bitrate = self._find_bitrate(params, ('-b:a', '-ab'))
+        if audio_bitrate is None:
+            audio_bitrate = self.DEFAULT_AUDIO_BITRATE
+        if self.audio_only or video.audio_only:
+            video_bitrate = 0
+        else:
+            video_bitrate = self._find_bitrate(params, ('-b:v', '-b', '-vb'))
+            if video_bitrate is None:
+                # the limit is better than nothing
+                video_bitrate = self._find_bitrate(params, ('-maxrate',))
+            if video_bitrate is None:
+                return None
+        return (video_bitrate + audio_bitrate) * video.duration / 8
+
+    @staticmethod
+    def _find_bitrate(params, options):
+        for index, param in enumerate(params[:-1]):
+            if param in options:
+                bitrate = utils.parse_bitrate(params[index + 1])
+                if bitrate is not None:
+                    return bitrate
+        return None
+
     def get_arguments(self, video, output):
-        args = ['-i', utils.convert_path_for_subprocess(video.filename),
-                 '-strict', 'experimental']
+        args = self._get_conversion_arguments(
+            video, utils.convert_path_for_subprocess(video.filename), output)
+        if self.muxer_faststart():
+            args.extend(['-movflags', '+faststart'])
+	args.append(self.convert_output_path(output))
+        return args
+
+    def get_stream_arguments(self, video, input_path=None):
+        """Get the arguments to convert a video and write the output to
+        stdout.
+
+        MP4 and MOV outputs are written as fragmented MP4, since the moov
+        atom can't be put back at the start of a pipe.
+
+        :param input_path: file to read, or None to read from stdin
+        :raises ValueError: if our parameters don't name an output format
+        """
+        if input_path is None:
+            input_path = 'pipe:0'
+        else:
+            input_path = utils.convert_path_for_subprocess(input_path)
+        args = self._get_conversion_arguments(video, input_path, '-')
+        # ffmpeg can't guess the format from the output filename
+        output_format = None
+        for index, arg in enumerate(args[:-1]):
+            if arg == '-f':
+                output_format = args[index + 1]
+        if output_format is None:
+            raise ValueError("%s: no output format" % (self.name,))
+        if output_format in FRAGMENTED_MUXERS:
+            args.extend(['-movflags', 'frag_keyframe+empty_moov'])
+        args.append('pipe:1')
+        return args
+
+    def get_sample_arguments(self, video, output, start, length):
+        # -ss before -i seeks the input, which is quick
+        args = ['-ss', '%.3f' % (start,)]
+        args.extend(self._get_conversion_arguments(
+            video, utils.convert_path_for_subprocess(video.filename), output))
+        args.extend(['-t', '%.3f' % (length,)])
+        args.append(self.convert_output_path(output))
+        return args
+
+    def _get_conversion_arguments(self, video, input_path, output):
+        """Get the arguments up to the output options."""
+        args = ['-i', input_path, '-strict', 'experimental']
         args.extend(settings.customize_ffmpeg_parameters(
             self.get_parameters(video)))
         if not (self.audio_only or video.audio_only):
@@ -136,9 +268,12 @@ class FFmpegConverterInfo(ConverterInfo):
             args.append("-s")
             args.append('%ix%i' % (width, height))
         args.extend(self.get_extra_arguments(video, output))
-	args.append(self.convert_output_path(output))
         return args
 
+    def muxer_faststart(self):
+        return (self.extension in FASTSTART_EXTENSIONS and
+                settings.ffmpeg_supports_faststart())
+
     def convert_output_path(self, output_path):
 	"""Convert our output path so that it can be passed to ffmpeg."""
 	# this is a bit tricky, because output_path doesn't exist on windows
@@ -187,16 +322,142 @@ class FFmpegConverterInfo(ConverterInfo):
 
         match = klass.PROGRESS_RE.match(line)
         if match is not None:
-            t = match.group(1)
+            t = match.group('time')
             if ':' in t:
                 hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
-                return {'progress': hms_to_seconds(hours, minutes, seconds)}
+                status = {'progress': hms_to_seconds(hours, minutes, seconds)}
             else:
-                return {'progress': float(t)}
+                status = {'progress': float(t)}
+            if match.group('frame') is not None:
+                status['frame'] = int(match.group('frame'))
+            if match.group('size') is not None:
+                # ffmpeg reports the output size so far in kilobytes
+                status['size'] = int(match.group('size')) * 1024
+            return status
 
         match = klass.LAST_PROGRESS_RE.match(line)
         if match is not None:
-            return {'finished': True}
+            status = {'finished': True, 'frame': int(match.group('frame'))}
+            if match.group('size') is not None:
+                status['size'] = int(match.group('size')) * 1024
+            return status
+
+class SegmentedConverterInfo(FFmpegConverterInfo):
+    """Base class for adaptive streaming (HLS, DASH) converters.
+
+    The input is decoded once and scaled to each rendition in the ladder
+    that isn't bigger than the input.  The output is a directory with the
+    segments and playlists for all the renditions, which ffmpeg updates as
+    each segment is finished.
+
+    Subclasses must implement get_muxer_arguments().
+    """
+    media_type = 'format'
+    segmented = True
+    # (width, height, video bitrate) for each rendition, smallest first
+    ladder = (
+        (640, 360, 800000),
+        (854, 480, 1400000),
+        (1280, 720, 2800000),
+        (1920, 1080, 5000000),
+    )
+    audio_bitrate = 128000
+    # seconds per segment.  Players can start once the first segment of
+    # each rendition is written.
+    segment_duration = 4
+    # one audio stream per rendition, or a single one shared by all of them
+    audio_per_rendition = False
+
+    def get_output_filename(self, video):
+        name = os.path.splitext(os.path.basename(video.filename))[0]
+        return '%s.%s' % (name, self.identifier)
+
+    def get_renditions(self, video):
+        """Get the renditions to make for a video.
+
+        Ladder steps that would be bigger than the input are left out, but
+        there's always at least one rendition.
+
+        :returns: list of (width, height, bitrate) tuples, largest first
+        """
+        if self.audio_only or video.audio_only:
+            return []
+        renditions = []
+        for width, height, bitrate in self.ladder:
+            size = utils.rescale_video((video.width, video.height),
+                                       (width, height), dont_upsize=True)
+            if size not in [r[:2] for r in renditions]:
+                renditions.append(size + (bitrate,))
+        renditions.reverse()
+        return renditions
+
+    def get_output_size_guess(self, video):
+        if not video.duration:
+            return None
+        renditions = self.get_renditions(video)
+        if self.audio_per_rendition:
+            audio_streams = max(len(renditions), 1)
+        else:
+            audio_streams = 1
+        bitrate = (sum(r[2] for r in renditions) +
+                   audio_streams * self.audio_bitrate)
+        return bitrate * video.duration / 8
+
+    def get_arguments(self, video, output):
+        args = ['-i', utils.convert_path_for_subprocess(video.filename),
+                '-strict', 'experimental']
+        renditions = self.get_renditions(video)
+        if renditions:
+            # decode and split once, then scale each copy
+            outputs = ''.join('[v%i]' % i for i in range(len(renditions)))
+            scales = ';'.join('[v%i]scale=%i:%i[v%iout]' % (i, w, h, i)
+                              for i, (w, h, bitrate)
+                              in enumerate(renditions))
+            args.extend(['-filter_complex', '[0:v]split=%i%s;%s' % (
+                        len(renditions), outputs, scales)])
+            for i, (width, height, bitrate) in enumerate(renditions):
+                args.extend(['-map', '[v%iout]' % i,
+                             '-c:v:%i' % i, 'libx264',
+                             '-b:v:%i' % i, str(bitrate),
+                             '-maxrate:v:%i' % i, str(bitrate),
+                             '-bufsize:v:%i' % i, str(bitrate * 2)])
+            # keyframes on segment boundaries in every rendition, so that
+            # players can switch between them
+            args.extend(['-preset', 'fast', '-pix_fmt', 'yuv420p',
+                         '-sc_threshold', '0',
+                         '-force_key_frames', 'expr:gte(t,n_forced*%i)' % (
+                        self.segment_duration,)])
+        has_audio = video.audio_codec is not None
+        if has_audio:
+            if self.audio_per_rendition:
+                audio_streams = max(len(renditions), 1)
+            else:
+                audio_streams = 1
+            for i in range(audio_streams):
+                args.extend(['-map', '0:a:0'])
+            args.extend(['-c:a', 'aac', '-b:a', str(self.audio_bitrate),
+                         '-ac', '2'])
+        args.extend(self.get_muxer_arguments(video, len(renditions),
+                                             has_audio, output))
+        return args
+
+    def get_muxer_arguments(self, video, video_streams, has_audio, output):
+        """Get the arguments for the segmenting muxer, ending with the
+        path of the playlist.
+
+        :param video_streams: number of video renditions
+        :param has_audio: is there audio?
+        :param output: the output directory
+        """
+        raise NotImplementedError()
+
+    def get_stream_arguments(self, video, input_path=None):
+        raise ValueError("%s writes a directory, not a stream" % (self.name,))
+
+    def get_sample_arguments(self, video, output, start, length):
+        # the segments and playlists would need their own directory; the
+        # size guess from the ladder's bitrates is used instead
+        raise NotImplementedError
 
 class FFmpegConverterInfo1080p(FFmpegConverterInfo):
     def __init__(self, name):
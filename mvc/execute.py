@@ -3,10 +3,20 @@
 mvc.execute wraps the standard subprocess module in for MVC.
 """
 
+import ctypes
+import ctypes.util
+import errno
+import glob
+import logging
+import multiprocessing
 import os
+import platform
+import signal
 import subprocess
 import sys
 
+logger = logging.getLogger(__name__)
+
 CalledProcessError = subprocess.CalledProcessError
 
 def default_popen_args():
@@ -31,12 +41,53 @@ class Popen(subprocess.Popen):
 
     These are just defaults though, they can be overriden by passing different
     values to the constructor
+
+    On platforms that support it, wait() also collects the resource usage of
+    the child process and stores it in the rusage attribute.
     """
+    rusage = None
+
     def __init__(self, commandline, **kwargs):
         final_args = default_popen_args()
         final_args.update(kwargs)
         subprocess.Popen.__init__(self, commandline, **final_args)
 
+    def suspend(self):
+        """Stop the process from running until resume() is called."""
+        if sys.platform == 'win32':
+            ctypes.windll.ntdll.NtSuspendProcess(int(self._handle))
+        else:
+            self.send_signal(signal.SIGSTOP)
+
+    def resume(self):
+        """Continue a process stopped with suspend()."""
+        if sys.platform == 'win32':
+            ctypes.windll.ntdll.NtResumeProcess(int(self._handle))
+        else:
+            self.send_signal(signal.SIGCONT)
+
+    def wait(self):
+        if not hasattr(os, 'wait4'):
+            return subprocess.Popen.wait(self)
+        while self.returncode is None:
+            try:
+                pid, sts, rusage = os.wait4(self.pid, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                # someone else reaped the child.  If that was another call
+                # on this object, keep the status it recorded, otherwise we
+                # can't get the status and use 0 like subprocess does.
+                if self.returncode is None:
+                    self.returncode = 0
+                break
+            if pid == self.pid:
+                self.rusage = rusage
+                self._handle_exitstatus(sts)
+        return self.returncode
+
 def check_output(commandline, **kwargs):
     """MVC version of subprocess.check_output.
 
@@ -47,3 +98,160 @@ def check_output(commandline, **kwargs):
     del final_args['stdout']
     final_args.update(kwargs)
     return subprocess.check_output(commandline, **final_args)
+
+# I/O scheduling classes for ioprio_set(), see ionice(1)
+IO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# ioprio_set() has no wrapper in libc, so we call it by syscall number
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+
+_libc = []
+def get_libc():
+    """Get the C library, or None if we can't load it."""
+    if not _libc:
+        try:
+            _libc.append(ctypes.CDLL(ctypes.util.find_library('c'),
+                                     use_errno=True))
+        except OSError:
+            logger.warn("can't load libc", exc_info=True)
+            _libc.append(None)
+    return _libc[0]
+
+PRIO_PROCESS = 0
+
+def set_priority(pid, nice=None, io_class=None, io_level=4, cpus=None):
+    """Set the priority of a process we've started.
+
+    This is called from the parent right after the process starts.  Doing
+    it in the child, between fork() and exec(), isn't safe in a
+    multithreaded program like ours: the child only has the forking
+    thread, and calling into ctypes there can deadlock on a lock that
+    another thread held at the time of the fork.
+
+    On linux these settings are per thread, so they're applied to every
+    thread the process has started so far; threads it starts later inherit
+    them.  Settings that the platform doesn't support are ignored.  Only
+    nice works outside of linux.  Failures are logged, since the process is
+    already running.
+
+    :param pid: process ID
+    :param nice: amount to add to the process's nice level
+    :param io_class: I/O scheduling class, one of the keys of IO_CLASSES
+    :param io_level: priority within the I/O class, 0 (highest) to 7
+    :param cpus: list of CPU numbers to run the process on
+    """
+    if sys.platform == 'win32' or not (nice or io_class is not None or cpus):
+        return
+    libc = get_libc()
+    if libc is None:
+        return
+    if sys.platform.startswith('linux'):
+        try:
+            tids = [int(tid) for tid in os.listdir('/proc/%i/task' % pid)]
+        except EnvironmentError:
+            return # it's already gone
+    else:
+        tids = [pid]
+    steps = []
+    if nice:
+        # the child starts with our nice level
+        priority = os.nice(0) + nice
+        steps.append(('setpriority', lambda tid: libc.setpriority(
+                    PRIO_PROCESS, tid, priority)))
+    if sys.platform.startswith('linux'):
+        if io_class is not None:
+            steps.append(_make_ioprio_setter(libc, io_class, io_level))
+        if cpus:
+            steps.append(_make_affinity_setter(libc, cpus))
+    for step in steps:
+        if step is None:
+            continue
+        name, func = step
+        for tid in tids:
+            if func(tid) != 0:
+                error = ctypes.get_errno()
+                if error != errno.ESRCH: # the thread already exited
+                    logger.warn('%s for %i failed: %s', name, tid,
+                                os.strerror(error))
+
+def _make_ioprio_setter(libc, io_class, io_level):
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall_number is None:
+        logger.warn("can't set I/O priority on %s", platform.machine())
+        return None
+    if io_class == 'idle':
+        io_level = 0 # the idle class doesn't have levels
+    ioprio = (IO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT) | io_level
+    return ('ioprio_set', lambda tid: libc.syscall(
+            syscall_number, IOPRIO_WHO_PROCESS, tid, ioprio))
+
+def _make_affinity_setter(libc, cpus):
+    bits = ctypes.sizeof(ctypes.c_ulong) * 8
+    mask = (ctypes.c_ulong * (max(cpus) // bits + 1))()
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    return ('sched_setaffinity', lambda tid: libc.sched_setaffinity(
+            tid, ctypes.sizeof(mask), mask))
+
+def parse_cpu_list(text):
+    """Parse a CPU list in the kernel's format, like "0-3,8,10-11".
+
+    :returns: list of CPU numbers
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def get_available_cpus():
+    """Get the CPUs that we're allowed to run on.
+
+    On linux, the CPUs are ordered by NUMA node, so that neighbouring CPUs in
+    the list share memory.
+    """
+    cpus = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Cpus_allowed_list:'):
+                    cpus = parse_cpu_list(line.split(':', 1)[1])
+    except EnvironmentError:
+        pass
+    if not cpus:
+        try:
+            return range(multiprocessing.cpu_count())
+        except NotImplementedError:
+            return []
+    node_for_cpu = {}
+    for path in glob.glob('/sys/devices/system/node/node*/cpulist'):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        try:
+            with open(path) as f:
+                for cpu in parse_cpu_list(f.read()):
+                    node_for_cpu[cpu] = node
+        except (EnvironmentError, ValueError):
+            pass
+    return sorted(cpus, key=lambda cpu: (node_for_cpu.get(cpu, 0), cpu))
+
+def split_cpus(cpus, count):
+    """Split a list of CPUs into count disjoint groups.
+
+    The groups are contiguous runs of cpus, and differ in size by at most
+    one.  If there are fewer CPUs than groups, some groups are empty.
+    """
+    return [cpus[i * len(cpus) // count:(i + 1) * len(cpus) // count]
+            for i in range(count)]
@@ -0,0 +1,404 @@
+"""jobqueue.py -- shared queues of conversion jobs.
+
+A coordinator submits job descriptions (see
+Conversion.get_job_description()) to a JobQueue, and workers on other
+machines claim them, run them and report back.  All that the machines share
+is the queue, plus the filesystem the input and output files are on.
+
+There are two backends:
+  - DirectoryJobQueue keeps each job in a JSON file and claims jobs by
+    renaming them, which is atomic on local filesystems and NFS.
+  - SQLiteJobQueue keeps jobs in an SQLite database.  Only use it on
+    filesystems where SQLite's locking works.
+"""
+
+import errno
+import glob
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class JobQueue(object):
+    """Base class for job queues.
+
+    Jobs are dicts that can be serialized to JSON, with a unique 'id' key.
+    Jobs with a higher 'priority' are claimed first, otherwise they're
+    claimed in the order they were submitted.
+
+    A job is in one of 3 states: 'pending', 'claimed' by a worker, or
+    'done'.  Workers attach reports to the jobs they've claimed (see
+    Conversion.get_report()).
+    """
+
+    def submit(self, job):
+        raise NotImplementedError()
+
+    def claim(self, worker_id):
+        """Claim the next pending job.
+
+        If several workers call this at once, each job is only given to one
+        of them.
+
+        :returns: job dict, or None if there are no pending jobs
+        """
+        raise NotImplementedError()
+
+    def update(self, job_id, report):
+        """Store the latest report for a claimed job.
+
+        This also tells the queue that the worker is still alive.
+        """
+        raise NotImplementedError()
+
+    def complete(self, job_id, report):
+        """Mark a job as done, with its final report."""
+        raise NotImplementedError()
+
+    def get(self, job_id):
+        """Get the state of a job.
+
+        :returns: dict with the keys 'state', 'worker', 'report' and
+        'updated_at', or None if there's no such job.
+        """
+        raise NotImplementedError()
+
+    def cancel(self, job_id):
+        """Cancel a job.
+
+        Pending jobs are marked as done right away.  For claimed jobs, the
+        worker sees is_canceled() return True the next time it checks.
+        """
+        raise NotImplementedError()
+
+    def is_canceled(self, job_id):
+        raise NotImplementedError()
+
+    def requeue_stale(self, timeout):
+        """Put claimed jobs whose worker hasn't sent an update in timeout
+        seconds back in the queue.
+
+        :returns: list of the ids of the requeued jobs
+        """
+        raise NotImplementedError()
+
+def canceled_report():
+    return {'status': 'canceled', 'error': 'manually stopped'}
+
+class DirectoryJobQueue(JobQueue):
+    """Job queue kept in a directory.
+
+    Layout:
+      pending/<key>.json -- jobs waiting for a worker.  Keys sort in the
+        order jobs should be claimed, and end in the job id.
+      claimed/<key>.json -- jobs a worker is running.  The file's mtime
+        is when it was claimed.
+      status/<id>.json -- worker and latest report for claimed jobs
+      done/<id>.json -- final state of finished jobs
+      cancel/<id> -- exists if a claimed job should be canceled
+    """
+    SUBDIRECTORIES = ('pending', 'claimed', 'status', 'done', 'cancel')
+
+    def __init__(self, path):
+        self.path = path
+        for name in self.SUBDIRECTORIES:
+            directory = os.path.join(path, name)
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def _write_json(self, path, data):
+        # write to a temp file and rename, so readers never see a partial
+        # file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path) # rename() doesn't replace on windows
+        os.rename(temp_path, path)
+
+    def _read_json(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except EnvironmentError:
+            return None
+        except ValueError:
+            logger.warn('ignoring corrupt job file %r', path)
+            return None
+
+    def _find(self, state, job_id):
+        paths = glob.glob(self._path(state, '*-%s.json' % (job_id,)))
+        if paths:
+            return paths[0]
+        return None
+
+    def submit(self, job):
+        # higher priorities sort first
+        priority = 500000 - max(min(job.get('priority', 0), 499999), -499999)
+        key = '%06d-%017.6f-%s' % (priority, time.time(), job['id'])
+        self._write_json(self._path('pending', key + '.json'), job)
+
+    def claim(self, worker_id):
+        for name in sorted(os.listdir(self._path('pending'))):
+            if name.startswith('.'):
+                continue
+            pending_path = self._path('pending', name)
+            claimed_path = self._path('claimed', name)
+            try:
+                # the status file is written after the rename, so until
+                # then requeue_stale() goes by the mtime
+                os.utime(pending_path, None)
+                os.rename(pending_path, claimed_path)
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue # another worker got it first
+                raise
+            job = self._read_json(claimed_path)
+            if job is None:
+                os.remove(claimed_path)
+                continue
+            self._write_json(self._path('status', job['id'] + '.json'),
+                             {'worker': worker_id, 'report': None,
+                              'updated_at': time.time()})
+            return job
+        return None
+
+    def update(self, job_id, report):
+        path = self._path('status', job_id + '.json')
+        status = self._read_json(path) or {}
+        status['report'] = report
+        status['updated_at'] = time.time()
+        self._write_json(path, status)
+
+    def complete(self, job_id, report):
+        status = self._read_json(self._path('status', job_id + '.json'))
+        worker = status.get('worker') if status else None
+        self._write_json(self._path('done', job_id + '.json'),
+                         {'worker': worker, 'report': report,
+                          'updated_at': time.time()})
+        for path in (self._find('claimed', job_id),
+                     self._path('status', job_id + '.json'),
+                     self._path('cancel', job_id)):
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def get(self, job_id):
+        done = self._read_json(self._path('done', job_id + '.json'))
+        if done is not None:
+            done['state'] = 'done'
+            return done
+        if self._find('claimed', job_id) is not None:
+            status = self._read_json(
+                self._path('status', job_id + '.json')) or {}
+            status['state'] = 'claimed'
+            status.setdefault('worker', None)
+            status.setdefault('report', None)
+            status.setdefault('updated_at', None)
+            return status
+        if self._find('pending', job_id) is not None:
+            return {'state': 'pending', 'worker': None, 'report': None,
+                    'updated_at': None}
+        return None
+
+    def cancel(self, job_id):
+        pending_path = self._find('pending', job_id)
+        if pending_path is not None:
+            try:
+                os.remove(pending_path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                self._write_json(self._path('done', job_id + '.json'),
+                                 {'worker': None,
+                                  'report': canceled_report(),
+                                  'updated_at': time.time()})
+                return
+        open(self._path('cancel', job_id), 'w').close()
+
+    def is_canceled(self, job_id):
+        return os.path.exists(self._path('cancel', job_id))
+
+    def requeue_stale(self, timeout):
+        requeued = []
+        now = time.time()
+        for name in os.listdir(self._path('claimed')):
+            if name.startswith('.'):
+                continue
+            job_id = name[:-len('.json')].rsplit('-', 1)[1]
+            status_path = self._path('status', job_id + '.json')
+            status = self._read_json(status_path)
+            if status is not None:
+                updated_at = status['updated_at']
+            else:
+                # just claimed, and the worker hasn't written the status
+                # yet
+                try:
+                    updated_at = os.path.getmtime(
+                        self._path('claimed', name))
+                except OSError:
+                    continue # finished in the meantime
+            if now - updated_at < timeout:
+                continue
+            logger.warn('requeueing job %s from worker %s', job_id,
+                        status.get('worker') if status else None)
+            try:
+                os.rename(self._path('claimed', name),
+                          self._path('pending', name))
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue # finished in the meantime
+                raise
+            try:
+                os.remove(status_path)
+            except OSError:
+                pass
+            requeued.append(job_id)
+        return requeued
+
+class SQLiteJobQueue(JobQueue):
+    """Job queue kept in an SQLite database."""
+    SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    created REAL NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    job TEXT NOT NULL,
+    report TEXT,
+    updated REAL,
+    cancel INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, priority, created);
+"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # we handle transactions ourselves, see _transaction()
+        self.connection = sqlite3.connect(path, timeout=60,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+
+    def _transaction(self, func, *args):
+        with self.lock:
+            cursor = self.connection.cursor()
+            # take the write lock right away, so that two workers can't
+            # select the same pending job
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                rv = func(cursor, *args)
+            except:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            return rv
+
+    def submit(self, job):
+        def submit(cursor):
+            cursor.execute('INSERT INTO jobs (id, priority, created, state, '
+                           'job) VALUES (?, ?, ?, ?, ?)',
+                           (job['id'], job.get('priority', 0), time.time(),
+                            'pending', json.dumps(job)))
+        self._transaction(submit)
+
+    def claim(self, worker_id):
+        def claim(cursor):
+            cursor.execute('SELECT id, job FROM jobs WHERE state = ? '
+                           'ORDER BY priority DESC, created LIMIT 1',
+                           ('pending',))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute('UPDATE jobs SET state = ?, worker = ?, '
+                           'updated = ? WHERE id = ?',
+                           ('claimed', worker_id, time.time(), row[0]))
+            return json.loads(row[1])
+        return self._transaction(claim)
+
+    def update(self, job_id, report):
+        def update(cursor):
+            cursor.execute('UPDATE jobs SET report = ?, updated = ? '
+                           'WHERE id = ?',
+                           (json.dumps(report), time.time(), job_id))
+        self._transaction(update)
+
+    def complete(self, job_id, report):
+        def complete(cursor):
+            cursor.execute('UPDATE jobs SET state = ?, report = ?, '
+                           'updated = ? WHERE id = ?',
+                           ('done', json.dumps(report), time.time(), job_id))
+        self._transaction(complete)
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT state, worker, report, updated FROM jobs '
+                'WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        state, worker, report, updated = row
+        if report is not None:
+            report = json.loads(report)
+        return {'state': state, 'worker': worker, 'report': report,
+                'updated_at': updated}
+
+    def cancel(self, job_id):
+        def cancel(cursor):
+            cursor.execute('UPDATE jobs SET state = ?, report = ?, '
+                           'updated = ? WHERE id = ? AND state = ?',
+                           ('done', json.dumps(canceled_report()),
+                            time.time(), job_id, 'pending'))
+            cursor.execute('UPDATE jobs SET cancel = 1 WHERE id = ?',
+                           (job_id,))
+        self._transaction(cancel)
+
+    def is_canceled(self, job_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT cancel FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def requeue_stale(self, timeout):
+        def requeue(cursor):
+            cursor.execute('SELECT id, worker FROM jobs WHERE state = ? '
+                           'AND updated < ?',
+                           ('claimed', time.time() - timeout))
+            rows = cursor.fetchall()
+            for job_id, worker in rows:
+                logger.warn('requeueing job %s from worker %s', job_id,
+                            worker)
+                cursor.execute('UPDATE jobs SET state = ?, worker = NULL, '
+                               'report = NULL WHERE id = ?',
+                               ('pending', job_id))
+            return [job_id for job_id, worker in rows]
+        return self._transaction(requeue)
+
+def open_queue(path):
+    """Open the job queue at path.
+
+    Paths ending in .db or .sqlite are opened as an SQLiteJobQueue, anything
+    else as a DirectoryJobQueue.
+    """
+    if os.path.splitext(path)[1] in ('.db', '.sqlite'):
+        return SQLiteJobQueue(path)
+    return DirectoryJobQueue(path)
@@ -0,0 +1,148 @@
+"""logbuffer.py -- bounded storage for converter output.
+
+A long encode can print hundreds of thousands of progress lines.  LogBuffer
+keeps the header block (everything the converter prints before it starts
+reporting progress, which describes the input and output streams) and the
+last few lines, so that memory use doesn't grow with the length of the
+encode.  Optionally, the complete output is written to a gzip file.  That
+file is written by a thread of its own, so that the thread reading the
+converter's output never waits on the disk.  If the disk falls more than
+MAX_SPILL_QUEUED lines behind, lines are left out of the file (and a line
+saying how many is written in their place) rather than waited for.
+"""
+
+import collections
+import gzip
+import logging
+import Queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# lines waiting to be written to a spill file; beyond this, lines are dropped
+MAX_SPILL_QUEUED = 10000
+
+class LogBuffer(object):
+    """Keeps the start and end of a converter's output.
+
+    :param header_lines: maximum number of header lines to keep
+    :param tail_lines: number of lines to keep from the end of the output
+    :param spill_path: if not None, write every line to a gzip file at this
+    path
+    """
+    def __init__(self, header_lines=200, tail_lines=500, spill_path=None):
+        self.header_lines = header_lines
+        self.header = []
+        self.in_header = True
+        self.tail = collections.deque(maxlen=tail_lines)
+        # lines that aren't progress reports, for error context
+        self.messages = collections.deque(maxlen=50)
+        self.line_count = 0
+        self.spill_path = spill_path
+        self.spill_file = None
+        # lines waiting to be written to spill_file
+        self.spill_queue = None
+        self.spill_thread = None
+        # lines left out of spill_file because the queue was full
+        self.spill_dropped = 0
+        if spill_path is not None:
+            try:
+                self.spill_file = gzip.open(spill_path, 'wb')
+            except EnvironmentError:
+                logger.exception('while opening log file %r', spill_path)
+                self.spill_path = None
+            else:
+                self.spill_queue = Queue.Queue(MAX_SPILL_QUEUED)
+                self.spill_thread = threading.Thread(
+                    target=self._spill, name='LogSpill:%s' % (spill_path,))
+                self.spill_thread.setDaemon(True)
+                self.spill_thread.start()
+
+    def append(self, line, progress=False):
+        """Add a line of output.
+
+        :param progress: True if line is a progress report.  The header ends
+        at the first one.
+        """
+        self.line_count += 1
+        spill_queue = self.spill_queue
+        if spill_queue is not None:
+            try:
+                spill_queue.put_nowait(line)
+            except Queue.Full:
+                self.spill_dropped += 1
+        if progress:
+            self.in_header = False
+        else:
+            self.messages.append(line)
+        if self.in_header and len(self.header) < self.header_lines:
+            self.header.append(line)
+        else:
+            self.in_header = False
+            self.tail.append(line)
+
+    def __len__(self):
+        return len(self.header) + len(self.tail)
+
+    def get_lines(self):
+        """Get the lines we kept.
+
+        If lines were dropped between the header and the tail, a line saying
+        so is put in their place.
+        """
+        lines = list(self.header)
+        dropped = self.line_count - len(self.header) - len(self.tail)
+        if dropped:
+            lines.append('[... %i lines omitted ...]' % dropped)
+        lines.extend(self.tail)
+        return lines
+
+    def get_text(self):
+        return '\n'.join(self.get_lines())
+
+    def get_error_context(self, count=10):
+        """Get the last count lines that weren't progress reports.
+
+        These are usually what explains why a converter failed.
+        """
+        return list(self.messages)[-count:]
+
+    def _spill(self):
+        """Write lines to spill_file as they're queued, until close()."""
+        reported = 0
+        while True:
+            line = self.spill_queue.get()
+            if line is None:
+                break
+            if self.spill_file is None:
+                continue # a write failed, drop the rest
+            dropped = self.spill_dropped
+            if dropped != reported and self.spill_queue.empty():
+                # we've caught up, the dropped lines came after this one
+                line = '%s\n[... %i lines dropped ...]' % (
+                    line, dropped - reported)
+                reported = dropped
+            try:
+                self.spill_file.write(line + '\n')
+            except EnvironmentError:
+                logger.exception('while writing log file %r',
+                                 self.spill_path)
+                self._close_spill_file()
+        self._close_spill_file()
+
+    def _close_spill_file(self):
+        if self.spill_file is not None:
+            try:
+                self.spill_file.close()
+            except EnvironmentError:
+                logger.exception('while closing log file %r',
+                                 self.spill_path)
+            self.spill_file = None
+
+    def close(self):
+        """Finish writing the spill file."""
+        if self.spill_queue is not None:
+            self.spill_queue.put(None)
+            self.spill_thread.join()
+            self.spill_queue = None
+            self.spill_thread = None
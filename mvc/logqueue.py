@@ -0,0 +1,328 @@
+"""logqueue.py -- logging that never blocks the thread that logs.
+
+Conversion threads log as they read the converter's output.  When a
+handler writes to a slow disk (the rotating log file on Windows, say), a
+stall in the write stalls the thread, and with it the progress updates.
+
+Queued logging is off unless it's turned on with enable(), which the
+applications do when the MVC_LOG_QUEUE environment variable (see
+settings.get_log_queue()) or the console's --log-file or --log-json option
+is set.  Then the root logger's handlers are moved to a QueueListener
+thread, and the root logger gets a QueueHandler in their place.  A thread
+that logs only formats the record and puts it on a bounded queue; if the
+queue is full, the record is dropped and counted rather than waited for.
+
+On the way into the queue, each record gets:
+  conversion_id -- Conversion.id of the conversion that logged it, or None
+  phase -- the status of that conversion (converting, staging, ...)
+Records are tagged with the conversion whose method is running on the
+logging thread, see conversion_context().
+
+Messages that repeat are rate limited: after RATE_LIMIT_BURST records with
+the same format string from the same conversion in RATE_LIMIT_INTERVAL
+seconds, the rest are dropped until the interval is over, and the next one
+says how many were dropped.
+
+JSONFormatter writes each record as one line of JSON, for log collectors.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import Queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# records waiting for the listener; beyond this, records are dropped
+MAX_QUEUED = 10000
+# records with the same message allowed in each interval
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_INTERVAL = 10.0
+# messages to keep counts for before forgetting ones that have gone quiet
+RATE_LIMIT_KEYS = 1000
+
+FORMAT = "%(asctime)s %(levelname)-8s %(name)s: %(message)s"
+
+_context = threading.local()
+
+@contextlib.contextmanager
+def conversion_context(conversion):
+    """Tag the records logged by this thread in the block with conversion.
+    """
+    previous = getattr(_context, 'conversion', None)
+    _context.conversion = conversion
+    try:
+        yield
+    finally:
+        _context.conversion = previous
+
+def logs_for_conversion(method):
+    """Decorator for Conversion methods that runs them in
+    conversion_context(self).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with conversion_context(self):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class ContextFilter(logging.Filter):
+    """Adds the conversion_id and phase attributes to records."""
+    def filter(self, record):
+        conversion = getattr(_context, 'conversion', None)
+        if conversion is None:
+            record.conversion_id = None
+            record.phase = None
+        else:
+            record.conversion_id = conversion.id
+            record.phase = conversion.status
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Drops records whose message has been logged too often lately.
+
+    Records are grouped by logger, format string and conversion, so
+    "error in %s" is limited as one message whatever its arguments, but a
+    conversion that logs it a lot doesn't silence it for the others.  The
+    conversion comes from the conversion_id that ContextFilter adds, so
+    that filter has to run first.
+
+    :param burst: records allowed for each message in each interval
+    :param interval: seconds
+    """
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL):
+        logging.Filter.__init__(self)
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        # (logger name, format string, conversion id) ->
+        #     [interval start, count, dropped]
+        self.counts = {}
+
+    def filter(self, record):
+        msg = record.msg
+        if not isinstance(msg, basestring):
+            msg = type(msg).__name__
+        key = (record.name, msg, getattr(record, 'conversion_id', None))
+        now = time.time()
+        with self.lock:
+            if len(self.counts) > RATE_LIMIT_KEYS:
+                self._prune(now)
+            entry = self.counts.get(key)
+            if entry is None or now - entry[0] >= self.interval:
+                dropped = entry[2] if entry is not None else 0
+                self.counts[key] = [now, 1, 0]
+            elif entry[1] < self.burst:
+                entry[1] += 1
+                dropped = 0
+            else:
+                entry[2] += 1
+                return False
+        record.suppressed = dropped
+        if dropped:
+            # the count goes in the message, so plain text logs show it too
+            record.msg = '%s [%i similar messages suppressed]' % (
+                record.getMessage(), dropped)
+            record.args = ()
+        return True
+
+    def _prune(self, now):
+        for key, entry in self.counts.items():
+            if now - entry[0] >= self.interval:
+                del self.counts[key]
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for a QueueListener to handle.
+
+    This is logging.handlers.QueueHandler from Python 3, except that it
+    never waits: when the queue is full, the record is dropped.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Make a record safe to handle on another thread.
+
+        The message is formatted now, since its arguments may change
+        before the listener gets to it, and the traceback is formatted
+        while it's still around.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+class QueueListener(object):
+    """Takes records off a queue and passes them to handlers, on its own
+    thread.
+
+    :param queue: queue that a QueueHandler writes to
+    :param handlers: handlers to pass each record to
+    :param queue_handler: the QueueHandler, to report records it dropped
+    """
+    _stop = object()
+
+    def __init__(self, queue, handlers, queue_handler=None):
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.queue_handler = queue_handler
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._monitor,
+                                       name='LogListener')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        reported = 0
+        while True:
+            record = self.queue.get()
+            if record is self._stop:
+                return
+            self.handle(record)
+            if self.queue_handler is not None:
+                dropped = self.queue_handler.dropped
+                if dropped != reported and self.queue.empty():
+                    self.handle(logger.makeRecord(
+                            logger.name, logging.WARNING, __file__, 0,
+                            'log queue was full, dropped %i records',
+                            (dropped - reported,), None))
+                    reported = dropped
+
+    def stop(self, timeout=5.0):
+        """Handle the records that are still queued and stop the thread."""
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(self._stop, timeout=timeout)
+        except Queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.thread = None
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as one line of JSON."""
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            'conversion_id': getattr(record, 'conversion_id', None),
+            'phase': getattr(record, 'phase', None),
+        }
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data)
+
+_handler = None
+_listener = None
+_atexit_registered = False
+# the root logger's handlers when we enabled, to give back in disable()
+_root_handlers = []
+# handler -> formatter it had before enable() set a JSONFormatter
+_formatters = {}
+
+def enable(path=None, json_format=False):
+    """Start queued logging.
+
+    The root logger's handlers are moved to the listener.  If it has none,
+    warnings and errors go to stderr, like Python does when logging isn't
+    set up.  disable() puts things back the way they were.
+
+    :param path: also write the log to this file, at INFO level
+    :param json_format: format records with JSONFormatter
+    :returns: the QueueListener
+    """
+    global _handler, _listener, _atexit_registered
+    root = logging.getLogger()
+    if _listener is None:
+        handlers = [h for h in root.handlers
+                    if not isinstance(h, QueueHandler)]
+        _root_handlers[:] = handlers
+        if not handlers:
+            stderr = logging.StreamHandler(sys.stderr)
+            stderr.setLevel(logging.WARNING)
+            stderr.setFormatter(logging.Formatter(FORMAT))
+            handlers.append(stderr)
+        queue = Queue.Queue(MAX_QUEUED)
+        _handler = QueueHandler(queue)
+        # ContextFilter first, RateLimitFilter uses what it adds
+        _handler.addFilter(ContextFilter())
+        _handler.addFilter(RateLimitFilter())
+        _listener = QueueListener(queue, handlers, _handler)
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        _listener.start()
+        if not _atexit_registered:
+            atexit.register(disable)
+            _atexit_registered = True
+    if path is not None:
+        file_handler = logging.FileHandler(path)
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(logging.Formatter(FORMAT))
+        _listener.handlers.append(file_handler)
+        if root.getEffectiveLevel() > logging.INFO:
+            root.setLevel(logging.INFO)
+    if json_format:
+        for handler in _listener.handlers:
+            if handler not in _formatters:
+                _formatters[handler] = handler.formatter
+            handler.setFormatter(JSONFormatter())
+    return _listener
+
+def disable():
+    """Stop queued logging and give the handlers back to the root logger.
+    """
+    global _handler, _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        if handler in _root_handlers:
+            if handler in _formatters:
+                handler.setFormatter(_formatters[handler])
+            root.addHandler(handler)
+        else:
+            # one we made, the stderr handler or a file
+            handler.close()
+    del _root_handlers[:]
+    _formatters.clear()
+    _handler = _listener = None
+
+def get_listener():
+    """Get the current QueueListener, or None if queued logging is off."""
+    return _listener
@@ -0,0 +1,177 @@
+"""notifications.py -- pass conversion updates from worker threads.
+
+Conversion threads post updates to a NotificationQueue, and the thread that
+owns the UI (or the console loop) takes them off in batches.  Updates for
+the same conversion are coalesced, so a consumer only sees each changed
+conversion once per batch no matter how many progress lines came in.
+
+Consumers don't need to poll.  They can either block in wait(), or set a
+wakeup callback, which gets called the first time something is posted
+after the queue was emptied (typically used to schedule an idle callback
+with the toolkit).
+"""
+
+import collections
+import errno
+import logging
+import os
+import select
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+class NotificationQueue(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.subscribers = []
+        self.wakeup_callback = None
+        # have we signaled the consumer since it last called take()?
+        self._signaled = False
+        if sys.platform == 'win32':
+            # select() only works with sockets on windows
+            self._read_fd = self._write_fd = None
+            self._event = threading.Event()
+        else:
+            self._read_fd, self._write_fd = os.pipe()
+            import fcntl
+            for fd in (self._read_fd, self._write_fd):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._event = None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def __contains__(self, conversion):
+        with self.lock:
+            return conversion in self.pending
+
+    def fileno(self):
+        """Get a file descriptor that becomes readable when updates are
+        pending.
+
+        This lets the queue be added to a select() loop or to a toolkit's
+        IO watch.  Returns None on windows.
+        """
+        return self._read_fd
+
+    def set_wakeup_callback(self, callback):
+        """Set a function to call when updates become available.
+
+        callback will be called from the thread that posted the update, so it
+        should only schedule work on the consumer's thread.
+        """
+        self.wakeup_callback = callback
+
+    def subscribe(self, callback):
+        """Subscribe to batches of updates.
+
+        callback will be called with the list of changed conversions each
+        time a batch is dispatched.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def post(self, conversion):
+        """Note that conversion has changed.
+
+        This can be called from any thread.
+        """
+        with self.lock:
+            self.pending[conversion] = None
+            if self._signaled:
+                return
+            self._signaled = True
+            self._signal()
+            callback = self.wakeup_callback
+        if callback is not None:
+            try:
+                callback()
+            except StandardError:
+                logger.exception('error in notification wakeup callback')
+
+    def take(self):
+        """Take all pending updates.
+
+        :returns: list of changed conversions, in the order they first
+        changed.
+        """
+        with self.lock:
+            changed = self.pending.keys()
+            self.pending.clear()
+            self._signaled = False
+            self._clear_signal()
+        return changed
+
+    def dispatch(self, changed):
+        """Send a batch of changed conversions to our subscribers."""
+        if not changed:
+            return
+        for callback in list(self.subscribers):
+            callback(changed)
+
+    def wait(self, timeout=None):
+        """Block until updates are pending or timeout seconds have passed.
+
+        :returns: True if there are pending updates
+        """
+        with self.lock:
+            if self.pending:
+                return True
+            read_fd = self._read_fd
+        if self._event is not None:
+            self._event.wait(timeout)
+        elif read_fd is not None:
+            try:
+                select.select([read_fd], [], [], timeout)
+            except select.error, e:
+                # EBADF if we were closed while waiting
+                if e.args[0] not in (errno.EINTR, errno.EBADF):
+                    raise
+        with self.lock:
+            return bool(self.pending)
+
+    def close(self):
+        """Close the pipe used to wake up the consumer.
+
+        Updates can still be posted and taken afterwards, but wait() and
+        fileno() no longer work.
+        """
+        # post() writes to the pipe with the lock held, so once the fds are
+        # cleared under it, nothing uses them again
+        with self.lock:
+            read_fd, write_fd = self._read_fd, self._write_fd
+            self._read_fd = self._write_fd = None
+        if read_fd is not None:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def _signal(self):
+        if self._event is not None:
+            self._event.set()
+            return
+        if self._write_fd is None:
+            return
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _clear_signal(self):
+        if self._event is not None:
+            self._event.clear()
+            return
+        if self._read_fd is None:
+            return
+        try:
+            while os.read(self._read_fd, 512):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
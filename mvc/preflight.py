@@ -0,0 +1,240 @@
+"""preflight.py -- estimate conversions by converting a few short samples.
+
+Before a batch starts, each conversion can be checked by converting
+SAMPLE_COUNT clips of SAMPLE_LENGTH seconds, taken from different points
+in the input, with the converter's real settings.  That takes a few
+seconds per file and:
+
+  - catches settings the converter rejects before the batch starts,
+    rather than when the conversion comes up in the queue
+  - measures how many bytes of output each second of media takes, which
+    predicts the output size even for converters that use a constant
+    quality setting, where ConverterInfo.get_output_size_guess() can't
+  - measures how fast the converter runs on this input
+
+The results are stored in Conversion.sample_estimate, which is used for the
+output size in admission control (ConversionManager.check_space()), for the
+queue ETA (ThroughputModel.predict_remaining()) and for the size the
+console shows for queued conversions.  Only the console's --preflight
+option runs it; in the GUI, the converter is usually picked after the
+files are added, so an estimate made then would be for the wrong settings.
+
+The sample times include starting the converter and seeking the input, so
+estimates for very fast converters err on the long side.
+"""
+
+import logging
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+
+from mvc import execute
+from mvc import tracing
+from mvc.logbuffer import LogBuffer
+from mvc.utils import line_reader
+
+logger = logging.getLogger(__name__)
+
+# number of clips to convert from each input
+SAMPLE_COUNT = 3
+# seconds of media in each clip
+SAMPLE_LENGTH = 5.0
+
+class PreflightError(ValueError):
+    """A sample couldn't be converted.
+
+    :attribute log: LogBuffer with the converter's output for the sample
+    """
+    def __init__(self, message, log):
+        ValueError.__init__(self, message)
+        self.log = log
+
+def get_sample_points(duration, count=SAMPLE_COUNT, length=SAMPLE_LENGTH):
+    """Pick the parts of a video to convert.
+
+    The samples are spread evenly across the video, since the start is
+    often a title sequence that's easier to encode than the rest.  Short
+    videos are converted whole.
+
+    :param duration: length of the video in seconds, or None if unknown
+    :returns: list of (start, length) tuples
+    """
+    if not duration:
+        # all we can do is check that the settings work
+        return [(0.0, length)]
+    if duration <= count * length:
+        return [(0.0, float(duration))]
+    span = duration - length
+    return [(span * (i + 0.5) / count, length) for i in range(count)]
+
+def convert_sample(converter, video, start, length, temp_dir=None):
+    """Convert part of a video.
+
+    :param temp_dir: directory for the sample's output, or None to use the
+    system's temp directory
+    :returns: dict with the keys 'media_seconds', 'bytes' and
+    'wall_seconds'
+    :raises NotImplementedError: if the converter can't convert samples
+    :raises PreflightError: if the converter failed
+    """
+    suffix = '.' + converter.extension if converter.extension else ''
+    output = tempfile.mktemp(suffix=suffix, dir=temp_dir)
+    try:
+        commandline = ([converter.get_executable()] +
+                       list(converter.get_sample_arguments(video, output,
+                                                           start, length)))
+    except ValueError, e:
+        raise PreflightError(str(e), LogBuffer())
+    logger.info('sample commandline: %r', ' '.join(commandline))
+    log = LogBuffer()
+    error = None
+    progress = None
+    started = time.time()
+    try:
+        with tracing.span('preflight', filename=video.filename,
+                          start=start):
+            try:
+                popen = execute.Popen(commandline, bufsize=1)
+            except OSError, e:
+                raise PreflightError('%r: %s' % (commandline[0], e), log)
+            for line in line_reader(popen.stdout):
+                try:
+                    status = converter.process_status_line(video, line)
+                except StandardError:
+                    logger.warn('error in process_status_line()',
+                                exc_info=True)
+                    status = None
+                log.append(line, progress=bool(status and
+                                               'progress' in status))
+                if status is None:
+                    continue
+                if 'progress' in status:
+                    progress = float(status['progress'])
+                if 'finished' in status:
+                    error = status.get('error')
+                    break
+            returncode = popen.wait()
+        wall_seconds = time.time() - started
+        if error is None and returncode:
+            error = 'exited with status %s' % (returncode,)
+        if error is None and not os.path.exists(output):
+            error = 'no output'
+        if error is not None:
+            raise PreflightError(error, log)
+        if os.path.isdir(output):
+            nbytes = sum(os.path.getsize(os.path.join(output, name))
+                         for name in os.listdir(output))
+        else:
+            nbytes = os.path.getsize(output)
+    finally:
+        try:
+            if os.path.isdir(output):
+                shutil.rmtree(output)
+            elif os.path.exists(output):
+                os.unlink(output)
+        except EnvironmentError:
+            logger.exception('while removing sample %r', output)
+    if video.duration:
+        media_seconds = min(length, video.duration - start)
+    else:
+        media_seconds = progress or length
+    return {'media_seconds': media_seconds, 'bytes': nbytes,
+            'wall_seconds': wall_seconds}
+
+def estimate(converter, video, temp_dir=None, count=SAMPLE_COUNT,
+             length=SAMPLE_LENGTH):
+    """Estimate a conversion from a few samples.
+
+    :returns: dict with the keys 'output_size' (bytes), 'encode_time'
+    (seconds), 'speed' (media seconds per wall second) and 'samples'.
+    output_size and encode_time are None if the video's duration is
+    unknown.
+    :raises NotImplementedError: if the converter can't convert samples
+    :raises PreflightError: if the converter failed
+    """
+    media_seconds = nbytes = wall_seconds = 0
+    points = get_sample_points(video.duration, count, length)
+    for start, sample_length in points:
+        sample = convert_sample(converter, video, start, sample_length,
+                                temp_dir)
+        media_seconds += sample['media_seconds']
+        nbytes += sample['bytes']
+        wall_seconds += sample['wall_seconds']
+    if media_seconds > 0 and wall_seconds > 0:
+        speed = float(media_seconds) / wall_seconds
+    else:
+        speed = None
+    if video.duration and media_seconds > 0:
+        output_size = int(float(nbytes) / media_seconds * video.duration)
+    else:
+        output_size = None
+    if video.duration and speed:
+        encode_time = video.duration / speed
+    else:
+        encode_time = None
+    result = {'output_size': output_size, 'encode_time': encode_time,
+              'speed': speed, 'samples': len(points)}
+    logger.info('preflight for %r with %s: %r', video.filename,
+                converter.identifier, result)
+    return result
+
+def check_conversions(conversions, workers=1, count=SAMPLE_COUNT,
+                      length=SAMPLE_LENGTH):
+    """Estimate a batch of conversions before they're queued.
+
+    The samples for up to workers conversions are converted at once.  Each
+    conversion that passes gets its sample_estimate set.  Ones whose
+    samples fail are finished as failed, with the sample's output as their
+    log, so they shouldn't be passed to run_conversion().  Conversions
+    whose converter can't convert samples pass without an estimate.
+
+    :returns: list of the conversions that passed, in the order given
+    """
+    conversions = list(conversions)
+    jobs = Queue.Queue()
+    for conversion in conversions:
+        jobs.put(conversion)
+    errors = {}
+
+    def work():
+        while True:
+            try:
+                conversion = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                conversion.sample_estimate = estimate(
+                    conversion.converter, conversion.video,
+                    conversion.manager.scratch_dir, count, length)
+            except NotImplementedError:
+                pass
+            except PreflightError, e:
+                errors[conversion] = e
+            except Exception, e:
+                logger.exception('while checking %r', conversion)
+                errors[conversion] = PreflightError(str(e), LogBuffer())
+
+    threads = [threading.Thread(target=work, name='Preflight:%i' % (i,))
+               for i in range(max(min(workers, len(conversions)), 1))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        # join() with a timeout, so that Ctrl-C still works
+        while thread.is_alive():
+            thread.join(0.5)
+
+    passed = []
+    for conversion in conversions:
+        error = errors.get(conversion)
+        if error is None:
+            passed.append(conversion)
+            continue
+        logger.warn('preflight failed for %r: %s', conversion, error)
+        conversion.log = error.log
+        conversion.error = 'sample conversion failed: %s' % (error,)
+        conversion.finalize()
+    return passed
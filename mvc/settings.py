@@ -62,6 +62,25 @@ def get_ffmpeg_version():
         ffmpeg_version = tuple(maybe_int(v) for v in version)
     return ffmpeg_version
 
+@memoize
+def ffmpeg_supports_faststart():
+    """Can ffmpeg put the moov atom at the start of MP4/MOV files itself?
+
+    Newer versions have a "faststart" flag for the mp4 muxers (-movflags
+    +faststart).  With older ones, we rewrite the file with qtfaststart
+    after the conversion.
+    """
+    commandline = [get_ffmpeg_executable_path(), '-h', 'muxer=mp4']
+    try:
+        p = execute.Popen(commandline)
+        stdout, _ = p.communicate()
+    except (OSError, TypeError):
+        # TypeError means we couldn't find ffmpeg at all
+        logging.warn("couldn't check ffmpeg for faststart support",
+                     exc_info=True)
+        return False
+    return 'faststart' in stdout
+
 def customize_ffmpeg_parameters(params):
     """Takes a list of parameters and modifies it based on
     platform-specific issues.  Returns the newly modified list of
@@ -86,3 +105,77 @@ def customize_ffmpeg_parameters(params):
                     '-coder', '0', '-bf', '0', '-refs', '1',
                     '-flags2', '-wpred-dct8x8']
     return params
+
+def get_data_directory():
+    """Get the directory MVC uses to store its own state between runs.
+
+    This method will create the directory if it doesn't exist
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA', os.path.expanduser('~'))
+        directory = os.path.join(base, 'Miro Video Converter')
+    elif sys.platform == 'darwin':
+        directory = os.path.expanduser(
+            '~/Library/Application Support/Miro Video Converter')
+    else:
+        base = os.environ.get('XDG_DATA_HOME',
+                              os.path.expanduser('~/.local/share'))
+        directory = os.path.join(base, 'mirovideoconverter')
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except EnvironmentError, e:
+            logging.info('os.makedirs: %s', str(e))
+    return directory
+
+def get_scratch_directory():
+    """Get the directory to write conversions to while they're in progress.
+
+    This is set with the MVC_SCRATCH_DIR environment variable, and should
+    point to fast local storage (an SSD or tmpfs).  Finished files are moved
+    to their destination in the background.
+
+    :returns: the directory, or None to write conversions straight to their
+    destination directory.
+    """
+    directory = os.environ.get('MVC_SCRATCH_DIR')
+    if not directory:
+        return None
+    directory = os.path.expanduser(directory)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except EnvironmentError, e:
+            logging.warn("can't create scratch directory %r (%s), writing "
+                         "to the destination instead", directory, e)
+            return None
+    return directory
+
+def get_trace_path():
+    """Get the file to write a trace of the conversions to.
+
+    Tracing is turned on by setting the MVC_TRACE environment variable to
+    the path of the file.  See mvc.tracing.
+
+    :returns: the path, or None if tracing is off
+    """
+    path = os.environ.get('MVC_TRACE')
+    if not path:
+        return None
+    return os.path.expanduser(path)
+
+def get_log_queue():
+    """Get how the log should be written, if it should go through a queue.
+
+    Queued logging is turned on by setting the MVC_LOG_QUEUE environment
+    variable to "text", or to "json" to write each record as JSON.  See
+    mvc.logqueue.
+
+    :returns: "text", "json", or None if queued logging is off
+    """
+    value = os.environ.get('MVC_LOG_QUEUE')
+    if not value:
+        return None
+    if value.lower() == 'json':
+        return 'json'
+    return 'text'
@@ -47,11 +47,18 @@ class WeakMethodReference:
     almost certainly aren't any other references to it.  Instead we keep a
     weak reference to the object, it's class and the unbound method.  This
     gives us enough info to recreate the bound method when we need it.
+
+    If on_dead is given, it's called with no arguments once the object or
+    the function is garbage collected.
     """
 
-    def __init__(self, method):
-        self.object = weakref.ref(method.im_self)
-        self.func = weakref.ref(method.im_func)
+    def __init__(self, method, on_dead=None):
+        if on_dead is not None:
+            finalizer = lambda ref: on_dead()
+        else:
+            finalizer = None
+        self.object = weakref.ref(method.im_self, finalizer)
+        self.func = weakref.ref(method.im_func, finalizer)
         # don't create a weak reference to the class.  That only works for
         # new-style classes.  It's highly unlikely the class will ever need to
         # be garbage collected anyways.
@@ -64,6 +71,21 @@ class WeakMethodReference:
         if obj is None: return None
         return func.__get__(obj, self.cls)
 
+def callback_key(func):
+    """Get a key that identifies func for duplicate checking.
+
+    Bound methods are created fresh each time they're looked up, so they're
+    identified by their object and function rather than by identity.
+    """
+    if getattr(func, 'im_self', None) is not None:
+        return (id(func.im_self), func.im_func)
+    try:
+        hash(func)
+    except TypeError:
+        return id(func)
+    else:
+        return func
+
 class Callback:
     def __init__(self, func, extra_args):
         self.func = func
@@ -79,8 +101,8 @@ class Callback:
         return False
 
 class WeakCallback:
-    def __init__(self, method, extra_args):
-        self.ref = WeakMethodReference(method)
+    def __init__(self, method, extra_args, on_dead=None):
+        self.ref = WeakMethodReference(method, on_dead)
         self.extra_args = extra_args
 
     def compare_function(self, func):
@@ -99,6 +121,12 @@ class WeakCallback:
 class SignalEmitter(object):
     def __init__(self, *signal_names):
         self.signal_callbacks = {}
+        # signal name -> {callback key -> callback id}, used to check for
+        # duplicate connections
+        self._callback_keys = {}
+        # signal name -> tuple of callbacks to run, in the order they were
+        # connected.  Rebuilt only when the callbacks for a signal change.
+        self._dispatch_cache = {}
         self.id_generator = itertools.count()
         self._currently_emitting = set()
         self._frozen = False
@@ -113,6 +141,8 @@ class SignalEmitter(object):
 
     def create_signal(self, name):
         self.signal_callbacks[name] = {}
+        self._callback_keys[name] = {}
+        self._dispatch_cache.pop(name, None)
 
     def get_callbacks(self, signal_name):
         try:
@@ -121,10 +151,27 @@ class SignalEmitter(object):
             raise KeyError("Signal: %s doesn't exist" % signal_name)
 
     def _check_already_connected(self, name, func):
-        for callback in self.get_callbacks(name).values():
-            if callback.compare_function(func):
-                raise ValueError("signal %s already connected to %s" %
-                        (name, func))
+        self.get_callbacks(name)
+        if callback_key(func) in self._callback_keys[name]:
+            raise ValueError("signal %s already connected to %s" %
+                    (name, func))
+
+    def _add_callback(self, name, id_, key, callback):
+        callback.key = key
+        self.get_callbacks(name)[id_] = callback
+        self._callback_keys[name][key] = id_
+        self._dispatch_cache.pop(name, None)
+
+    def _remove_callback(self, name, id_):
+        callbacks = self.signal_callbacks.get(name)
+        if callbacks is None or id_ not in callbacks:
+            return False
+        callback = callbacks.pop(id_)
+        keys = self._callback_keys[name]
+        if keys.get(callback.key) == id_:
+            del keys[callback.key]
+        self._dispatch_cache.pop(name, None)
+        return True
 
     def connect(self, name, func, *extra_args):
         """Connect a callback to a signal.  Returns an callback handle that
@@ -135,8 +182,8 @@ class SignalEmitter(object):
         """
         self._check_already_connected(name, func)
         id_ = self.id_generator.next()
-        callbacks = self.get_callbacks(name)
-        callbacks[id_] = Callback(func, extra_args)
+        self._add_callback(name, id_, callback_key(func),
+                           Callback(func, extra_args))
         return (name, id_)
 
     def connect_weak(self, name, method, *extra_args):
@@ -151,24 +198,32 @@ class SignalEmitter(object):
         if not hasattr(method, 'im_self'):
             raise TypeError("connect_weak must be called with object methods")
         id_ = self.id_generator.next()
-        callbacks = self.get_callbacks(name)
-        callbacks[id_] = WeakCallback(method, extra_args)
+        # drop the callback as soon as the method's object goes away.  Only
+        # keep a weak reference to ourselves, so that connections don't keep
+        # us alive either.
+        self_ref = weakref.ref(self)
+        def on_dead():
+            emitter = self_ref()
+            if emitter is not None:
+                emitter._remove_callback(name, id_)
+        self._add_callback(name, id_, callback_key(method),
+                           WeakCallback(method, extra_args, on_dead))
         return (name, id_)
 
     def disconnect(self, callback_handle):
         """Disconnect a signal.  callback_handle must be the return value from
         connect() or connect_weak().
         """
-        callbacks = self.get_callbacks(callback_handle[0])
-        if callback_handle[1] in callbacks:
-            del callbacks[callback_handle[1]]
-        else:
+        self.get_callbacks(callback_handle[0])
+        if not self._remove_callback(*callback_handle):
             logging.warning(
                 "disconnect called but callback_handle not in the callback")
 
     def disconnect_all(self):
         for signal in self.signal_callbacks:
             self.signal_callbacks[signal] = {}
+            self._callback_keys[signal] = {}
+        self._dispatch_cache.clear()
 
     def emit(self, name, *args):
         if self._frozen:
@@ -181,9 +236,17 @@ class SignalEmitter(object):
             callback_returned_true = self._run_signal(name, args)
         finally:
             self._currently_emitting.discard(name)
-            self.clear_old_weak_references()
         return callback_returned_true
 
+    def _get_dispatch(self, name):
+        try:
+            return self._dispatch_cache[name]
+        except KeyError:
+            callbacks = self.get_callbacks(name)
+            dispatch = tuple(callbacks[id_] for id_ in sorted(callbacks))
+            self._dispatch_cache[name] = dispatch
+            return dispatch
+
     def _run_signal(self, name, args):
         callback_returned_true = False
         try:
@@ -194,17 +257,22 @@ class SignalEmitter(object):
             if self_callback(*args):
                 callback_returned_true = True
         if not callback_returned_true:
-            for callback in self.get_callbacks(name).values():
+            for callback in self._get_dispatch(name):
                 if callback.invoke(self, args):
                     callback_returned_true = True
                     break
         return callback_returned_true
 
     def clear_old_weak_references(self):
-        for callback_map in self.signal_callbacks.values():
+        """Remove callbacks for objects that have been garbage collected.
+
+        Dead callbacks are normally removed as soon as their object goes
+        away, so this only needs to be called to be extra sure.
+        """
+        for name, callback_map in self.signal_callbacks.items():
             for id_ in callback_map.keys():
                 if callback_map[id_].is_dead():
-                    del callback_map[id_]
+                    self._remove_callback(name, id_)
 
 class SystemSignals(SignalEmitter):
     """System wide signals for Miro.  These can be accessed from the singleton
@@ -0,0 +1,164 @@
+"""streaming.py -- convert from stdin and to stdout.
+
+StreamConversion runs a converter that writes its output to a file object
+(normally stdout) rather than to the conversion directory, so MVC can be
+used in a Unix pipeline.  The input is either a file or a stream (normally
+stdin).  Nothing is written to disk: there's no temp file, and no
+finalize step.
+
+Streams can't be probed by name, so the first PROBE_SIZE bytes are read
+with read_head() and probed with video.StreamVideoFile.  Those bytes are
+then fed to the converter, followed by the rest of the stream.
+
+Only output formats that can be written in order work.  MP4 and MOV are
+written as fragmented MP4 (see FFmpegConverterInfo.get_stream_arguments());
+WebM, MP3 and Ogg stream as they are.
+"""
+
+import errno
+import logging
+import os
+import subprocess
+import threading
+
+from mvc.conversion import Conversion
+from mvc.logqueue import logs_for_conversion
+
+logger = logging.getLogger(__name__)
+
+# bytes to read from a stream before probing it.  ffmpeg reads up to 5MB by
+# default to find the streams in its input.
+PROBE_SIZE = 5 * 1024 * 1024
+# bytes to copy to the converter at a time
+CHUNK_SIZE = 64 * 1024
+
+def _read(fd, size):
+    while True:
+        try:
+            return os.read(fd, size)
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+
+def read_head(stream, size=PROBE_SIZE):
+    """Read the start of a stream for probing.
+
+    This reads from the file descriptor directly, so that no data is left
+    behind in the file object's buffer.
+
+    :returns: up to size bytes; fewer if the stream ended
+    """
+    fd = stream.fileno()
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = _read(fd, min(remaining, CHUNK_SIZE))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return ''.join(chunks)
+
+class StreamConversion(Conversion):
+    """Conversion that writes its output to a stream.
+
+    :param output_stream: file object to write the output to
+    :param input_stream: file object to read the input from, or None to read
+    video.filename.  When this is set, video should be a StreamVideoFile
+    for the same stream.
+    """
+    def __init__(self, video, converter, manager, output_stream,
+                 input_stream=None, **kwargs):
+        self.output_stream = output_stream
+        self.input_stream = input_stream
+        self.feeder = None
+        Conversion.__init__(self, video, converter, manager, **kwargs)
+
+    def set_converter(self, converter):
+        if self.status != 'initialized':
+            raise RuntimeError("can't change converter after starting")
+        # raises ValueError right away if the converter can't write to a pipe
+        converter.get_stream_arguments(self.video)
+        self.converter = converter
+        self.output = '-'
+
+    def estimate_output_size(self):
+        # nothing goes to disk
+        return None
+
+    @logs_for_conversion
+    def run(self):
+        logger.info('starting %r', self)
+        self.record_queued()
+        if self.input_stream is None:
+            try:
+                self.input_bytes = os.path.getsize(self.video.filename)
+            except EnvironmentError:
+                pass
+        else:
+            self.input_bytes = 0
+        logger.info('commandline: %r', ' '.join(
+                self.get_subprocess_arguments(None)))
+        # anything the caller printed has to come before our output
+        self.output_stream.flush()
+        self.thread = threading.Thread(target=self._thread,
+                                       name="Thread:%s" % (self,))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def get_subprocess_arguments(self, output):
+        if self.input_stream is None:
+            input_path = self.video.filename
+        else:
+            input_path = None
+        return ([self.converter.get_executable()] +
+                list(self.converter.get_stream_arguments(self.video,
+                                                         input_path)))
+
+    def get_popen_kwargs(self):
+        kwargs = Conversion.get_popen_kwargs(self)
+        # the output goes straight to output_stream, and we read the
+        # converter's messages from stderr
+        kwargs['stdout'] = self.output_stream
+        kwargs['stderr'] = subprocess.PIPE
+        if self.input_stream is not None:
+            kwargs['stdin'] = subprocess.PIPE
+        return kwargs
+
+    def process_output(self):
+        if self.input_stream is not None:
+            self.feeder = threading.Thread(target=self._feed,
+                                           args=(self.popen.stdin,),
+                                           name="Feeder:%s" % (self,))
+            self.feeder.setDaemon(True)
+            self.feeder.start()
+        Conversion.process_output(self)
+
+    @logs_for_conversion
+    def _feed(self, pipe):
+        """Copy the head of the input stream and then the rest of it to the
+        converter.
+        """
+        fd = self.input_stream.fileno()
+        chunk = self.video.head
+        try:
+            while chunk:
+                pipe.write(chunk)
+                self.input_bytes += len(chunk)
+                chunk = _read(fd, CHUNK_SIZE)
+        except EnvironmentError, e:
+            # EPIPE means the converter exited (or was stopped) before it
+            # read everything, process_output() reports why.
+            if e.errno != errno.EPIPE:
+                logger.exception('while feeding %r', self)
+        finally:
+            try:
+                pipe.close()
+            except EnvironmentError:
+                pass
+
+    def move_to_destination(self):
+        pass # the output has already gone to output_stream
+
+    def get_output_bytes(self):
+        return self.output_size
@@ -0,0 +1,233 @@
+"""throughput.py -- learned encoding speed for converters.
+
+ThroughputModel remembers how fast conversions actually ran, measured as
+media seconds encoded per wall clock second, and uses that history to
+predict how long a job will take before it has started.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# weight given to the newest sample when updating a running average
+SMOOTHING = 0.3
+
+# (max height, name) pairs used to bucket input resolutions
+RESOLUTION_CLASSES = (
+    (360, '360p'),
+    (480, '480p'),
+    (720, '720p'),
+    (1080, '1080p'),
+)
+
+def resolution_class(video):
+    """Get a coarse name for the resolution of a video.
+
+    Videos of similar size encode at similar speeds, so we group them rather
+    than keying on the exact dimensions.
+    """
+    if video.audio_only:
+        return 'audio'
+    if not video.height:
+        return 'unknown'
+    for max_height, name in RESOLUTION_CLASSES:
+        if video.height <= max_height:
+            return name
+    return 'uhd'
+
+def model_keys(converter, video):
+    """Get the keys used to look up the speed of a conversion.
+
+    Keys are returned from the most specific to the least specific; the
+    more general keys are used when we have no history for the specific
+    ones.
+    """
+    resolution = resolution_class(video)
+    codec = video.video_codec or video.audio_codec or 'unknown'
+    identifier = converter.identifier
+    return ['%s|%s|%s' % (identifier, resolution, codec),
+            '%s|%s' % (identifier, resolution),
+            identifier,
+            '*|%s' % (resolution,),
+            '*']
+
+class ThroughputModel(object):
+    """Records realized encoding speeds and predicts conversion times.
+
+    :param path: file to persist the model to.  If None, the model is only
+    kept in memory.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.speeds = {}
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except EnvironmentError:
+            return # no history yet
+        except ValueError:
+            logger.warn('ignoring corrupt throughput history in %r',
+                        self.path)
+            return
+        with self.lock:
+            self.speeds = dict((key, value) for (key, value) in data.items()
+                               if isinstance(value, dict) and
+                               value.get('speed', 0) > 0)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.speeds, indent=1, sort_keys=True)
+        directory = os.path.dirname(self.path)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path) # rename() doesn't replace on windows
+            os.rename(temp_path, self.path)
+        except EnvironmentError:
+            logger.exception('while saving throughput history to %r',
+                             self.path)
+
+    def record(self, converter, video, media_seconds, wall_seconds):
+        """Record a finished conversion.
+
+        :param media_seconds: duration of the media that was converted
+        :param wall_seconds: time the conversion took
+        """
+        if not media_seconds or not wall_seconds or wall_seconds <= 0:
+            return
+        speed = float(media_seconds) / wall_seconds
+        with self.lock:
+            for key in model_keys(converter, video):
+                entry = self.speeds.get(key)
+                if entry is None:
+                    self.speeds[key] = {'speed': speed, 'samples': 1}
+                else:
+                    entry['speed'] = (SMOOTHING * speed +
+                                      (1 - SMOOTHING) * entry['speed'])
+                    entry['samples'] += 1
+        logger.info('throughput for %s: %.2fx realtime', converter.identifier,
+                    speed)
+        self.save()
+
+    def get_speed(self, converter, video):
+        """Get the expected speed for a conversion
+
+        :returns: media seconds per wall second, or None if we have no
+        history to base a guess on.
+        """
+        with self.lock:
+            for key in model_keys(converter, video):
+                if key in self.speeds:
+                    return self.speeds[key]['speed']
+        return None
+
+    def predict(self, converter, video):
+        """Predict how many seconds converting video will take.
+
+        :returns: seconds, or None if we can't make a prediction
+        """
+        if not video.duration:
+            return None
+        speed = self.get_speed(converter, video)
+        if speed is None:
+            return None
+        return video.duration / speed
+
+    def get_conversion_speed(self, conversion):
+        """Get the expected speed for a conversion.
+
+        The speed measured by converting samples of its input (see
+        mvc.preflight) is used if there is one, since it's for this input
+        and these settings.  Otherwise it's the same as get_speed().
+        """
+        estimate = conversion.sample_estimate
+        if estimate is not None and estimate['speed']:
+            return estimate['speed']
+        return self.get_speed(conversion.converter, conversion.video)
+
+    def predict_remaining(self, conversion):
+        """Predict how many seconds are left for a conversion.
+
+        Conversions that haven't started are predicted from their full
+        duration, running conversions from the media left to encode.
+        """
+        if conversion.status in ('finished', 'failed', 'canceled'):
+            return 0.0
+        if conversion.status == 'initialized':
+            duration = conversion.video.duration
+            if not duration:
+                return None
+            speed = self.get_conversion_speed(conversion)
+            if speed is None:
+                return None
+            return duration / speed
+        if conversion.eta is not None:
+            return conversion.eta
+        duration = conversion.duration or conversion.video.duration
+        if not duration:
+            return None
+        speed = self.get_conversion_speed(conversion)
+        if speed is None:
+            return None
+        return max(duration - (conversion.progress or 0), 0) / speed
+
+def schedule_finish_times(running, queued, slots, predict):
+    """Simulate a conversion queue to find when each job will finish.
+
+    :param running: conversions that currently hold a slot
+    :param queued: conversions waiting for a slot, in the order they will
+    start
+    :param slots: number of conversions that run at once, or None for no limit
+    :param predict: function that returns the seconds a conversion has left,
+    or None if unknown
+
+    :returns: dict mapping conversions to the number of seconds from now until
+    they finish, or None if that can't be predicted.
+    """
+    finish_times = {}
+    slot_free = []
+    unknown = False
+    for conversion in running:
+        remaining = predict(conversion)
+        if remaining is None:
+            unknown = True
+            finish_times[conversion] = None
+            slot_free.append(0.0)
+        else:
+            finish_times[conversion] = remaining
+            slot_free.append(remaining)
+    if slots is None:
+        slots = len(slot_free) + len(queued)
+    slot_free.sort()
+    # slots that aren't used by running conversions are free right away
+    slot_free = [0.0] * max(slots - len(slot_free), 0) + slot_free
+    for conversion in queued:
+        remaining = predict(conversion)
+        if remaining is None:
+            unknown = True
+        if unknown or not slot_free:
+            # once one job is unknown, everything behind it is too
+            finish_times[conversion] = None
+            continue
+        start = slot_free.pop(0)
+        finish = start + remaining
+        finish_times[conversion] = finish
+        # keep the list sorted so that pop(0) is the next slot to free up
+        index = 0
+        while index < len(slot_free) and slot_free[index] <= finish:
+            index += 1
+        slot_free.insert(index, finish)
+    return finish_times
@@ -0,0 +1,241 @@
+"""tracing.py -- timed spans for finding out where a batch spends its time.
+
+Tracing is off unless it's turned on with enable(), which the applications
+do when the MVC_TRACE environment variable (see settings.get_trace_path())
+or the console's --trace option is set.  While it's off, span() returns a
+shared object whose __enter__ and __exit__ do nothing, and record() returns
+right away, so the hooks cost one function call each.
+
+While it's on, every span is kept in memory.  At exit, the spans are
+written to a file in the Chrome trace event format (open it in
+chrome://tracing or https://ui.perfetto.dev) and a table of the total time
+spent in each kind of span is printed to stderr.  Spans that belong to a
+conversion are shown on their own row in the trace, so the queue wait,
+encode, thumbnail and finalize phases of each file line up.
+
+Span names used by MVC:
+  probe -- running ffmpeg -i to read a file's media info
+  preflight -- converting a sample of a file, see mvc.preflight
+  queued -- waiting in ConversionManager.waiting for a free slot
+  encode -- the converter process running, not counting pauses
+  paused -- the converter process suspended
+  thumbnail -- writing the thumbnail for a conversion
+  staging_wait -- waiting for a write-behind thread after the encode
+  finalize -- ConverterInfo.finalize() and moving the output into place
+  notifications -- handling a batch of updates on the UI / console thread
+"""
+
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+class _NullSpan(object):
+    """What span() returns when tracing is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_span = _NullSpan()
+
+class Span(object):
+    """Context manager that records the time spent in its block."""
+    def __init__(self, tracer, name, conversion, args):
+        self.tracer = tracer
+        self.name = name
+        self.conversion = conversion
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.time(),
+                           self.conversion, **self.args)
+        return False
+
+class Tracer(object):
+    """Collects spans from any thread.
+
+    :param path: file to write the Chrome trace to, or None to only keep
+    the spans in memory
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.created_at = time.time()
+        # (name, start, end, track, args) tuples
+        self.spans = []
+        # conversion -> track number; weak, so that tracing doesn't keep
+        # finished conversions alive
+        self.tracks = weakref.WeakKeyDictionary()
+        # track number -> label for the track
+        self.track_names = {}
+        self.next_track = 1
+
+    def _get_track(self, conversion):
+        if conversion is None:
+            thread = threading.current_thread()
+            # thread idents are big numbers, so they don't collide with the
+            # conversion tracks
+            track = thread.ident
+            if track not in self.track_names:
+                self.track_names[track] = thread.name
+            return track
+        track = self.tracks.get(conversion)
+        if track is None:
+            track = self.next_track
+            self.next_track += 1
+            self.tracks[conversion] = track
+            self.track_names[track] = os.path.basename(
+                conversion.video.filename or '-')
+        return track
+
+    def record(self, name, start, end, conversion=None, **args):
+        """Record a span that has already ended."""
+        with self.lock:
+            track = self._get_track(conversion)
+            self.spans.append((name, start, end, track, args))
+
+    def get_chrome_trace(self):
+        """Get the spans in the Chrome trace event format.
+
+        :returns: dict that can be serialized to JSON
+        """
+        pid = os.getpid()
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+            track_names = dict(self.track_names)
+        for track, label in track_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': track, 'args': {'name': label}})
+        for name, start, end, track, args in spans:
+            events.append({
+                'name': name,
+                'cat': 'mvc',
+                'ph': 'X',
+                'pid': pid,
+                'tid': track,
+                # microseconds since the tracer was created
+                'ts': int((start - self.created_at) * 1000000),
+                'dur': int((end - start) * 1000000),
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.get_chrome_trace(), f)
+
+    def summarize(self):
+        """Total up the spans by name.
+
+        :returns: dict mapping span names to dicts with the keys 'count',
+        'total' and 'max' (in seconds)
+        """
+        summary = {}
+        with self.lock:
+            spans = list(self.spans)
+        for name, start, end, track, args in spans:
+            totals = summary.setdefault(name, {'count': 0, 'total': 0.0,
+                                               'max': 0.0})
+            elapsed = end - start
+            totals['count'] += 1
+            totals['total'] += elapsed
+            totals['max'] = max(totals['max'], elapsed)
+        return summary
+
+    def format_summary(self):
+        summary = self.summarize()
+        lines = ['%-14s %7s %10s %10s %10s' % ('span', 'count', 'total',
+                                               'mean', 'max')]
+        for name, totals in sorted(summary.items(),
+                                   key=lambda item: -item[1]['total']):
+            lines.append('%-14s %7i %9.3fs %9.3fs %9.3fs' % (
+                    name, totals['count'], totals['total'],
+                    totals['total'] / totals['count'], totals['max']))
+        return '\n'.join(lines)
+
+    def finish(self):
+        """Write the trace file and print the summary."""
+        if not self.spans:
+            return
+        if self.path is not None:
+            try:
+                self.write_chrome_trace(self.path)
+            except EnvironmentError:
+                logger.exception('while writing trace to %r', self.path)
+            else:
+                sys.stderr.write('trace written to %s\n' % (self.path,))
+        sys.stderr.write(self.format_summary() + '\n')
+
+_tracer = None
+_atexit_registered = False
+
+def enable(path=None):
+    """Start tracing.
+
+    :param path: file to write the Chrome trace to at exit
+    :returns: the Tracer
+    """
+    global _tracer, _atexit_registered
+    if _tracer is None:
+        _tracer = Tracer(path)
+        if not _atexit_registered:
+            atexit.register(_finish)
+            _atexit_registered = True
+    elif path is not None:
+        _tracer.path = path
+    return _tracer
+
+def disable():
+    """Stop tracing and throw away what was recorded."""
+    global _tracer
+    _tracer = None
+
+def get_tracer():
+    """Get the current Tracer, or None if tracing is off."""
+    return _tracer
+
+def _finish():
+    if _tracer is not None:
+        _tracer.finish()
+
+def span(name, conversion=None, **args):
+    """Time a block of code.
+
+    Use it as a context manager::
+
+        with tracing.span('probe', filename=filename):
+            ...
+
+    :param name: kind of span, used to total them up
+    :param conversion: Conversion the span belongs to, if any
+    :param args: extra information to store in the trace
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _null_span
+    return Span(tracer, name, conversion, args)
+
+def record(name, start, end, conversion=None, **args):
+    """Record a span that was timed some other way, for example the time a
+    conversion spent in the queue.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    tracer.record(name, start, end, conversion, **args)
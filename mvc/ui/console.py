@@ -1,12 +1,21 @@
 import json
 import operator
 import optparse
-import time
+import os
 import sys
 
 import mvc
+from mvc import logqueue
+from mvc import preflight
+from mvc import settings
+from mvc import tracing
+from mvc.conversion import summarize_stats
+from mvc.jobqueue import open_queue
+from mvc.utils import duration_string, size_string
+from mvc.watchfolder import SETTLE_TIME, WatchFolder
 from mvc.widgets import app
-from mvc.widgets import initialize
+from mvc.worker import Coordinator, Worker
+from mvc.widgets import get_conversion_directory, initialize
 
 parser = optparse.OptionParser(
     usage='%prog [-l] [--list-converters] [-c <converter> <filenames..>]',
@@ -20,6 +29,62 @@ parser.add_option('-l', '--list-converters', action='store_true',
                   help="Print a list of supported converter types.")
 parser.add_option('-c', '--converter', dest='converter',
                   help="Specify the type of conversion to make.")
+parser.add_option('--stdout', action='store_true', dest='stdout',
+                  help="Write the converted file to stdout instead of the "
+                  "conversion directory, and the status to stderr.  Use "
+                  "'-' as the filename to read from stdin.  MP4 and MOV "
+                  "output is written as fragmented MP4.")
+parser.add_option('--save-logs', action='store_true', dest='save_logs',
+                  help="Save the converter output for each file to "
+                  "<output>.log.gz.")
+parser.add_option('--scratch-dir', dest='scratch_dir',
+                  help="Write conversions to this directory while they're "
+                  "in progress (default: $MVC_SCRATCH_DIR).")
+parser.add_option('--nice', type='int', dest='nice',
+                  help="Run the converter at a lower priority, like "
+                  "nice(1).")
+parser.add_option('--io-class', dest='io_class',
+                  choices=['idle', 'best-effort', 'realtime'],
+                  help="I/O scheduling class for the converter (linux "
+                  "only): idle, best-effort or realtime.")
+parser.add_option('--pin-cpus', action='store_true', dest='pin_cpus',
+                  help="Run each simultaneous conversion on its own group of "
+                  "CPUs (linux only).")
+parser.add_option('--watch', action='append', dest='watch',
+                  help="Convert files as they're written to this directory "
+                  "(can be given more than once).  Runs until interrupted.")
+parser.add_option('--settle-time', type='float', dest='settle_time',
+                  default=SETTLE_TIME,
+                  help="With --watch, seconds a file's size must stay the "
+                  "same before it's converted, if we can't tell when it's "
+                  "closed [%default].")
+parser.add_option('--preflight', action='store_true', dest='preflight',
+                  help="Convert a few short samples of each file before "
+                  "starting, to catch settings that don't work and to "
+                  "estimate the size and time of each conversion.")
+parser.add_option('--trace', dest='trace',
+                  help="Record how long each step of each conversion takes, "
+                  "write the trace to this file in Chrome's trace format "
+                  "and print a summary at exit (default: $MVC_TRACE).")
+parser.add_option('--log-file', dest='log_file',
+                  help="Write the log to this file, from a background "
+                  "thread so that a slow disk doesn't hold up the "
+                  "conversions.  Set $MVC_LOG_QUEUE to queue the usual log "
+                  "the same way.")
+parser.add_option('--log-json', action='store_true', dest='log_json',
+                  help="Write the log as one JSON document per line, with "
+                  "the id and status of the conversion for each record.")
+parser.add_option('--queue', dest='queue',
+                  help="Send conversions to the job queue at this path "
+                  "instead of running them, or with --worker, run jobs from "
+                  "it.  Paths ending in .db or .sqlite are SQLite "
+                  "databases, anything else is a directory.")
+parser.add_option('--worker', action='store_true', dest='worker',
+                  help="Run conversions from the job queue given with "
+                  "--queue.")
+parser.add_option('--exit-when-idle', action='store_true',
+                  dest='exit_when_idle',
+                  help="With --worker, exit once the queue is empty.")
 
 class Application(mvc.Application):
 
@@ -38,26 +103,73 @@ class Application(mvc.Application):
                         c.identifier)
             return
 
+        if options.trace:
+            tracing.enable(options.trace)
+        if options.log_file or options.log_json:
+            logqueue.enable(options.log_file, bool(options.log_json))
+        self.conversion_manager.save_logs = bool(options.save_logs)
+        if options.scratch_dir:
+            self.conversion_manager.scratch_dir = options.scratch_dir
+        self.conversion_manager.nice = options.nice
+        self.conversion_manager.io_class = options.io_class
+        self.conversion_manager.pin_cpus = bool(options.pin_cpus)
+
+        # in streaming mode, stdout is for the converted file
+        streaming = bool(options.stdout) or '-' in args
+        if streaming:
+            out = sys.stderr
+            if len(args) != 1:
+                parser.error('only one file can be streamed')
+            if (options.queue or options.worker or options.watch or
+                options.preflight):
+                parser.error("streaming doesn't work with --queue, --watch "
+                             "or --preflight")
+        else:
+            out = sys.stdout
+        if options.watch and (options.queue or options.worker):
+            parser.error("--watch doesn't work with --queue")
+
+        coordinator = None
+        if options.queue:
+            queue = open_queue(options.queue)
+            if options.worker:
+                self.startup()
+                Worker(queue, self.converter_manager,
+                       self.conversion_manager).run(
+                    exit_when_idle=bool(options.exit_when_idle))
+                return
+            coordinator = Coordinator(queue)
+        elif options.worker:
+            parser.error('--worker needs --queue')
+
         try:
             self.converter_manager.get_by_id(options.converter)
         except KeyError:
             message = '%r is not a valid converter type.' % (
                 options.converter,)
             if options.json:
-                print json.dumps({'error': message})
+                print >>out, json.dumps({'error': message})
             else:
-                print 'ERROR:', message
-                print 'Use "%s -l" to get a list of valid converters.' % (
-                    parser.prog,)
-                print
-                parser.print_help()
+                print >>out, 'ERROR:', message
+                print >>out, ('Use "%s -l" to get a list of valid '
+                              'converters.' % (parser.prog,))
+                print >>out
+                parser.print_help(out)
             sys.exit(1)
 
         any_failed = False
+        # queue_changes that queue_eta was computed for
+        estimate = {'queue_changes': None, 'queue_eta': None}
 
         def changed(c):
             if c.status == 'failed':
                 any_failed = True
+            manager = self.conversion_manager
+            if estimate['queue_changes'] != manager.queue_changes:
+                # only go through the queue when it changed
+                estimate['queue_changes'] = manager.queue_changes
+                estimate['queue_eta'] = manager.update_queue_estimates()
+            queue_eta = estimate['queue_eta']
             if options.json:
                 output = {
                     'filename': c.video.filename,
@@ -67,52 +179,196 @@ class Application(mvc.Application):
                     'progress': c.progress,
                     'percent': (c.progress_percent * 100 if c.progress_percent
                                 else 0),
+                    'eta': c.eta,
+                    'finish_in': c.queue_eta,
+                    'queue_eta': queue_eta,
                     }
+                if c.waiting_reason is not None:
+                    output['waiting_reason'] = c.waiting_reason
+                if c.sample_estimate is not None:
+                    output['estimate'] = c.sample_estimate
                 if c.error is not None:
                     output['error'] = c.error
-                print json.dumps(output)
+                if c.error_context:
+                    output['error_context'] = c.error_context
+                if c.status in ('finished', 'failed', 'canceled'):
+                    output['stats'] = c.get_stats()
+                print >>out, json.dumps(output)
             else:
-                if c.status == 'initialized':
+                if c.status == 'initialized' and c.waiting_reason:
+                    line = 'waiting (%s)' % (c.waiting_reason,)
+                elif c.status == 'initialized':
                     line = 'starting (output: %s)' % (c.output,)
+                    if (c.sample_estimate is not None and
+                        c.sample_estimate['output_size']):
+                        line = 'starting (output: %s, about %s)' % (
+                            c.output,
+                            size_string(c.sample_estimate['output_size']))
                 elif c.status == 'converting':
-                    if c.progress_percent is not None:
-                        line = 'converting (%i%% complete, %is remaining)' % (
-                            c.progress_percent * 100, c.eta)
+                    if c.eta is not None:
+                        remaining = '%is remaining' % (c.eta,)
                     else:
-                        line = 'converting (0% complete, unknown remaining)'
+                        remaining = 'unknown remaining'
+                    line = 'converting (%i%% complete, %s)' % (
+                        (c.progress_percent or 0) * 100, remaining)
+                elif c.status == 'paused':
+                    line = 'paused (%i%% complete)' % (
+                        (c.progress_percent or 0) * 100,)
+                    if c.preempted:
+                        line += ', waiting for higher priority conversions'
                 elif c.status == 'staging':
                     line = 'staging'
                 elif c.status == 'failed':
                     line = 'failed (error: %r)' % (c.error,)
+                    if c.error_context:
+                        line = '\n    '.join([line] + c.error_context)
                 elif c.status == 'finished':
                     line = 'finished (output: %s)' % (c.output,)
                 else:
                     line = c.status
-                print '%s: %s' % (c.video.filename, line)
+                if (c.status in ('initialized', 'converting') and
+                    queue_eta is not None):
+                    line = '%s [queue done in %s]' % (
+                        line, duration_string(queue_eta))
+                print >>out, '%s: %s' % (c.video.filename, line)
 
+        conversions = []
+        # with --preflight, conversions wait here until they're checked
+        unchecked = []
         for filename in args:
             try:
-                c = app.start_conversion(filename, options.converter)
-            except ValueError:
-                message = 'could not parse %r' % filename
+                if streaming:
+                    c = self.get_stream_conversion(filename, options.converter,
+                                                   sys.stdout, sys.stdin)
+                    self.conversion_manager.run_conversion(c)
+                elif coordinator is not None:
+                    c = self.get_conversion(filename, options.converter)
+                    if options.preflight:
+                        unchecked.append(c)
+                        continue
+                    coordinator.submit(c)
+                elif options.preflight:
+                    unchecked.append(self.get_conversion(filename,
+                                                         options.converter))
+                    continue
+                else:
+                    c = self.start_conversion(filename, options.converter)
+            except ValueError, e:
+                if streaming:
+                    message = 'could not stream %r (%s)' % (filename, e)
+                else:
+                    message = 'could not parse %r' % filename
                 if options.json:
                     any_failed = True
-                    print json.dumps({'status': 'failed', 'error': message,
-                                      'filename': filename})
+                    print >>out, json.dumps({'status': 'failed',
+                                             'error': message,
+                                             'filename': filename})
                 else:
-                    print 'ERROR:', message
+                    print >>out, 'ERROR:', message
                 continue
+            conversions.append(c)
             changed(c)
             c.listen(changed)
 
-        # XXX real mainloop
+        if unchecked:
+            if not options.json:
+                print >>out, 'converting samples of %i files...' % (
+                    len(unchecked),)
+            passed = set(preflight.check_conversions(
+                    unchecked, self.conversion_manager.simultaneous or 1))
+            for c in unchecked:
+                conversions.append(c)
+                if c not in passed:
+                    # finished as failed; it won't change again
+                    any_failed = True
+                    changed(c)
+                    continue
+                if coordinator is not None:
+                    coordinator.submit(c)
+                else:
+                    self.conversion_manager.run_conversion(c)
+                changed(c)
+                c.listen(changed)
+
+        watch = None
+        if options.watch:
+            watch = self.watch(options, changed, conversions)
+
+        if coordinator is not None:
+            coordinator.wait(self.conversion_manager)
         while self.conversion_manager.running:
+            self.conversion_manager.wait_for_notifications(1.0)
             self.conversion_manager.check_notifications()
-            time.sleep(1)
         self.conversion_manager.check_notifications() # one last time
+        if watch is not None:
+            # only now, so that the conversions that finished since the
+            # interrupt are recorded
+            watch.close()
+
+        if conversions:
+            self.print_summary(summarize_stats(conversions), options.json,
+                               out)
 
         sys.exit(0 if not any_failed else 1)
 
+    def watch(self, options, changed, conversions):
+        """Convert files from the --watch directories until we're
+        interrupted.
+
+        :returns: the WatchFolder, which the caller closes once the
+        conversions it stopped have finished
+        """
+        converter = self.converter_manager.get_by_id(options.converter)
+        record_path = os.path.join(settings.get_data_directory(),
+                                   'watched.json')
+        try:
+            watch = WatchFolder(self.conversion_manager, converter,
+                                options.watch, record_path=record_path,
+                                output_dir=get_conversion_directory(),
+                                settle_time=options.settle_time)
+        except (ValueError, EnvironmentError), e:
+            parser.error(str(e))
+        def started(c):
+            conversions.append(c)
+            changed(c)
+            c.listen(changed)
+        watch.add_callback(started)
+        try:
+            while True:
+                watch.poll(1.0)
+                self.conversion_manager.check_notifications()
+        except KeyboardInterrupt:
+            # conversions that are cut short are converted again next time
+            for c in watch.stop_conversions():
+                # let it clean up its temp file
+                if c.thread is not None:
+                    c.thread.join(5.0)
+        except:
+            watch.close()
+            raise
+        return watch
+
+    def print_summary(self, summary, use_json, out=sys.stdout):
+        if use_json:
+            print >>out, json.dumps({'summary': summary})
+            return
+        print >>out, 'Summary: %i conversions, %i failed' % (
+            summary['conversions'], summary['failed'])
+        rows = [('total', summary)] + sorted(summary['converters'].items())
+        for name, totals in rows:
+            parts = ['wall %s' % duration_string(totals['wall_time']),
+                     'cpu %s' % duration_string(totals['cpu_time'])]
+            if totals['fps']:
+                parts.append('%.1f fps' % totals['fps'])
+            if totals['max_rss']:
+                parts.append('peak rss %s' % size_string(totals['max_rss']))
+            if totals['compression_ratio'] is not None:
+                parts.append('%s -> %s (%.2fx)' % (
+                    size_string(totals['input_bytes']),
+                    size_string(totals['output_bytes']),
+                    totals['compression_ratio']))
+            print >>out, '  %s: %s' % (name, ', '.join(parts))
+
 if __name__ == "__main__":
     initialize(None)
     app.widgetapp = Application()
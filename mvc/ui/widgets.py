@@ -12,13 +12,16 @@ except ImportError:
     sys.path.append(mvc_path)
     import mvc
 
+import collections
 import copy
 import tempfile
+import time
 import urllib
 import urlparse
 
-from mvc.widgets import (initialize, idle_add, mainloop_start, mainloop_stop,
-                         attach_menubar, reveal_file, get_conversion_directory)
+from mvc.widgets import (initialize, idle_add, timeout_add, mainloop_start,
+                         mainloop_stop, attach_menubar, reveal_file,
+                         get_conversion_directory)
 from mvc.widgets import menus
 from mvc.widgets import widgetset
 from mvc.widgets import cellpack
@@ -29,7 +32,8 @@ from mvc.widgets import app
 from mvc.converter import ConverterInfo
 from mvc.video import VideoFile
 from mvc.resources import image_path
-from mvc.utils import size_string, round_even, convert_path_for_subprocess
+from mvc.utils import (size_string, duration_string, round_even,
+                       convert_path_for_subprocess)
 from mvc import openfiles
 
 BUTTON_FONT = widgetutil.font_scale_from_osx_points(15.0)
@@ -71,6 +75,19 @@ TEXT_SHADOW = widgetutil.css_to_color('#000000')
 
 TABLE_WIDTH, TABLE_HEIGHT = 470, 87
 
+# minimum seconds between redraws of the conversion table, so that a lot of
+# simultaneous conversions don't keep the UI thread busy redrawing
+UPDATE_INTERVAL = 0.1
+
+THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT = 90, 70
+# how much pixel memory to spend on thumbnails.  Thumbnails that don't fit
+# are reloaded from disk when they're drawn again.
+THUMBNAIL_CACHE_BYTES = 16 * 1024 * 1024
+
+thumbnail_surfaces = widgetutil.ImageSurfaceCache(
+    THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_CACHE_BYTES,
+    image_path('audio.png'))
+
 class CustomLabel(widgetset.Background):
     def __init__(self, text=''):
         widgetset.Background.__init__(self)
@@ -676,72 +693,130 @@ class ConversionModel(widgetset.TableModel):
             'numeric', # duration
             'numeric', # progress
             'numeric', # eta,
-            'object', # image
+            'object', # thumbnail path
             'object', # the actual conversion
             )
         self.conversion_to_iter = {}
-        self.thumbnail_to_image = {None: widgetset.Image(
-                image_path('audio.png'))}
+        # last values written to each row, so updates only touch the
+        # columns that changed
+        self.conversion_to_values = {}
+        self.conversion_to_thumbnail = {}
+        # aggregate state, kept up to date as rows change so that we never
+        # need to scan every conversion
+        self.filename_to_conversion = {}
+        self.conversion_to_status = {}
+        self.status_counts = collections.defaultdict(int)
 
     def conversions(self):
         return iter(self.conversion_to_iter)
 
+    def __contains__(self, conversion):
+        return conversion in self.conversion_to_iter
+
+    def get_by_filename(self, filename):
+        """Get the conversion for an input file, or None."""
+        return self.filename_to_conversion.get(filename)
+
+    def count_status(self, *statuses):
+        """Count the conversions that have any of the given statuses."""
+        return sum(self.status_counts[status] for status in statuses)
+
     def all_conversions_done(self):
-        has_conversions = any(self.conversions())
-        all_done = ((set(c.status for c in self.conversions()) -
-                     set(['canceled', 'finished', 'failed'])) == set())
-        return all_done and has_conversions
+        count = len(self.conversion_to_iter)
+        return bool(count) and self.count_status('canceled', 'finished',
+                                                 'failed') == count
 
-    def get_image(self, path):
-        if path not in self.thumbnail_to_image:
-            try:
-                image = widgetset.Image(path)
-            except ValueError:
-                image = self.thumbnail_to_image[None]
-            self.thumbnail_to_image[path] = image
-        return self.thumbnail_to_image[path]
+    def note_status(self, conversion):
+        """Update our status counts for a change to conversion.
 
-    def update_conversion(self, conversion):
-        try:
-            output_size = os.stat(conversion.output).st_size
-        except OSError:
-            output_size = 0
+        This is cheap, so it's called as soon as a conversion changes, even
+        though redrawing its row may be delayed.
+        """
+        if conversion not in self.conversion_to_iter:
+            return
+        old_status = self.conversion_to_status.get(conversion)
+        if old_status == conversion.status:
+            return
+        if old_status is not None:
+            self.status_counts[old_status] -= 1
+        self.status_counts[conversion.status] += 1
+        self.conversion_to_status[conversion] = conversion.status
+
+    def get_thumbnail(self, conversion):
+        if conversion in self.conversion_to_thumbnail:
+            return self.conversion_to_thumbnail[conversion]
 
         def complete():
             # needs to do it on the update_conversion() from app object
-            # which calls model_changed() and redraws for us
+            # which schedules the row to be redrawn
             app.widgetapp.update_conversion(conversion)
 
-        values = (conversion.video.filename,
-                  output_size,
-                  conversion.converter.name,
-                  conversion.status,
-                  conversion.duration or 0,
-                  conversion.progress or 0,
-                  conversion.eta or 0,
-                  self.get_image(conversion.video.get_thumbnail(complete, 90, 70)),
-                  conversion
-                  )
+        path = conversion.video.get_thumbnail(complete, THUMBNAIL_WIDTH,
+                                              THUMBNAIL_HEIGHT)
+        if path is not None or conversion.video.audio_only:
+            # once we have a thumbnail it doesn't change, so stop asking
+            self.conversion_to_thumbnail[conversion] = path
+        return path
+
+    def get_values(self, conversion):
+        if conversion.status == 'initialized':
+            # for queued conversions, show when they're expected to finish
+            eta = conversion.queue_eta
+        else:
+            eta = conversion.eta
+        return (conversion.video.filename,
+                conversion.output_size or 0,
+                conversion.converter.name,
+                conversion.status,
+                conversion.duration or 0,
+                conversion.progress or 0,
+                eta or 0,
+                self.get_thumbnail(conversion),
+                conversion
+                )
+
+    def update_conversion(self, conversion):
+        values = self.get_values(conversion)
         iter_ = self.conversion_to_iter.get(conversion)
         if iter_ is None:
             self.conversion_to_iter[conversion] = self.append(*values)
+            self.filename_to_conversion[conversion.video.filename] = conversion
         else:
-            self.update(iter_, *values)
+            old_values = self.conversion_to_values[conversion]
+            for index, value in enumerate(values):
+                if value != old_values[index]:
+                    self.update_value(iter_, index, value)
+        self.conversion_to_values[conversion] = values
+        self.note_status(conversion)
+
+    def update_conversions(self, conversions):
+        """Update the rows for several conversions at once.
+
+        Conversions that aren't in the model (for example because their row
+        was removed since they changed) are skipped.
+        """
+        for conversion in conversions:
+            if conversion in self.conversion_to_iter:
+                self.update_conversion(conversion)
+
+    def remove_conversions(self, conversions):
+        for conversion in conversions:
+            iter_ = self.conversion_to_iter.get(conversion)
+            if iter_ is not None:
+                self.remove(iter_)
 
     def remove(self, iter_):
         conversion = self[iter_][-1]
         del self.conversion_to_iter[conversion]
+        del self.conversion_to_values[conversion]
+        del self.filename_to_conversion[conversion.video.filename]
+        status = self.conversion_to_status.pop(conversion, None)
+        if status is not None:
+            self.status_counts[status] -= 1
 
-        # XXX If we add/remove too quickly, we could still be processing
-        # thumbnails and this may return null, and the self.thumbnail_to_image
-        # dictionary may get out of sync
-        def complete(path):
-            logging.info('calling completion handler for get_thumbnail on '
-                         'removal')
-
-        thumbnail_path = conversion.video.get_thumbnail(complete, 90, 70)
+        thumbnail_path = self.conversion_to_thumbnail.pop(conversion, None)
         if thumbnail_path:
-            del self.thumbnail_to_image[thumbnail_path]
+            thumbnail_surfaces.remove(thumbnail_path)
         return super(ConversionModel, self).remove(iter_)
 
 
@@ -836,7 +911,7 @@ class ConversionCellRenderer(widgetset.CustomCellRenderer):
         context.fill()
 
     def layout_left(self, layout_manager):
-        surface = widgetset.ImageSurface(self.thumbnail)
+        surface = thumbnail_surfaces.get(self.thumbnail)
         return cellpack.Padding(surface, 10, 10, 10, 10)
 
     def layout_right(self, layout_manager, hotspot):
@@ -861,7 +936,7 @@ class ConversionCellRenderer(widgetset.CustomCellRenderer):
 
     def layout_bottom(self, layout_manager, hotspot):
         layout_manager.set_text_color(TEXT_COLOR)
-        if self.status in ('converting', 'staging'):
+        if self.status in ('converting', 'paused', 'staging'):
             box = cellpack.HBox(spacing=5)
             stack = cellpack.Stack()
             stack.pack(cellpack.Alignment(self.progressbar_base,
@@ -883,8 +958,12 @@ class ConversionCellRenderer(widgetset.CustomCellRenderer):
         elif self.status == 'initialized': # queued
             vbox = cellpack.VBox()
             vbox.pack_space(2)
+            if self.eta:
+                text = "Queued - done in %s" % duration_string(self.eta)
+            else:
+                text = "Queued"
             vbox.pack(IconWithText(self.queued,
-                                   layout_manager.textbox("Queued")))
+                                   layout_manager.textbox(text)))
             return vbox
         elif self.status in ('finished', 'failed', 'canceled'):
             vbox = cellpack.VBox(spacing=5)
@@ -1023,6 +1102,13 @@ class Application(mvc.Application):
 	mvc.Application.__init__(self, simultaneous)
 	self.create_signal('window-shown')
 	self.sent_window_shown = False
+        # conversions whose rows need to be redrawn
+        self.dirty_conversions = set()
+        self.update_scheduled = False
+        self.last_update = 0
+        # what the queue ETA was computed for, see get_queue_eta()
+        self.queue_eta_key = None
+        self.queue_eta = None
 
     def startup(self):
         if self.started:
@@ -1156,7 +1242,10 @@ class Application(mvc.Application):
         vbox.pack_start(bottom)
         self.window.set_content_widget(vbox)
 
-        idle_add(self.conversion_manager.check_notifications, 1)
+        # worker threads wake us up when there's something to handle, rather
+        # than us polling for changes
+        self.conversion_manager.notify_queue.set_wakeup_callback(
+            lambda: idle_add(self.conversion_manager.check_notifications))
 
         self.window.connect('file-drag-motion', self.drag_motion)
         self.window.connect('file-drag-received', self.drag_data_received)
@@ -1175,7 +1264,8 @@ class Application(mvc.Application):
         ConverterInfo or list of ConverterInfos.
         """
         if menu_type == 'format':
-            order = ['Audio', 'Video', 'Ingest Formats', 'Same Format']
+            order = ['Audio', 'Video', 'Ingest Formats',
+                     'Adaptive Streaming', 'Same Format']
             options.sort(key=lambda (name, menu): order.index(name))
         else:
             options.sort()
@@ -1187,11 +1277,12 @@ class Application(mvc.Application):
         self.drop_target.set_in_drag(True)
 
     def drag_data_received(self, widget, values):
+        filenames = []
         for uri in values:
             parsed = urlparse.urlparse(uri)
             if parsed.scheme == 'file':
-                pathname = urllib.url2pathname(parsed.path)
-                self.file_activated(widget, pathname)
+                filenames.append(urllib.url2pathname(parsed.path))
+        self.files_activated(filenames)
 
     def on_window_shown(self, window):
 	# only emit window-shown once, even if our window gets shown, hidden,
@@ -1212,8 +1303,7 @@ class Application(mvc.Application):
         dialog = widgetset.FileOpenDialog('Choose Files...')
         dialog.set_select_multiple(True)
         if dialog.run() == 0: # success
-            for filename in dialog.get_filenames():
-                self.file_activated(None, filename)
+            self.files_activated(dialog.get_filenames())
         dialog.destroy()
 
     def about(self):
@@ -1250,17 +1340,30 @@ class Application(mvc.Application):
         menu = widgetset.ContextMenu(optionlist)
         menu.popup()
 
+    def get_queue_eta(self):
+        """Get the seconds until every conversion is done, or None.
+
+        Going through the queue is slow for long queues, so it's only done
+        again when the queue, our rows or the converter changed.
+        """
+        key = (self.conversion_manager.queue_changes, len(self.model),
+               self.current_converter)
+        if key != self.queue_eta_key:
+            self.queue_eta_key = key
+            self.queue_eta = self.conversion_manager.update_queue_estimates(
+                self.model.conversions())
+        return self.queue_eta
+
     def update_convert_button(self):
         can_cancel = False
         can_start = False
-        has_conversions = any(self.model.conversions())
+        has_conversions = len(self.model) > 0
         all_done = self.model.all_conversions_done()
-        for c in self.model.conversions():
-            if c.status == 'converting':
-                can_cancel = True
-                break
-            elif c.status == 'initialized':
-                can_start = True
+        queue_eta = self.get_queue_eta()
+        if self.model.count_status('converting', 'paused'):
+            can_cancel = True
+        elif self.model.count_status('initialized'):
+            can_start = True
         # if there are no conversions ... these can't be set
         if not has_conversions:
             for m in self.menus:
@@ -1280,7 +1383,12 @@ class Application(mvc.Application):
             self.convert_label.set_text('Convert to')
         elif can_cancel:
             target = self.current_converter.name
-            self.convert_label.set_text('Converting to %s' % target)
+            if queue_eta:
+                self.convert_label.set_text('Converting to %s (done in %s)' %
+                                            (target,
+                                             duration_string(queue_eta)))
+            else:
+                self.convert_label.set_text('Converting to %s' % target)
         elif can_start:
             target = self.current_converter.name
             self.convert_label.set_text('Will convert to %s' % target)
@@ -1307,35 +1415,63 @@ class Application(mvc.Application):
                 self.button_bar.disable()
 
     def file_activated(self, widget, filename):
-        filename = os.path.realpath(filename)
-        for c in self.model.conversions():
-            if c.video.filename == filename:
+        self.files_activated([filename])
+
+    def files_activated(self, filenames):
+        conversions = []
+        added = set()
+        for filename in filenames:
+            filename = os.path.realpath(filename)
+            if (filename in added or
+                self.model.get_by_filename(filename) is not None):
                 logger.info('ignoring duplicate: %r', filename)
-                return
-        # XXX disabled - don't want to allow individualized file outputs
-        # since the workflow isn't entirely clear for now.
-        #if self.options.options['destination'] is None:
-        #    try:
-        #        tempfile.TemporaryFile(dir=os.path.dirname(filename))
-        #    except EnvironmentError:
-        #        # can't write to the destination directory; ask for a new one
-        #        self.options.on_destination_clicked(None)
+                continue
+            # XXX disabled - don't want to allow individualized file outputs
+            # since the workflow isn't entirely clear for now.
+            #if self.options.options['destination'] is None:
+            #    try:
+            #        tempfile.TemporaryFile(dir=os.path.dirname(filename))
+            #    except EnvironmentError:
+            #        # can't write to the destination directory; ask for a new
+            #        # one
+            #        self.options.on_destination_clicked(None)
+            try:
+                vf = VideoFile(filename)
+            except ValueError:
+                logging.info('invalid file %r, cannot parse', filename,
+                        exc_info=True)
+                continue
+            c = self.conversion_manager.get_conversion(
+                vf,
+                self.current_converter,
+                output_dir=self.options.options['destination'])
+            c.listen(self.update_conversion)
+            if self.conversion_manager.running:
+                # start running automatically if a conversion is already in
+                # progress
+                self.conversion_manager.run_conversion(c)
+            added.add(filename)
+            conversions.append(c)
+        if conversions:
+            self.add_conversions(conversions)
+
+    def add_conversions(self, conversions):
+        self.table.start_bulk_change()
         try:
-            vf = VideoFile(filename)
-        except ValueError:
-            logging.info('invalid file %r, cannot parse', filename,
-                    exc_info=True)
-            return
-        c = self.conversion_manager.get_conversion(
-            vf,
-            self.current_converter,
-            output_dir=self.options.options['destination'])
-        c.listen(self.update_conversion)
-        if self.conversion_manager.running:
-            # start running automatically if a conversion is already in
-            # progress
-            self.conversion_manager.run_conversion(c)
-        self.update_conversion(c)
+            for c in conversions:
+                self.model.update_conversion(c)
+        finally:
+            self.table.model_changed()
+        self.update_table_size()
+
+    def remove_conversions(self, conversions):
+        for c in conversions:
+            self.dirty_conversions.discard(c)
+        self.table.start_bulk_change()
+        try:
+            self.model.remove_conversions(conversions)
+        finally:
+            self.table.model_changed()
         self.update_table_size()
 
     def on_select_converter(self, widget, identifier):
@@ -1354,9 +1490,6 @@ class Application(mvc.Application):
         #
         # XXX TODO: what happens if the state is 'failed'?  Should we reset?
         all_done = self.model.all_conversions_done()
-        if all_done:
-            for c in self.model.conversions():
-                c.status = 'initialized'
 
         if self.current_converter is not EMPTY_CONVERTER:
             self.convert_label.set_text(
@@ -1373,14 +1506,20 @@ class Application(mvc.Application):
         else:
             self.options.disable_custom_size()
 
+        if all_done:
+            # every row is going to change, so freeze the table until
+            # we're done
+            self.table.start_bulk_change()
+            for c in self.model.conversions():
+                c.status = 'initialized'
         for c in self.model.conversions():
             if c.status == 'initialized':
                 c.set_converter(self.current_converter)
-                self.model.update_conversion(c)
-
-        # We likely either reset the status or we've changed the conversion
-        # output so let's just reload the table model.
-        self.table.model_changed()
+                # We likely either reset the status or we've changed the
+                # conversion output, so redraw the row.
+                self.update_conversion(c)
+        if all_done:
+            self.flush_updates()
 
         self.update_convert_button()
 
@@ -1408,11 +1547,8 @@ class Application(mvc.Application):
                 # all done: no conversion job should be running at this point
                 all_done = self.model.all_conversions_done()
                 if all_done:
-                    # take stuff off one by one from the list until we have none!
-                    # might not be very efficient.
-                    iter_ = self.model.first_iter()
-                    while iter_ is not None:
-                        conversion = self.model[iter_][-1]
+                    conversions = list(self.model.conversions())
+                    for conversion in conversions:
                         if conversion.status in ('finished',
                                                  'failed',
                                                  'canceled',
@@ -1421,8 +1557,7 @@ class Application(mvc.Application):
                                 self.conversion_manager.remove(conversion)
                             except ValueError:
                                 pass
-                        iter_ = self.model.remove(iter_)
-                    self.update_table_size()
+                    self.remove_conversions(conversions)
         else:
             for conversion in self.model.conversions():
                 conversion.stop()
@@ -1432,8 +1567,31 @@ class Application(mvc.Application):
         self.convert_button.enable()
 
     def update_conversion(self, conversion):
-        self.model.update_conversion(conversion)
-        self.update_table_size()
+        """Schedule the row for conversion to be redrawn.
+
+        Rows are updated in batches, at most once every UPDATE_INTERVAL
+        seconds.
+        """
+        self.model.note_status(conversion)
+        self.dirty_conversions.add(conversion)
+        if self.update_scheduled:
+            return
+        self.update_scheduled = True
+        delay = self.last_update + UPDATE_INTERVAL - time.time()
+        if delay > 0:
+            timeout_add(delay, self.flush_updates)
+        else:
+            idle_add(self.flush_updates)
+
+    def flush_updates(self):
+        self.update_scheduled = False
+        self.last_update = time.time()
+        dirty, self.dirty_conversions = self.dirty_conversions, set()
+        self.model.update_conversions(dirty)
+        self.update_convert_button()
+        # on OS X, the table only redraws the changed rows when it's told
+        # the model changed
+        self.table.model_changed()
 
     def update_table_size(self):
         conversions = len(self.model)
@@ -1458,9 +1616,8 @@ class Application(mvc.Application):
             self.model.remove(iter_)
             self.update_table_size()
         elif name == 'show-log':
-            lines = ''.join(conversion.lines)
             d = TextDialog('Log', '', self.window)
-            d.set_text(lines)
+            d.set_text(conversion.log.get_text())
             try:
                 d.run()
             finally:
@@ -1,8 +1,8 @@
 import ctypes
-import itertools
 import logging
 import os
 import sys
+import threading
 
 def hms_to_seconds(hours, minutes, seconds):
     return (hours * 3600 +
@@ -126,61 +126,160 @@ class Matrix(object):
             yield self[column, i]
 
 
-class Cache(object):
-    def __init__(self, size):
-        self.size = size
+class LRUCache(object):
+    """Least recently used cache.
+
+    Entries are evicted, least recently used first, once the cache holds
+    more than max_size entries or once the total weight of its entries
+    goes over max_weight.  Both limits are optional.
+
+    Subclasses can implement create_new_value() to have get() create values
+    for missing keys.  All methods are thread safe.
+
+    :param max_size: maximum number of entries
+    :param max_weight: maximum total weight of the entries
+    :param weight: function that takes a value and returns its weight (for
+    example its size in bytes).  By default every entry weighs 1.
+
+    :attribute hits: number of lookups that found a valid entry
+    :attribute misses: number of lookups that didn't
+    :attribute evictions: number of entries dropped to stay within the limits
+    """
+    def __init__(self, max_size=None, max_weight=None, weight=None):
+        self.max_size = max_size
+        self.max_weight = max_weight
+        if weight is not None:
+            self.weight = weight
+        # key -> link in a circular doubly linked list, ordered from least
+        # to most recently used.  Links are
+        # [prev, next, key, value, weight, invalidator] lists rather than
+        # objects because that's noticeably faster.
         self.dict = {}
-        self.counter = itertools.count()
-        self.access_times = {}
-        self.invalidators = {}
+        self.root = root = []
+        root[:] = [root, root, None, None, 0, None]
+        self.total_weight = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def weight(self, value):
+        return 1
 
     def get(self, key, invalidator=None):
-        if key in self.dict:
-            existing_invalidator = self.invalidators[key]
-            if (existing_invalidator is None or
-                not existing_invalidator(key)):
-                self.access_times[key] = self.counter.next()
-                return self.dict[key]
+        """Get the value for key, creating it with create_new_value() if we
+        don't have a valid one.
 
+        :param invalidator: function that gets called with key on later
+        lookups.  If it returns True the entry is considered stale.
+        """
+        link = self._lookup(key)
+        if link is not None:
+            return link[3]
         value = self.create_new_value(key, invalidator=invalidator)
         self.set(key, value, invalidator=invalidator)
         return value
 
+    def find(self, key, default=None):
+        """Get the value for key if we have a valid one, otherwise
+        default.
+        """
+        link = self._lookup(key)
+        if link is None:
+            return default
+        return link[3]
+
+    def _lookup(self, key):
+        with self.lock:
+            link = self.dict.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            invalidator = link[5]
+        # the invalidator may stat files or use the cache itself, so it's
+        # called without holding the lock
+        if invalidator is not None and invalidator(key):
+            with self.lock:
+                if self.dict.get(key) is link:
+                    self._unlink(key)
+                self.misses += 1
+            return None
+        with self.lock:
+            root = self.root
+            if self.dict.get(key) is link and link[1] is not root:
+                # move the link to the most recently used end
+                link_prev, link_next = link[0], link[1]
+                link_prev[1] = link_next
+                link_next[0] = link_prev
+                last = root[0]
+                last[1] = root[0] = link
+                link[0] = last
+                link[1] = root
+            self.hits += 1
+        return link
+
     def set(self, key, value, invalidator=None):
-        if len(self.dict) == self.size:
-            self.shrink_size()
-        self.access_times[key] = self.counter.next()
-        self.dict[key] = value
-        self.invalidators[key] = invalidator
+        weight = self.weight(value)
+        with self.lock:
+            self._unlink(key)
+            root = self.root
+            last = root[0]
+            link = [last, root, key, value, weight, invalidator]
+            last[1] = root[0] = self.dict[key] = link
+            self.total_weight += weight
+            self._shrink()
+
+    def _unlink(self, key):
+        link = self.dict.pop(key, None)
+        if link is not None:
+            link_prev, link_next = link[0], link[1]
+            link_prev[1] = link_next
+            link_next[0] = link_prev
+            self.total_weight -= link[4]
 
     def remove(self, key):
-        if key in self.dict:
-            del self.dict[key]
-            del self.access_times[key]
-        if key in self.invalidators:
-            del self.invalidators[key]
+        with self.lock:
+            self._unlink(key)
+
+    def clear(self):
+        with self.lock:
+            self.dict.clear()
+            self.root[:] = [self.root, self.root, None, None, 0, None]
+            self.total_weight = 0
 
     def keys(self):
-        return self.dict.iterkeys()
-
-    def shrink_size(self):
-        # shrink by LRU
-        to_sort = self.access_times.items()
-        to_sort.sort(key=lambda m: m[1])
-        new_dict = {}
-        new_access_times = {}
-        new_invalidators = {}
-        latest_times = to_sort[len(self.dict) // 2:]
-        for (key, time) in latest_times:
-            new_dict[key] = self.dict[key]
-            new_invalidators[key] = self.invalidators[key]
-            new_access_times[key] = time
-        self.dict = new_dict
-        self.access_times = new_access_times
+        with self.lock:
+            return iter(self.dict.keys())
+
+    def __contains__(self, key):
+        return key in self.dict
+
+    def __len__(self):
+        return len(self.dict)
+
+    def _shrink(self):
+        root = self.root
+        while self.dict and (
+            (self.max_size is not None and len(self.dict) > self.max_size) or
+            (self.max_weight is not None and
+             self.total_weight > self.max_weight)):
+            self._unlink(root[1][2])
+            self.evictions += 1
+
+    def stats(self):
+        """Get a dict of statistics about the cache, for debugging."""
+        with self.lock:
+            return {'size': len(self.dict), 'weight': self.total_weight,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
 
     def create_new_value(self, val, invalidator=None):
         raise NotImplementedError()
 
+class Cache(LRUCache):
+    """LRUCache that holds at most size entries."""
+    def __init__(self, size):
+        LRUCache.__init__(self, max_size=size)
+        self.size = size
+
 
 def size_string(nbytes):
     # when switching from the enclosure reported size to the
@@ -204,6 +303,19 @@ def size_string(nbytes):
     else:
         return "%(size)s B" % {"size": nbytes}
 
+def duration_string(seconds):
+    """Format a number of seconds for the user, e.g. "1h 05m" or "3m 20s".
+    """
+    if seconds is None:
+        return ""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh %02dm" % (seconds // 3600, (seconds % 3600) // 60)
+    elif seconds >= 60:
+        return "%dm %02ds" % (seconds // 60, seconds % 60)
+    else:
+        return "%ds" % seconds
+
 def convert_path_for_subprocess(path):
     """Convert a path to a form suitable for passing to a subprocess.
 
@@ -228,3 +340,47 @@ def convert_path_for_subprocess(path):
         logging.info("convert_path_for_subprocess: got short path %r",
                 short_path_buf.value)
 	return short_path_buf.value.encode('ascii')
+
+def get_available_space(path):
+    """Get the number of bytes that can be written to the filesystem that
+    holds path.
+
+    :returns: bytes available, or None if we can't tell
+    """
+    try:
+        if sys.platform == 'win32':
+            free_bytes = ctypes.c_ulonglong(0)
+            if not ctypes.windll.kernel32.GetDiskFreeSpaceExW(
+                    unicode(path), ctypes.byref(free_bytes), None, None):
+                return None
+            return free_bytes.value
+        stat = os.statvfs(path)
+    except (EnvironmentError, AttributeError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+def get_filesystem_id(path):
+    """Get a value that's the same for all paths on one filesystem."""
+    if sys.platform == 'win32':
+        return os.path.splitdrive(os.path.abspath(path))[0].lower()
+    try:
+        return os.stat(path).st_dev
+    except EnvironmentError:
+        return path
+
+BITRATE_SUFFIXES = {'k': 1000, 'K': 1000, 'm': 1000000, 'M': 1000000}
+
+def parse_bitrate(value):
+    """Parse an ffmpeg bitrate like "96k" or "2M" into bits per second.
+
+    :returns: bits per second, or None if value isn't a bitrate
+    """
+    multiplier = BITRATE_SUFFIXES.get(value[-1:])
+    if multiplier is not None:
+        value = value[:-1]
+    else:
+        multiplier = 1
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return None
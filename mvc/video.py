@@ -1,16 +1,21 @@
 import logging
 import os
 import re
+import subprocess
 import tempfile
 import threading
 
 from mvc import execute
+from mvc import tracing
 from mvc.widgets import idle_add
 from mvc.settings import get_ffmpeg_executable_path
-from mvc.utils import hms_to_seconds, convert_path_for_subprocess
+from mvc.utils import hms_to_seconds, convert_path_for_subprocess, LRUCache
 
 logger = logging.getLogger(__name__)
 
+# (filepath, mtime, size) -> info dict from get_media_info()
+_media_info_cache = LRUCache(max_size=256)
+
 class VideoFile(object):
     def __init__(self, filename):
         self.filename = filename
@@ -59,6 +64,26 @@ class VideoFile(object):
 
         return self.thumbnails.get(key)
 
+class StreamVideoFile(VideoFile):
+    """VideoFile for a stream we can't seek in, like stdin.
+
+    The media info comes from probing the first bytes of the stream, which
+    the caller has already read (see get_stream_media_info()).  Thumbnails
+    aren't supported.
+
+    :param head: the start of the stream
+    """
+    def __init__(self, head, filename='-'):
+        self.head = head
+        VideoFile.__init__(self, filename)
+
+    def parse(self):
+        self.__dict__.update(get_stream_media_info(self.head))
+
+    def get_thumbnail(self, completion, width=None, height=None,
+                      type_='.png'):
+        return None
+
 class Node(object):
     def __init__(self, line="", children=None):
         self.line = line
@@ -251,11 +276,44 @@ def get_media_info(filepath):
     :returns: dict of media info possibly containing: height, width,
     container, audio_codec, video_codec
     """
+    try:
+        stat = os.stat(filepath)
+    except EnvironmentError:
+        key = None
+    else:
+        # include the mtime and size so that we re-probe changed files
+        key = (filepath, stat.st_mtime, stat.st_size)
+        info = _media_info_cache.find(key)
+        if info is not None:
+            return dict(info)
     logger.info('get_media_info: %r', filepath)
-    output = get_ffmpeg_output(filepath)
-    ast = parse_ffmpeg_output(output.splitlines())
-    info = extract_info(ast)
+    with tracing.span('probe', filename=filepath):
+        output = get_ffmpeg_output(filepath)
+        ast = parse_ffmpeg_output(output.splitlines())
+        info = extract_info(ast)
     logger.info('get_media_info: %r', info)
+    if key is not None:
+        _media_info_cache.set(key, dict(info))
+    return info
+
+def get_stream_media_info(head):
+    """Like get_media_info(), but for the start of a stream.
+
+    ffmpeg is given the bytes in head on stdin.  Streams usually don't say
+    how long they are, so there's often no duration.
+
+    :param head: the first bytes of the stream
+    :raises ValueError: if ffmpeg can't make sense of head
+    """
+    commandline = [get_ffmpeg_executable_path(), '-i', 'pipe:0']
+    logger.info('get_stream_media_info: %i bytes', len(head))
+    with tracing.span('probe', filename='-', head_bytes=len(head)):
+        popen = execute.Popen(commandline, stdin=subprocess.PIPE)
+        # ffmpeg stops reading once it has seen enough, which is fine
+        output, _ = popen.communicate(head)
+        ast = parse_ffmpeg_output(output.splitlines())
+        info = extract_info(ast)
+    logger.info('get_stream_media_info: %r', info)
     return info
 
 def get_thumbnail(filename, width, height, output, completion, skip=0):
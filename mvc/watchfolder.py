@@ -0,0 +1,443 @@
+"""watchfolder.py -- convert files as they show up in a directory.
+
+WatchFolder watches one or more directories and queues each new file on a
+converter once it has been completely written.  A file counts as complete
+when:
+  - the writer closes it (inotify's IN_CLOSE_WRITE), or it is renamed into
+    the directory (IN_MOVED_TO), which is how rsync and most copy tools
+    finish, or
+  - its size and mtime haven't changed for settle_time seconds.  This
+    covers files that were there when we started, and platforms without
+    inotify, where we poll the directories instead.
+
+Files that are handled are kept in a JSON record, keyed by path, with
+their size, mtime and converter.  After a restart, files that are in the
+record unchanged are skipped; ones that were queued but never finished are
+queued again.
+
+Only the top level of each directory is watched.
+"""
+
+import ctypes
+import errno
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import tempfile
+import time
+
+from mvc import execute
+from mvc.video import VideoFile
+
+logger = logging.getLogger(__name__)
+
+# seconds a file's size and mtime must stay the same before it's converted
+SETTLE_TIME = 5.0
+# seconds between scans when we can't use inotify
+POLL_INTERVAL = 2.0
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+# struct inotify_event, without the name that follows it
+EVENT_HEADER = struct.Struct('iIII')
+
+class PollingWatcher(object):
+    """Finds changes by listing the directories every few seconds.
+
+    :param directories: list of directories to watch
+    """
+    def __init__(self, directories, interval=POLL_INTERVAL):
+        self.directories = directories
+        self.interval = interval
+        self.last_scan = None
+
+    def fileno(self):
+        """Get a file descriptor that's readable when there are changes, or
+        None if there isn't one.
+        """
+        return None
+
+    def close(self):
+        pass
+
+    def get_timeout(self):
+        """Get the seconds until read_changes() has something to report."""
+        if self.last_scan is None:
+            return 0
+        return max(self.last_scan + self.interval - time.time(), 0)
+
+    def read_changes(self):
+        """Get the files that changed since the last call.
+
+        :returns: list of (path, complete) tuples.  complete is True if we
+        know the file was completely written.
+        """
+        if self.get_timeout() > 0:
+            return []
+        self.last_scan = time.time()
+        return [(path, False) for path in list_files(self.directories)]
+
+class InotifyWatcher(object):
+    """Finds changes with linux's inotify.
+
+    :raises EnvironmentError: if inotify isn't available
+    """
+    def __init__(self, directories):
+        libc = execute.get_libc()
+        if not sys.platform.startswith('linux') or libc is None:
+            raise EnvironmentError(errno.ENOSYS, 'inotify not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise EnvironmentError(ctypes.get_errno(), 'inotify_init1')
+        # watch descriptor -> directory
+        self.watches = {}
+        self.directories = directories
+        # report every file once at the start, like PollingWatcher does
+        self.rescan = True
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, directory.encode('utf8')
+                                        if isinstance(directory, unicode)
+                                        else directory, WATCH_MASK)
+            if wd < 0:
+                code = ctypes.get_errno()
+                self.close()
+                raise EnvironmentError(code, os.strerror(code), directory)
+            self.watches[wd] = directory
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def get_timeout(self):
+        return 0 if self.rescan else None
+
+    def read_changes(self):
+        changes = []
+        if self.rescan:
+            self.rescan = False
+            changes.extend((path, False)
+                           for path in list_files(self.directories))
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            changes.extend(self._parse_events(data))
+        return changes
+
+    def _parse_events(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # we missed events, look at everything again
+                logger.warn('inotify queue overflowed, rescanning')
+                for path in list_files(self.directories):
+                    yield path, False
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name or mask & (IN_ISDIR |
+                                                        IN_IGNORED):
+                continue
+            path = os.path.join(directory, name)
+            yield path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+
+def create_watcher(directories):
+    """Watch directories with inotify if we can, otherwise by polling."""
+    try:
+        return InotifyWatcher(directories)
+    except (EnvironmentError, AttributeError), e:
+        # AttributeError means libc has no inotify functions
+        logger.info('not using inotify (%s), polling instead', e)
+        return PollingWatcher(directories)
+
+def list_files(directories):
+    paths = []
+    for directory in directories:
+        try:
+            names = os.listdir(directory)
+        except EnvironmentError:
+            logger.warn("can't list %r", directory, exc_info=True)
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+def is_ignored(path):
+    """Should we leave this file alone?
+
+    Hidden files are skipped, since copy tools use them for files they
+    haven't finished writing (rsync writes to .name.XXXXXX).
+    """
+    name = os.path.basename(path)
+    return (name.startswith('.') or
+            name.endswith(('.part', '.partial', '.tmp', '.crdownload')))
+
+class WatchRecord(object):
+    """Record of the files a WatchFolder has handled, kept in a JSON file.
+
+    :param path: file to keep the record in, or None to only keep it in
+    memory
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (EnvironmentError, ValueError):
+                logger.warn('ignoring unreadable watch record %r', path,
+                            exc_info=True)
+
+    def get(self, path):
+        return self.entries.get(path)
+
+    def is_done(self, path, size, mtime, converter_id):
+        """Has this version of a file already been converted (or failed)?"""
+        entry = self.entries.get(path)
+        return (entry is not None and
+                entry['status'] in ('finished', 'failed') and
+                entry['size'] == size and entry['mtime'] == mtime and
+                entry['converter'] == converter_id)
+
+    def set(self, path, **entry):
+        self.entries.setdefault(path, {}).update(entry)
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        # write to a temp file and rename, so a crash never leaves a
+        # partial record
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                         prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f)
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path) # rename() doesn't replace on windows
+        os.rename(temp_path, self.path)
+
+class WatchFolder(object):
+    """Queues files from watched directories on a converter.
+
+    :param conversion_manager: ConversionManager to run the conversions
+    with
+    :param converter: ConverterInfo to convert the files with
+    :param directories: list of directories to watch
+    :param record_path: JSON file to record handled files in, so they
+    aren't converted again after a restart
+    :param output_dir: directory to write the conversions to; it can't be
+    one of the watched directories
+    :param settle_time: seconds a file must stay the same before we take it
+    :param watcher: PollingWatcher or InotifyWatcher, defaults to
+    create_watcher(directories)
+    """
+    def __init__(self, conversion_manager, converter, directories,
+                 record_path=None, output_dir=None, settle_time=SETTLE_TIME,
+                 watcher=None):
+        directories = [os.path.abspath(d) for d in directories]
+        if output_dir is not None:
+            output_dir = os.path.abspath(output_dir)
+            if output_dir in directories:
+                raise ValueError("can't watch the output directory %r" % (
+                        output_dir,))
+        self.conversion_manager = conversion_manager
+        self.converter = converter
+        self.directories = directories
+        self.output_dir = output_dir
+        self.settle_time = settle_time
+        self.record = WatchRecord(record_path)
+        if watcher is None:
+            watcher = create_watcher(directories)
+        self.watcher = watcher
+        # path -> (size, mtime, time the size or mtime last changed)
+        self.pending = {}
+        # path -> conversion, for files being converted
+        self.conversions = {}
+        # functions to call with each conversion we start
+        self.callbacks = []
+
+    def close(self):
+        """Stop watching.
+
+        Conversions that are still running are left in the record as
+        queued, so they're started again the next time we watch.
+        """
+        self.watcher.close()
+        for conversion in self.conversions.values():
+            conversion.unlisten(self.conversion_changed)
+        self.conversions = {}
+
+    def stop_conversions(self):
+        """Stop the conversions we started that are still running or
+        queued.
+
+        They're recorded as canceled (or stay queued, if we're closed
+        before we hear back), so they're started again the next time we
+        watch.  Conversions that are already being moved to the output
+        directory are left to finish.
+
+        :returns: list of the conversions that were stopped
+        """
+        stopped = []
+        for conversion in self.conversions.values():
+            if conversion.status in ('initialized', 'converting', 'paused'):
+                conversion.stop()
+                stopped.append(conversion)
+        return stopped
+
+    def add_callback(self, callback):
+        """Call callback(conversion) for each conversion we start."""
+        self.callbacks.append(callback)
+
+    def poll(self, timeout=None):
+        """Wait for changes, and queue the files that are ready.
+
+        Besides our own changes, this also returns early when the
+        conversion manager has notifications, so the caller can handle them
+        with check_notifications().
+
+        :param timeout: longest time to wait, in seconds
+        :returns: list of conversions that were started
+        """
+        self._wait(timeout)
+        now = time.time()
+        for path, complete in self.watcher.read_changes():
+            self.file_changed(path, complete, now)
+        return self.check_pending(now)
+
+    def _wait(self, timeout):
+        timeouts = [t for t in (timeout, self.watcher.get_timeout(),
+                                self._get_settle_timeout())
+                    if t is not None]
+        timeout = min(timeouts) if timeouts else None
+        if timeout == 0:
+            return
+        fds = [fd for fd in (self.watcher.fileno(),
+                             self.conversion_manager.notify_queue.fileno())
+               if fd is not None]
+        if not fds:
+            time.sleep(timeout)
+            return
+        try:
+            select.select(fds, [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+    def _get_settle_timeout(self):
+        if not self.pending:
+            return None
+        first = min(changed_at for size, mtime, changed_at
+                    in self.pending.values())
+        return max(first + self.settle_time - time.time(), 0)
+
+    def file_changed(self, path, complete, now):
+        """Note that a file changed.
+
+        :param complete: do we know the file was completely written?
+        """
+        if is_ignored(path) or path in self.conversions:
+            return
+        try:
+            stat = os.stat(path)
+        except EnvironmentError:
+            # deleted or renamed away
+            self.pending.pop(path, None)
+            return
+        size, mtime = stat.st_size, stat.st_mtime
+        if self.record.is_done(path, size, mtime, self.converter.identifier):
+            return
+        old = self.pending.get(path)
+        if complete:
+            # the writer is done with it, don't wait
+            changed_at = now - self.settle_time
+        elif old is not None and old[:2] == (size, mtime):
+            changed_at = old[2]
+        else:
+            changed_at = now
+        self.pending[path] = (size, mtime, changed_at)
+
+    def check_pending(self, now=None):
+        """Queue the pending files that have settled.
+
+        :returns: list of conversions that were started
+        """
+        if now is None:
+            now = time.time()
+        started = []
+        for path, (size, mtime, changed_at) in sorted(self.pending.items()):
+            if now - changed_at < self.settle_time:
+                continue
+            del self.pending[path]
+            conversion = self.start_conversion(path, size, mtime)
+            if conversion is not None:
+                started.append(conversion)
+        return started
+
+    def start_conversion(self, path, size, mtime):
+        logger.info('watch folder: converting %r', path)
+        entry = {'size': size, 'mtime': mtime,
+                 'converter': self.converter.identifier}
+        try:
+            video = VideoFile(path)
+        except ValueError:
+            logger.warn('watch folder: could not parse %r', path)
+            self.record.set(path, status='failed',
+                            error='could not parse %r' % (path,), **entry)
+            return None
+        conversion = self.conversion_manager.get_conversion(
+            video, self.converter, output_dir=self.output_dir)
+        self.conversions[path] = conversion
+        self.record.set(path, status='queued', output=conversion.output,
+                        error=None, **entry)
+        conversion.listen(self.conversion_changed)
+        for callback in self.callbacks:
+            callback(conversion)
+        self.conversion_manager.run_conversion(conversion)
+        return conversion
+
+    def conversion_changed(self, conversion):
+        if conversion.status not in ('finished', 'failed', 'canceled'):
+            return
+        path = conversion.video.filename
+        if self.conversions.get(path) is not conversion:
+            return
+        del self.conversions[path]
+        conversion.unlisten(self.conversion_changed)
+        if conversion.status == 'canceled':
+            # try again next time we start
+            self.record.set(path, status='canceled')
+        else:
+            self.record.set(path, status=conversion.status,
+                            error=conversion.error)
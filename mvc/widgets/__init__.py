@@ -14,6 +14,7 @@ mainloop_start = plat.mainloop_start
 mainloop_stop = plat.mainloop_stop
 idle_add = plat.idle_add
 idle_remove = plat.idle_remove
+timeout_add = plat.timeout_add
 reveal_file = plat.reveal_file
 get_conversion_directory = plat.get_conversion_directory
 
@@ -33,6 +33,13 @@ def idle_add(callback, periodic=None):
         delay = 0
     return gobject.timeout_add(delay, wrapper)
 
+def timeout_add(delay, callback):
+    """Call callback once, after delay seconds."""
+    def wrapper():
+        callback()
+        return False
+    return gobject.timeout_add(int(delay * 1000), wrapper)
+
 def idle_remove(id_):
     gobject.source_remove(id_)
 
@@ -42,16 +42,19 @@ from mvc import utils
 
 use_native_buttons = False # not implemented in MVC
 
-class FontCache(utils.Cache):
+class FontCache(utils.LRUCache):
     def get(self, context, description, scale_factor, bold, italic):
         key = (context, description, scale_factor, bold, italic)
-        return utils.Cache.get(self, key)
+        return utils.LRUCache.get(self, key)
 
     def create_new_value(self, key, invalidator=None):
         (context, description, scale_factor, bold, italic) = key
         return Font(context, description, scale_factor, bold, italic)
 
-_font_cache = FontCache(512)
+_font_cache = FontCache(max_size=512)
+
+# maximum number of pango layouts each LayoutManager keeps around for reuse
+LAYOUT_CACHE_SIZE = 2000
 
 class LayoutManager(object):
     def __init__(self, widget):
@@ -61,6 +64,9 @@ class LayoutManager(object):
         widget.connect('style-set', self.on_style_set)
         widget.connect('direction-changed', self.on_direction_changed)
         self.widget = widget
+        # shaped pango layouts shared between TextBoxes that display the
+        # same text the same way.  See TextBox.get_layout_key().
+        self.layout_cache = utils.LRUCache(max_size=LAYOUT_CACHE_SIZE)
         self.reset()
 
     def reset(self):
@@ -71,12 +77,14 @@ class LayoutManager(object):
     def on_style_set(self, widget, previous_style):
         old_font_desc = self.style_font_desc
         self.update_style(widget.style)
+        self.layout_cache.clear()
         if self.style_font_desc != old_font_desc:
             # bug #17423 font changed, so the widget's width might have changed
             widget.queue_resize()
 
     def on_direction_changed(self, widget, previous_direction):
         self.update_direction(widget.get_direction())
+        self.layout_cache.clear()
 
     def update_style(self, style):
         self.style_font_desc = style.font_desc
@@ -103,7 +111,7 @@ class LayoutManager(object):
 
     def textbox(self, text, underline=False):
         textbox = TextBox(self.pango_context, self.current_font,
-                self.text_color, self.text_shadow)
+                self.text_color, self.text_shadow, self.layout_cache)
         textbox.set_text(text, underline=underline)
         return textbox
 
@@ -151,18 +159,38 @@ class Font(object):
                 pango.PIXELS(metrics.get_descent()) + 1)
 
 class TextBox(object):
-    def __init__(self, context, font, color, shadow):
-        self.layout = pango.Layout(context)
-        self.layout.set_wrap(pango.WRAP_WORD_CHAR)
+    """Text drawn with pango.
+
+    TextBoxes are cheap to create.  The pango layout is only built when the
+    text is measured or drawn, and if a layout cache is given, layouts are
+    shared with other TextBoxes that have the same text, attributes, font,
+    wrapping and width.  Layouts in the cache are never changed; changing
+    a TextBox makes it pick up a different layout instead.
+    """
+    def __init__(self, context, font, color, shadow, layout_cache=None):
+        self.context = context
         self.font = font
         self.color = color
-        self.layout.set_font_description(font.description.copy())
         self.width = self.height = None
         self.shadow = shadow
+        self.wrap = 'word'
+        self.alignment = 'left'
+        self.layout_cache = layout_cache
+        self._layout = None
+
+    def _get_layout(self):
+        if self._layout is None:
+            self.ensure_layout()
+        return self._layout
+    layout = property(_get_layout)
+
+    def _changed(self):
+        self._layout = None
 
     def set_text(self, text, font=None, color=None, underline=False):
         self.text_chunks = []
         self.attributes = []
+        self.attribute_keys = []
         self.text_length = 0
         self.underlines = []
         self.append_text(text, font, color, underline)
@@ -176,6 +204,8 @@ class TextBox(object):
         if font is not None:
             attr = pango.AttrFontDesc(font.description, startpos, endpos)
             self.attributes.append(attr)
+            self.attribute_keys.append(('font', font.description.to_string(),
+                                        startpos, endpos))
         if underline:
             self.underlines.append((startpos, endpos))
         if color:
@@ -184,14 +214,14 @@ class TextBox(object):
             attr = pango.AttrForeground(convert(color[0]), convert(color[1]),
                     convert(color[2]), startpos, endpos)
             self.attributes.append(attr)
-        self.text_set = False
+            self.attribute_keys.append(('color', tuple(color), startpos,
+                                        endpos))
+        self._changed()
 
     def set_width(self, width):
-        if width is not None:
-            self.layout.set_width(int(width * pango.SCALE))
-        else:
-            self.layout.set_width(-1)
-        self.width = width
+        if width != self.width:
+            self.width = width
+            self._changed()
 
     def set_height(self, height):
         # if height is not None:
@@ -199,41 +229,82 @@ class TextBox(object):
         #     # isn't
         #     pygtkhacks.set_pango_layout_height(self.layout,
         #         int(height * pango.SCALE))
-        self.height = height
+        if height != self.height:
+            self.height = height
+            if self.text_length > 100:
+                # the height changes how much text we pass to pango
+                self._changed()
 
     def set_wrap_style(self, wrap):
-        if wrap == 'word':
-            self.layout.set_wrap(pango.WRAP_WORD_CHAR)
-        elif wrap == 'char' or wrap == 'truncated-char':
-            self.layout.set_wrap(pango.WRAP_CHAR)
-        else:
+        if wrap not in ('word', 'char', 'truncated-char'):
             raise ValueError("Unknown wrap value: %s" % wrap)
-        if wrap == 'truncated-char':
-            self.layout.set_ellipsize(pango.ELLIPSIZE_END)
-        else:
-            self.layout.set_ellipsize(pango.ELLIPSIZE_NONE)
+        if wrap != self.wrap:
+            self.wrap = wrap
+            self._changed()
 
     def set_alignment(self, align):
-        if align == 'left':
-            self.layout.set_alignment(pango.ALIGN_LEFT)
-        elif align == 'right':
-            self.layout.set_alignment(pango.ALIGN_RIGHT)
-        elif align == 'center':
-            self.layout.set_alignment(pango.ALIGN_CENTER)
-        else:
+        if align not in ('left', 'right', 'center'):
             raise ValueError("Unknown align value: %s" % align)
+        if align != self.alignment:
+            self.alignment = align
+            self._changed()
+
+    def get_text(self):
+        text = ''.join(self.text_chunks)
+        if len(text) > 100:
+            text = text[:self._calc_text_cutoff()]
+        return text
+
+    def get_layout_key(self, text):
+        """Get the key for our layout in the layout cache.
+
+        This includes everything that changes how pango shapes the text,
+        but not the color and shadow, which are only used when drawing.
+        """
+        return (text, tuple(self.attribute_keys), self.font, self.wrap,
+                self.alignment, self.width)
 
     def ensure_layout(self):
-        if not self.text_set:
-            text = ''.join(self.text_chunks)
-            if len(text) > 100:
-                text = text[:self._calc_text_cutoff()]
-            self.layout.set_text(text)
-            attr_list = pango.AttrList()
-            for attr in self.attributes:
-                attr_list.insert(attr)
-            self.layout.set_attributes(attr_list)
-            self.text_set = True
+        if self._layout is not None:
+            return
+        text = self.get_text()
+        if self.layout_cache is None:
+            self._layout = self._make_layout(text)
+            return
+        key = self.get_layout_key(text)
+        layout = self.layout_cache.find(key)
+        if layout is None:
+            layout = self._make_layout(text)
+            self.layout_cache.set(key, layout)
+        self._layout = layout
+
+    def _make_layout(self, text):
+        layout = pango.Layout(self.context)
+        layout.set_font_description(self.font.description.copy())
+        if self.wrap == 'word':
+            layout.set_wrap(pango.WRAP_WORD_CHAR)
+        else:
+            layout.set_wrap(pango.WRAP_CHAR)
+        if self.wrap == 'truncated-char':
+            layout.set_ellipsize(pango.ELLIPSIZE_END)
+        else:
+            layout.set_ellipsize(pango.ELLIPSIZE_NONE)
+        if self.alignment == 'right':
+            layout.set_alignment(pango.ALIGN_RIGHT)
+        elif self.alignment == 'center':
+            layout.set_alignment(pango.ALIGN_CENTER)
+        else:
+            layout.set_alignment(pango.ALIGN_LEFT)
+        if self.width is not None:
+            layout.set_width(int(self.width * pango.SCALE))
+        else:
+            layout.set_width(-1)
+        layout.set_text(text)
+        attr_list = pango.AttrList()
+        for attr in self.attributes:
+            attr_list.insert(attr)
+        layout.set_attributes(attr_list)
+        return layout
 
     def _calc_text_cutoff(self):
         """This method is a bit of a hack...  GTK slows down if we pass too
@@ -58,6 +58,11 @@ def idle_add(callback, periodic=None):
         AppHelper.callAfter(wrapper)
     del pool
 
+def timeout_add(delay, callback):
+    pool = NSAutoreleasePool.alloc().init()
+    AppHelper.callLater(delay, callback)
+    del pool
+
 def idle_remove(id_):
     pass
 
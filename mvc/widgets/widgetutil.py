@@ -1,4 +1,6 @@
+import logging
 from math import pi as PI
+from mvc import utils
 from mvc.widgets import widgetset
 from mvc.resources import image_path
 
@@ -223,3 +225,44 @@ class ThreeImageSurface(object):
 
         self.center.draw(context, x, y, center_width, self.height, fraction)
         self.right.draw(context, x + center_width, y, right_width, self.height, fraction)
+
+class ImageSurfaceCache(utils.LRUCache):
+    """Cache of ImageSurfaces for image files, pre-scaled to fit inside
+    width x height.
+
+    The cache is bounded by max_bytes, an estimate of the pixel memory used
+    by the surfaces, and evicts the least recently used surfaces first.
+    Looking up None, or a file that can't be loaded, returns the surface for
+    default_path, which is drawn at its natural size and never evicted.
+    """
+    def __init__(self, width, height, max_bytes, default_path):
+        utils.LRUCache.__init__(self, max_weight=max_bytes)
+        self.width = width
+        self.height = height
+        self.default_path = default_path
+        self.default_surface = None
+
+    def weight(self, surface):
+        # 4 bytes per pixel for ARGB surfaces
+        return int(surface.width * surface.height * 4)
+
+    def get(self, path):
+        if path is None:
+            return self.get_default()
+        return utils.LRUCache.get(self, path)
+
+    def get_default(self):
+        if self.default_surface is None:
+            self.default_surface = widgetset.ImageSurface(
+                widgetset.Image(self.default_path))
+        return self.default_surface
+
+    def create_new_value(self, path, invalidator=None):
+        try:
+            image = widgetset.Image(path)
+        except ValueError:
+            logging.warn('error loading image %r', path, exc_info=True)
+            return self.get_default()
+        if image.width > self.width or image.height > self.height:
+            image = image.resize_for_space(self.width, self.height)
+        return widgetset.ImageSurface(image)
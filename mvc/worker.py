@@ -0,0 +1,208 @@
+"""worker.py -- run conversions on several machines.
+
+A Coordinator pushes conversions to a shared JobQueue (see mvc.jobqueue)
+instead of running them, and Workers on other machines claim the jobs, run
+them with their own ConversionManager and report back.  The coordinator
+copies the reports to its Conversion objects, so code that watches
+conversions doesn't need to know where they run.
+
+Input and output paths are passed as they are, so every machine must see
+the shared filesystem at the same path.
+"""
+
+import copy
+import logging
+import os
+import socket
+import time
+
+from mvc.video import VideoFile
+
+logger = logging.getLogger(__name__)
+
+# seconds between progress reports for a job
+REPORT_INTERVAL = 1.0
+# a claimed job is given to another worker if its worker hasn't reported for
+# this many seconds
+STALE_TIMEOUT = 120.0
+
+class Worker(object):
+    """Claims jobs from a queue and runs them.
+
+    :param queue: JobQueue to take jobs from
+    :param converter_manager: ConverterManager to look up converters in
+    :param conversion_manager: ConversionManager to run the jobs with
+    :param worker_id: name for this worker, defaults to the host name and
+    process id
+    :param max_jobs: number of jobs to run at once, defaults to the
+    conversion manager's simultaneous setting
+    """
+    def __init__(self, queue, converter_manager, conversion_manager,
+                 worker_id=None, max_jobs=None, poll_interval=2.0):
+        self.queue = queue
+        self.converter_manager = converter_manager
+        self.conversion_manager = conversion_manager
+        if worker_id is None:
+            worker_id = '%s:%i' % (socket.gethostname(), os.getpid())
+        self.worker_id = worker_id
+        if max_jobs is None:
+            max_jobs = conversion_manager.simultaneous or 1
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        # conversion -> job id
+        self.jobs = {}
+        # conversion -> (status, time) of the last report we sent
+        self.last_report = {}
+        self.stopped = False
+
+    def run(self, exit_when_idle=False):
+        """Run jobs until stop() is called.
+
+        :param exit_when_idle: return once the queue is empty and our jobs
+        are finished
+        """
+        logger.info('worker %s starting', self.worker_id)
+        while not self.stopped:
+            self.claim_jobs()
+            if exit_when_idle and not self.jobs:
+                break
+            self.conversion_manager.wait_for_notifications(self.poll_interval)
+            self.conversion_manager.check_notifications()
+            self.send_heartbeats()
+        logger.info('worker %s stopping', self.worker_id)
+
+    def stop(self):
+        self.stopped = True
+
+    def count_busy(self):
+        # conversions that are staging are done with the CPU
+        return len([c for c in self.jobs if c.status != 'staging'])
+
+    def claim_jobs(self):
+        while self.count_busy() < self.max_jobs:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                return
+            self.start_job(job)
+
+    def make_conversion(self, job):
+        """Create a Conversion from a job description.
+
+        The converter is copied, so that jobs with different sizes can run
+        at once.
+        """
+        converter = copy.copy(self.converter_manager.get_by_id(
+                job['converter']))
+        converter.width = job.get('width', converter.width)
+        converter.height = job.get('height', converter.height)
+        converter.dont_upsize = job.get('dont_upsize', converter.dont_upsize)
+        video = VideoFile(job['filename'])
+        conversion = self.conversion_manager.get_conversion(
+            video, converter, output_dir=job.get('output_dir'),
+            priority=job.get('priority', 0))
+        conversion.nice = job.get('nice')
+        conversion.io_class = job.get('io_class')
+        return conversion
+
+    def start_job(self, job):
+        logger.info('worker %s running job %s (%s)', self.worker_id,
+                    job['id'], job.get('filename'))
+        try:
+            conversion = self.make_conversion(job)
+        except KeyError:
+            self.queue.complete(job['id'], {
+                'status': 'failed',
+                'error': 'unknown converter %r' % (job.get('converter'),)})
+            return
+        except ValueError:
+            self.queue.complete(job['id'], {
+                'status': 'failed',
+                'error': 'could not parse %r' % (job.get('filename'),)})
+            return
+        self.jobs[conversion] = job['id']
+        conversion.listen(self.conversion_changed)
+        self.conversion_manager.run_conversion(conversion)
+
+    def conversion_changed(self, conversion):
+        job_id = self.jobs.get(conversion)
+        if job_id is None:
+            return
+        if conversion.status in ('finished', 'failed', 'canceled'):
+            self.queue.complete(job_id, conversion.get_report())
+            conversion.unlisten(self.conversion_changed)
+            del self.jobs[conversion]
+            self.last_report.pop(conversion, None)
+            return
+        last_status, last_time = self.last_report.get(conversion, (None, 0))
+        if (conversion.status != last_status or
+            time.time() - last_time >= REPORT_INTERVAL):
+            self.send_report(conversion)
+
+    def send_report(self, conversion):
+        self.queue.update(self.jobs[conversion], conversion.get_report())
+        self.last_report[conversion] = (conversion.status, time.time())
+
+    def send_heartbeats(self):
+        """Report on jobs that haven't changed lately, and stop the ones
+        that were canceled.
+        """
+        now = time.time()
+        for conversion, job_id in self.jobs.items():
+            if self.queue.is_canceled(job_id):
+                conversion.stop()
+                continue
+            last_time = self.last_report.get(conversion, (None, 0))[1]
+            if now - last_time >= REPORT_INTERVAL:
+                self.send_report(conversion)
+
+class Coordinator(object):
+    """Sends conversions to a job queue and follows their progress.
+
+    :param queue: JobQueue to submit to
+    """
+    def __init__(self, queue, poll_interval=1.0, stale_timeout=STALE_TIMEOUT):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        # job id -> conversion
+        self.jobs = {}
+        # job id -> last report we applied
+        self.reports = {}
+
+    def submit(self, conversion):
+        job = conversion.get_job_description()
+        self.queue.submit(job)
+        self.jobs[job['id']] = conversion
+        return job['id']
+
+    def cancel(self, conversion):
+        for job_id, c in self.jobs.items():
+            if c is conversion:
+                self.queue.cancel(job_id)
+
+    def poll(self):
+        """Copy the latest reports to our conversions.
+
+        Conversions that changed are notified as if they ran locally.
+        """
+        for job_id, conversion in self.jobs.items():
+            record = self.queue.get(job_id)
+            if record is None:
+                continue
+            report = record['report']
+            if report is not None and report != self.reports.get(job_id):
+                self.reports[job_id] = report
+                conversion.apply_report(report)
+                conversion.notify_listeners()
+            if record['state'] == 'done':
+                del self.jobs[job_id]
+                self.reports.pop(job_id, None)
+        self.queue.requeue_stale(self.stale_timeout)
+
+    def wait(self, conversion_manager):
+        """Follow our jobs until they're all done."""
+        while self.jobs:
+            self.poll()
+            conversion_manager.wait_for_notifications(self.poll_interval)
+            conversion_manager.check_notifications()
+        conversion_manager.check_notifications()
@@ -0,0 +1,55 @@
+"""writebehind.py -- copy finished outputs to their destination in the
+background.
+
+When conversions are written to a scratch directory on fast local storage,
+moving the result to its destination (which may be a slow network share)
+can take a while.  WriteBehindQueue runs those moves on a small pool of
+threads, so that the encoder slot a conversion held can be given to the next
+conversion right away.
+"""
+
+import logging
+import Queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue(object):
+    """Runs functions on a bounded pool of background threads.
+
+    :param workers: maximum number of functions to run at once
+    """
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        # number of jobs submitted that haven't finished yet
+        self.pending = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.pending
+
+    def submit(self, func, *args):
+        """Schedule func(*args) to run on one of our threads."""
+        with self.lock:
+            self.pending += 1
+            if len(self.threads) < min(self.pending, self.workers):
+                thread = threading.Thread(
+                    target=self._thread,
+                    name='WriteBehind:%i' % (len(self.threads),))
+                thread.setDaemon(True)
+                self.threads.append(thread)
+                thread.start()
+        self.queue.put((func, args))
+
+    def _thread(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except StandardError:
+                logger.exception('in write-behind job %r', func)
+            with self.lock:
+                self.pending -= 1
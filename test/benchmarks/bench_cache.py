@@ -0,0 +1,116 @@
+"""Benchmark utils.LRUCache against the cache class it replaced.
+
+Usage: python test/benchmarks/bench_cache.py [size] [lookups] [cost]
+
+cost is how many loop iterations creating a value takes, to simulate
+expensive values like fonts and text layouts.
+"""
+
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from mvc import utils
+
+class OldCache(object):
+    """utils.Cache as it was before LRUCache, for comparison."""
+    def __init__(self, size):
+        self.size = size
+        self.dict = {}
+        self.counter = itertools.count()
+        self.access_times = {}
+        self.invalidators = {}
+
+    def get(self, key, invalidator=None):
+        if key in self.dict:
+            existing_invalidator = self.invalidators[key]
+            if (existing_invalidator is None or
+                not existing_invalidator(key)):
+                self.access_times[key] = self.counter.next()
+                return self.dict[key]
+
+        value = self.create_new_value(key, invalidator=invalidator)
+        self.set(key, value, invalidator=invalidator)
+        return value
+
+    def set(self, key, value, invalidator=None):
+        if len(self.dict) == self.size:
+            self.shrink_size()
+        self.access_times[key] = self.counter.next()
+        self.dict[key] = value
+        self.invalidators[key] = invalidator
+
+    def shrink_size(self):
+        to_sort = self.access_times.items()
+        to_sort.sort(key=lambda m: m[1])
+        new_dict = {}
+        new_access_times = {}
+        new_invalidators = {}
+        latest_times = to_sort[len(self.dict) // 2:]
+        for (key, time) in latest_times:
+            new_dict[key] = self.dict[key]
+            new_invalidators[key] = self.invalidators[key]
+            new_access_times[key] = time
+        self.dict = new_dict
+        self.access_times = new_access_times
+
+def make_value(key, cost, counter):
+    counter[0] += 1
+    for i in xrange(cost):
+        pass
+    return key
+
+class OldKeyCache(OldCache):
+    def __init__(self, size, cost):
+        OldCache.__init__(self, size)
+        self.cost = cost
+        self.created = [0]
+
+    def create_new_value(self, key, invalidator=None):
+        return make_value(key, self.cost, self.created)
+
+class NewKeyCache(utils.LRUCache):
+    def __init__(self, size, cost):
+        utils.LRUCache.__init__(self, max_size=size)
+        self.cost = cost
+        self.created = [0]
+
+    def create_new_value(self, key, invalidator=None):
+        return make_value(key, self.cost, self.created)
+
+def bench(cache, keys):
+    """Look up keys in cache.
+
+    :returns: (total time, slowest single lookup) tuple
+    """
+    slowest = 0
+    start = time.time()
+    for key in keys:
+        before = time.time()
+        cache.get(key)
+        slowest = max(slowest, time.time() - before)
+    return time.time() - start, slowest
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 512
+    lookups = int(argv[2]) if len(argv) > 2 else 200000
+    cost = int(argv[3]) if len(argv) > 3 else 0
+    rand = random.Random(0)
+    # a working set a bit bigger than the cache, with a hot subset, which is
+    # what the font and layout caches see while scrolling
+    keys = [int(rand.paretovariate(1.2) * size / 4) for i in xrange(lookups)]
+    for name, cache in (('old Cache', OldKeyCache(size, cost)),
+                        ('LRUCache', NewKeyCache(size, cost))):
+        elapsed, slowest = bench(cache, keys)
+        print ('%-10s %8.0f lookups/s, %5.1f%% misses, slowest lookup '
+               '%.0f us' % (name, lookups / elapsed,
+                            100.0 * cache.created[0] / lookups,
+                            slowest * 1e6))
+    print 'LRUCache stats: %r' % (cache.stats(),)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,203 @@
+"""End-to-end encode speed of the registered converters.
+
+Usage: python test/benchmarks/bench_converters.py [options]
+
+Synthetic inputs are generated with ffmpeg's lavfi sources (testsrc2 and
+sine), so every run, on every host, converts the same material.  Inputs are
+kept in the work directory and reused by later runs.  Each input is run
+through each selected converter with ConversionManager, one at a time by
+default, and the fps, CPU time, output size and wall time of every run are
+written to a JSON report.
+
+Pass --baseline with an earlier report to compare against it; runs whose
+speed dropped by more than --threshold are listed as regressions.
+"""
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from mvc import conversion
+from mvc import converter
+from mvc import settings
+from mvc.video import VideoFile
+
+parser = optparse.OptionParser(usage='%prog [options]')
+parser.add_option('-c', '--converter', action='append', dest='converters',
+                  help="Converter id to run (can be given more than once, "
+                  "default: all converters).")
+parser.add_option('-m', '--match', dest='match',
+                  help="Only run converters whose id contains this string.")
+parser.add_option('-r', '--resolutions', dest='resolutions',
+                  default='640x360,1280x720,1920x1080',
+                  help="Comma separated input sizes [%default].")
+parser.add_option('-d', '--durations', dest='durations', default='10',
+                  help="Comma separated input durations in seconds "
+                  "[%default].")
+parser.add_option('-j', '--simultaneous', type='int', dest='simultaneous',
+                  default=1,
+                  help="Conversions to run at once [%default].")
+parser.add_option('-w', '--work-dir', dest='work_dir',
+                  default=os.path.join(tempfile.gettempdir(), 'mvc-bench'),
+                  help="Directory for generated inputs [%default].")
+parser.add_option('-o', '--output', dest='output',
+                  help="Write the JSON report to this file.")
+parser.add_option('-b', '--baseline', dest='baseline',
+                  help="Compare against this earlier report.")
+parser.add_option('-t', '--threshold', type='float', dest='threshold',
+                  default=0.1,
+                  help="Slowdown, as a fraction, that counts as a "
+                  "regression [%default].")
+
+def generate_input(work_dir, size, duration):
+    """Create (or reuse) a synthetic input file.
+
+    :returns: path to the file
+    """
+    path = os.path.join(work_dir, 'input-%s-%is.mp4' % (size, duration))
+    if os.path.exists(path):
+        return path
+    temp_path = path + '.tmp.mp4'
+    commandline = [
+        settings.get_ffmpeg_executable_path(), '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=%s:rate=30:duration=%i' % (
+            size, duration),
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000:'
+        'duration=%i' % (duration,),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-strict', 'experimental', '-shortest', temp_path]
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(commandline, stdout=devnull,
+                              stderr=subprocess.STDOUT)
+    os.rename(temp_path, path)
+    return path
+
+def select_converters(options):
+    manager = converter.ConverterManager()
+    manager.startup()
+    if options.converters:
+        converters = [manager.get_by_id(id_) for id_ in options.converters]
+    else:
+        converters = manager.list_converters()
+    if options.match:
+        converters = [c for c in converters if options.match in c.identifier]
+    return sorted(converters, key=lambda c: c.identifier)
+
+def run_conversions(jobs, simultaneous, output_dir):
+    """Convert every (key, input path, converter) in jobs.
+
+    :returns: dict mapping keys to the conversion's stats
+    """
+    manager = conversion.ConversionManager(simultaneous)
+    conversions = {}
+    for key, path, converter_info in jobs:
+        c = manager.get_conversion(VideoFile(path), converter_info,
+                                   output_dir=output_dir)
+        conversions[key] = c
+        manager.run_conversion(c)
+    while manager.running:
+        manager.wait_for_notifications(1.0)
+        manager.check_notifications()
+    results = {}
+    for key, c in conversions.items():
+        stats = c.get_stats()
+        stats['error'] = c.error
+        results[key] = stats
+        try:
+            os.remove(c.output)
+        except EnvironmentError:
+            pass
+    manager.close()
+    return results
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline report.
+
+    :returns: list of (key, old wall time, new wall time) for runs that got
+    slower by more than threshold
+    """
+    regressions = []
+    for key, stats in sorted(results.items()):
+        old = baseline['results'].get(key)
+        if old is None or not old.get('wall_time') or not stats['wall_time']:
+            continue
+        # wall time covers converters that don't report frames
+        speedup = old['wall_time'] / stats['wall_time']
+        print '%-40s %7.2fs -> %7.2fs (%+.0f%%)' % (
+            key, old['wall_time'], stats['wall_time'],
+            (speedup - 1) * 100)
+        if speedup < 1 - threshold:
+            regressions.append((key, old['wall_time'], stats['wall_time']))
+    return regressions
+
+def main(argv):
+    options, args = parser.parse_args(argv[1:])
+    if not os.path.exists(options.work_dir):
+        os.makedirs(options.work_dir)
+    inputs = []
+    for size in options.resolutions.split(','):
+        for duration in options.durations.split(','):
+            inputs.append((size, int(duration),
+                           generate_input(options.work_dir, size,
+                                          int(duration))))
+    jobs = []
+    for converter_info in select_converters(options):
+        for size, duration, path in inputs:
+            key = '%s|%s|%is' % (converter_info.identifier, size, duration)
+            jobs.append((key, path, converter_info))
+
+    output_dir = tempfile.mkdtemp(dir=options.work_dir)
+    try:
+        start = time.time()
+        results = run_conversions(jobs, options.simultaneous, output_dir)
+        total_time = time.time() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    for key, stats in sorted(results.items()):
+        if stats['error']:
+            print '%-40s failed: %s' % (key, stats['error'])
+            continue
+        cpu = (stats['cpu_user'] or 0) + (stats['cpu_system'] or 0)
+        print '%-40s %7.2fs wall %7.2fs cpu %7s fps %10s bytes' % (
+            key, stats['wall_time'] or 0, cpu,
+            '%.1f' % stats['fps'] if stats['fps'] else '-',
+            stats['output_bytes'])
+    print 'total: %i conversions in %.1fs' % (len(results), total_time)
+
+    report = {
+        'created': time.time(),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'ffmpeg': settings.get_ffmpeg_executable_path(),
+        'ffmpeg_version': '.'.join(str(v) for v in
+                                   settings.get_ffmpeg_version()),
+        'simultaneous': options.simultaneous,
+        'total_time': total_time,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        print 'compared with %s (ffmpeg %s):' % (
+            options.baseline, baseline.get('ffmpeg_version'))
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print '%i regressions' % (len(regressions),)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,224 @@
+"""Simulate large batches to find overhead in the conversion manager.
+
+Usage: python test/benchmarks/bench_manager.py [options]
+
+Runs --jobs conversions through ConversionManager, using fake_encoder.py
+in place of ffmpeg, and the real ffmpeg output parser.  Reports the CPU
+time the manager process spent per job (output parsing, notifications and
+bookkeeping, but not the encoders), how long notifications waited before
+they were handled, and how fast the parser handles lines.
+
+Each job has a listener that does what the console and GUI do for each
+update: it recomputes the queue ETA with update_queue_estimates(), passing
+every job like the GUI passes its rows, whenever the queue changed, and
+formats a status line.  Its cost is reported per notification.
+
+With --replay, recorded ffmpeg logs (for example the .log.gz files that
+--save-logs writes) are fed through the parser on their own, and also used
+as the encoder output for the simulated jobs.
+"""
+
+import gzip
+import optparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from mvc import conversion
+from mvc.converter import FFmpegConverterInfo
+from mvc.notifications import NotificationQueue
+
+FAKE_ENCODER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fake_encoder.py')
+
+parser = optparse.OptionParser(usage='%prog [options]')
+parser.add_option('-n', '--jobs', type='int', default=1000,
+                  help="Number of conversions [%default].")
+parser.add_option('-j', '--simultaneous', type='int', default=8,
+                  help="Conversions to run at once [%default].")
+parser.add_option('--duration', type='float', default=60.0,
+                  help="Media seconds per job [%default].")
+parser.add_option('--speed', type='float', default=0,
+                  help="Media seconds encoded per wall second, 0 for as "
+                  "fast as possible [%default].")
+parser.add_option('--progress-interval', type='float', default=0.5,
+                  help="Media seconds between progress lines [%default].")
+parser.add_option('--noise', type='int', default=0,
+                  help="Extra log lines per progress line [%default].")
+parser.add_option('--fail-rate', type='float', default=0.0,
+                  help="Fraction of jobs that fail [%default].")
+parser.add_option('--replay', action='append', default=[],
+                  help="Recorded ffmpeg log to replay (can be given more "
+                  "than once).")
+
+class SimulatedVideo(object):
+    """Just enough of VideoFile for the manager, without running ffmpeg."""
+    def __init__(self, filename, duration):
+        self.filename = filename
+        self.duration = duration
+        self.width = 640
+        self.height = 360
+        self.audio_only = False
+        self.container = 'webm'
+        self.video_codec = 'vp8'
+        self.audio_codec = 'vorbis'
+
+class SimulatedConverter(FFmpegConverterInfo):
+    media_type = 'format'
+    extension = 'sim'
+
+    def __init__(self, options):
+        FFmpegConverterInfo.__init__(self, 'Simulated')
+        self.options = options
+        self.seed = 0
+
+    def get_executable(self):
+        return sys.executable
+
+    def get_arguments(self, video, output):
+        options = self.options
+        self.seed += 1
+        args = ['-u', FAKE_ENCODER,
+                '--duration', str(video.duration),
+                '--speed', str(options.speed),
+                '--progress-interval', str(options.progress_interval),
+                '--noise', str(options.noise),
+                '--fail-rate', str(options.fail_rate),
+                '--seed', str(self.seed)]
+        if options.replay:
+            args.extend(['--replay',
+                         options.replay[self.seed % len(options.replay)]])
+        return args + [video.filename, output]
+
+class LatencyQueue(NotificationQueue):
+    """NotificationQueue that measures how long updates wait."""
+    def __init__(self):
+        NotificationQueue.__init__(self)
+        self.posted_at = {}
+        self.latencies = []
+
+    def post(self, conversion):
+        with self.lock:
+            if conversion not in self.pending:
+                self.posted_at[conversion] = time.time()
+        NotificationQueue.post(self, conversion)
+
+    def take(self):
+        changed = NotificationQueue.take(self)
+        now = time.time()
+        for conversion in changed:
+            posted_at = self.posted_at.pop(conversion, None)
+            if posted_at is not None:
+                self.latencies.append(now - posted_at)
+        return changed
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def bench_parser(paths):
+    """Feed recorded logs through the ffmpeg output parser.
+
+    :returns: (lines, seconds) tuple
+    """
+    video = SimulatedVideo('replay', None)
+    lines = []
+    for path in paths:
+        if path.endswith('.gz'):
+            f = gzip.open(path)
+        else:
+            f = open(path)
+        with f:
+            for line in f.read().replace('\r', '\n').split('\n'):
+                if line:
+                    lines.append(line)
+    process_status_line = FFmpegConverterInfo.process_status_line
+    start = time.time()
+    for line in lines:
+        process_status_line(video, line)
+    return len(lines), time.time() - start
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def bench_manager(options, work_dir):
+    manager = conversion.ConversionManager(options.simultaneous)
+    manager.notify_queue.close()
+    manager.notify_queue = LatencyQueue()
+    converter = SimulatedConverter(options)
+    counts = {'calls': 0, 'estimates': 0}
+    times = {'listener': 0.0, 'estimates': 0.0}
+    estimate = {'queue_changes': None, 'queue_eta': None}
+    conversions = []
+    def changed(c):
+        start = time.time()
+        counts['calls'] += 1
+        if estimate['queue_changes'] != manager.queue_changes:
+            estimate['queue_changes'] = manager.queue_changes
+            estimate['queue_eta'] = manager.update_queue_estimates(
+                conversions)
+            counts['estimates'] += 1
+            times['estimates'] += time.time() - start
+        line = '%s: %s (%i%%, %s remaining, queue done in %s)' % (
+            c.video.filename, c.status, (c.progress_percent or 0) * 100,
+            c.eta, estimate['queue_eta'])
+        times['listener'] += time.time() - start
+    cpu_start = cpu_time()
+    start = time.time()
+    for i in xrange(options.jobs):
+        video = SimulatedVideo(os.path.join(work_dir, 'input-%i' % i),
+                               options.duration)
+        c = manager.get_conversion(video, converter, output_dir=work_dir)
+        c.listen(changed)
+        conversions.append(c)
+        manager.run_conversion(c)
+    queued_time = time.time() - start
+    while manager.running:
+        manager.wait_for_notifications(1.0)
+        manager.check_notifications()
+    wall_time = time.time() - start
+    cpu = cpu_time() - cpu_start
+    failed = len([c for c in conversions if c.status != 'finished'])
+    latencies = manager.notify_queue.latencies
+    print '%i jobs (%i failed) in %.1fs, %.1f jobs/s' % (
+        options.jobs, failed, wall_time, options.jobs / wall_time)
+    print 'queueing all jobs took %.3fs' % (queued_time,)
+    print 'manager cpu: %.2fs total, %.2f ms/job' % (
+        cpu, cpu * 1000 / options.jobs)
+    lines = sum(c.log.line_count for c in conversions)
+    print 'converter output: %i lines, %.0f lines per cpu second' % (
+        lines, lines / cpu if cpu else 0)
+    print 'notifications: %i handled, %i listener calls' % (
+        len(latencies), counts['calls'])
+    print 'listener: %.3f ms per call, %i queue estimates, %.2f ms each' % (
+        times['listener'] * 1000 / max(counts['calls'], 1),
+        counts['estimates'],
+        times['estimates'] * 1000 / max(counts['estimates'], 1))
+    print 'notification latency: p50 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        max(latencies or [0]) * 1000)
+    manager.close()
+
+def main(argv):
+    options, args = parser.parse_args(argv[1:])
+    if options.replay:
+        lines, elapsed = bench_parser(options.replay)
+        print 'parser: %i lines in %.3fs, %.0f lines/s' % (
+            lines, elapsed, lines / elapsed if elapsed else 0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        bench_manager(options, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main(sys.argv)
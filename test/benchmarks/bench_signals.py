@@ -0,0 +1,45 @@
+"""Micro-benchmark for SignalEmitter.emit() with many listeners.
+
+Usage: python test/benchmarks/bench_signals.py [listeners] [emits]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from mvc import signals
+
+class Listener(object):
+    def callback(self, emitter, *args):
+        pass
+
+def bench(listeners, emits, weak):
+    emitter = signals.SignalEmitter('changed', 'other')
+    keep_alive = []
+    for i in range(listeners):
+        listener = Listener()
+        keep_alive.append(listener)
+        if weak:
+            emitter.connect_weak('changed', listener.callback)
+        else:
+            emitter.connect('changed', listener.callback)
+        # listeners on other signals shouldn't slow down emitting 'changed'
+        emitter.connect('other', listener.callback)
+    start = time.time()
+    for i in xrange(emits):
+        emitter.emit('changed', i)
+    return time.time() - start
+
+def main(argv):
+    listeners = int(argv[1]) if len(argv) > 1 else 100
+    emits = int(argv[2]) if len(argv) > 2 else 10000
+    for weak in (False, True):
+        elapsed = bench(listeners, emits, weak)
+        print '%-6s %d listeners: %8.0f emits/s (%.1f us/callback)' % (
+            'weak' if weak else 'strong', listeners, emits / elapsed,
+            elapsed / (emits * listeners) * 1e6)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,102 @@
+"""Stand-in for ffmpeg, for simulating large conversion batches.
+
+Usage: python fake_encoder.py [options] <input> <output>
+
+Prints output in ffmpeg's format: a header with the input's duration, then
+progress lines, then the final Lsize line, and writes a small output file.
+How fast it goes, how much it prints and how often it fails can be set with
+the options below.  With --replay, the lines of a recorded ffmpeg log are
+printed instead.
+"""
+
+import gzip
+import optparse
+import random
+import sys
+import time
+
+parser = optparse.OptionParser(usage='%prog [options] <input> <output>')
+parser.add_option('--duration', type='float', default=60.0,
+                  help="Media seconds to pretend to encode [%default].")
+parser.add_option('--speed', type='float', default=0,
+                  help="Media seconds encoded per wall second, 0 for as "
+                  "fast as possible [%default].")
+parser.add_option('--progress-interval', type='float', default=0.5,
+                  help="Media seconds between progress lines [%default].")
+parser.add_option('--noise', type='int', default=0,
+                  help="Extra non-progress lines to print with each "
+                  "progress line [%default].")
+parser.add_option('--fail-rate', type='float', default=0.0,
+                  help="Chance of failing partway through [%default].")
+parser.add_option('--fps', type='float', default=30.0,
+                  help="Frame rate to report [%default].")
+parser.add_option('--replay',
+                  help="Print this recorded log (plain or gzipped) instead.")
+parser.add_option('--seed', type='int',
+                  help="Random seed, for repeatable failures.")
+
+def hms(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%02i:%02i:%05.2f' % (hours, minutes, seconds)
+
+def replay(path, speed):
+    if path.endswith('.gz'):
+        f = gzip.open(path)
+    else:
+        f = open(path)
+    with f:
+        for line in f:
+            sys.stdout.write(line)
+            if speed:
+                time.sleep(1.0 / speed)
+
+def encode(options):
+    rand = random.Random(options.seed)
+    fail_at = None
+    if rand.random() < options.fail_rate:
+        fail_at = rand.random() * options.duration
+    print "Input #0, matroska,webm, from 'input.webm':"
+    print '  Duration: %s, start: 0.000000, bitrate: 1000 kb/s' % (
+        hms(options.duration),)
+    print '    Stream #0:0: Video: vp8, yuv420p, 640x360, %g fps' % (
+        options.fps,)
+    print 'Output #0, mp4, to \'output.mp4\':'
+    progress = 0.0
+    while progress < options.duration:
+        if options.speed:
+            time.sleep(options.progress_interval / options.speed)
+        progress = min(progress + options.progress_interval, options.duration)
+        if fail_at is not None and progress >= fail_at:
+            print 'Error while opening encoder for output stream #0:0'
+            return 1
+        for i in xrange(options.noise):
+            print '[libx264 @ 0x1234abcd] frame I:%i Avg QP:20.00' % (i,)
+        frames = int(progress * options.fps)
+        sys.stdout.write('frame=%6i fps=%3i q=28.0 size=%8ikB time=%s '
+                         'bitrate= 800.0kbits/s    \r' % (
+                frames, options.fps, progress * 100, hms(progress)))
+        sys.stdout.flush()
+    print ('frame=%6i fps=%3i q=-1.0 Lsize=%8ikB time=%s '
+           'bitrate= 800.0kbits/s    ' % (
+            int(options.duration * options.fps), options.fps,
+            options.duration * 100, hms(options.duration)))
+    return 0
+
+def main(argv):
+    options, args = parser.parse_args(argv[1:])
+    if len(args) != 2:
+        parser.error('need an input and an output')
+    output = args[1]
+    if options.replay:
+        replay(options.replay, options.speed)
+        status = 0
+    else:
+        status = encode(options)
+    if status == 0:
+        with open(output, 'w') as f:
+            f.write('simulated')
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
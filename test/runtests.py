@@ -1,7 +1,9 @@
+import sys
+
 try:
     import mvc
 except ImportError:
-    import os.path, sys
+    import os.path
     mvc_path = os.path.join(os.path.dirname(__file__), '..')
     sys.path.append(mvc_path)
 
@@ -9,6 +11,21 @@ from test_video import *
 from test_converter import *
 from test_conversion import *
 from test_utils import *
+from test_throughput import *
+from test_notifications import *
+from test_signals import *
+from test_cellpack import *
+from test_widgetutil import *
+from test_logbuffer import *
+from test_execute import *
+from test_jobqueue import *
+from test_tracing import *
+from test_watchfolder import *
+from test_preflight import *
+from test_logqueue import *
+from test_ui import *
+if sys.platform != 'darwin':
+    from test_layoutmanager import *
 
 if __name__ == "__main__":
     import unittest
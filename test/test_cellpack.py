@@ -0,0 +1,52 @@
+from mvc.widgets import cellpack
+
+import base
+
+class FakeTextBox(object):
+    """Stands in for a TextBox."""
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.drawn_at = []
+
+    def get_size(self):
+        return self.size
+
+    def draw(self, context, x, y, width, height):
+        self.drawn_at.append((x, y, width, height))
+
+class FakeContext(object):
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+class CellPackTest(base.Test):
+
+    def test_box_layout(self):
+        child1 = FakeTextBox(10, 5)
+        child2 = FakeTextBox(20, 8)
+        box = cellpack.HBox(spacing=2)
+        box.pack(child1)
+        box.pack(child2, expand=True)
+        self.assertEqual(box.get_size(), (32, 8))
+        box.render_layout(FakeContext(50, 10))
+        self.assertEqual(child1.drawn_at[-1], (0, 0, 10, 10))
+        self.assertEqual(child2.drawn_at[-1], (12, 0, 38, 10))
+
+    def test_get_current_size(self):
+        box = cellpack.VBox()
+        box.pack(FakeTextBox(10, 5))
+        self.assertEqual(box.get_current_size(), (10, 5))
+        # we can keep packing after measuring
+        box.pack(FakeTextBox(15, 5))
+        self.assertEqual(box.get_current_size(), (15, 10))
+        self.assertEqual(box.get_size(), (15, 10))
+
+    def test_table_layout(self):
+        child1 = FakeTextBox(10, 5)
+        child2 = FakeTextBox(20, 8)
+        table = cellpack.Table(1, 2, col_spacing=1)
+        table.pack(child1, 0, 0)
+        table.pack(child2, 0, 1)
+        self.assertEqual(table.get_size(), (31, 8))
+        table.render_layout(FakeContext(31, 8))
+        self.assertEqual(child2.drawn_at[-1], (11, 0, 20, 8))
@@ -3,14 +3,17 @@ import json
 import os.path
 import shutil
 import sys
+from StringIO import StringIO
 import tempfile
 import time
 
 from mvc import video
 from mvc import converter
 from mvc import conversion
+from mvc import streaming
 
 import base
+import mock
 
 
 class FakeConverterInfo(converter.ConverterInfo):
@@ -28,6 +31,35 @@ class FakeConverterInfo(converter.ConverterInfo):
     def process_status_line(self, video, line):
         return json.loads(line)
 
+class FakeStreamConverterInfo(FakeConverterInfo):
+
+    def get_stream_arguments(self, video, input_path=None):
+        return ['-u', os.path.join(
+                os.path.dirname(__file__), 'testdata',
+                'fake_stream_converter.py')]
+
+
+class FakeSegmentedConverterInfo(FakeConverterInfo):
+
+    segmented = True
+
+    def get_output_filename(self, video):
+        return os.path.basename(video.filename) + '.segmented'
+
+    def get_arguments(self, video, output):
+        return ['-u', os.path.join(
+                os.path.dirname(__file__), 'testdata', 'fake_segmenter.py'),
+                video.filename, output]
+
+
+class FakeStreamVideo(object):
+    filename = '-'
+    duration = None
+    audio_only = False
+
+    def __init__(self, head):
+        self.head = head
+
 
 class ConversionManagerTest(base.Test):
 
@@ -40,6 +72,7 @@ class ConversionManagerTest(base.Test):
 
     def tearDown(self):
         base.Test.tearDown(self)
+        self.manager.close()
         shutil.rmtree(self.temp_dir, ignore_errors=True)
 
     def changed(self, conversion):
@@ -53,8 +86,8 @@ class ConversionManagerTest(base.Test):
     def spin(self, timeout):
         finish_by = time.time() + timeout
         while time.time() < finish_by and self.manager.running:
+            self.manager.wait_for_notifications(0.1)
             self.manager.check_notifications()
-            time.sleep(0.1)
 
     def start_conversion(self, filename, timeout=3):
         vf = video.VideoFile(filename)
@@ -73,7 +106,7 @@ class ConversionManagerTest(base.Test):
         return c
 
     def test_initial(self):
-        self.assertEqual(self.manager.notify_queue, set())
+        self.assertEqual(len(self.manager.notify_queue), 0)
         self.assertEqual(self.manager.in_progress, set())
         self.assertFalse(self.manager.running)
 
@@ -87,7 +120,17 @@ class ConversionManagerTest(base.Test):
         self.assertEqual(c.progress_percent, 1.0)
         self.assertTrue(os.path.exists(c.output))
         self.assertEqual(file(c.output).read(), 'blank')
-        self.assertEqual(self.changes, [
+        # The move to the destination runs on the write-behind pool.  If we
+        # take the 'staging' update before the move is done, we see it on
+        # its own, otherwise it's merged into 'finished'.  Listeners read
+        # the status when the batch is dispatched, so a 'staging' update
+        # can also show up as a second 'finished'.
+        statuses = [change['status'] for change in self.changes]
+        self.assertTrue(statuses[5:] in (['finished'],
+                                         ['staging', 'finished'],
+                                         ['finished', 'finished']),
+                        statuses)
+        self.assertEqual(self.changes[:5] + self.changes[-1:], [
                 {'status': 'converting', 'duration': 5.0, 'eta': 5.0,
                  'progress': 0.0},
                 {'status': 'converting', 'duration': 5.0, 'eta': 4.0,
@@ -102,6 +145,35 @@ class ConversionManagerTest(base.Test):
                  'progress': 5.0}
                 ])
 
+    def get_etas(self, lines):
+        """Run converter output through a conversion, and get its ETA
+        after each update.
+        """
+        vf = mock.Mock(filename='input.webm', duration=100.0, height=720,
+                       video_codec='vp8', audio_codec='vorbis',
+                       audio_only=False)
+        c = self.manager.get_conversion(vf, self.converter,
+                                        output_dir=self.temp_dir)
+        etas = []
+        c.notify_listeners = lambda: etas.append(c.eta)
+        c.popen = mock.Mock(stdout=StringIO(
+                '\n'.join(json.dumps(line) for line in lines)))
+        c.process_output()
+        return etas
+
+    def test_eta_before_extrapolating(self):
+        # the first 5% is predicted from the expected speed, 2x realtime
+        self.manager.throughput.speeds['*'] = {'speed': 2.0, 'samples': 1}
+        etas = self.get_etas([{'duration': 100}, {'progress': 1},
+                              {'progress': 3}])
+        self.assertEqual(etas, [50.0, 49.5, 48.5])
+
+    def test_eta_unknown(self):
+        # with no history, the ETA is unknown rather than 0
+        etas = self.get_etas([{'duration': 100}, {'progress': 1},
+                              {'progress': 3}])
+        self.assertEqual(etas, [None, None, None])
+
     def test_conversion_with_error(self):
         filename = os.path.join(self.temp_dir, 'error.webm')
         shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
@@ -110,6 +182,8 @@ class ConversionManagerTest(base.Test):
         self.assertFalse(os.path.exists(c.output))
         self.assertEqual(c.status, 'failed')
         self.assertEqual(c.error, 'test error')
+        self.assertEqual(len(c.error_context), 1)
+        self.assertTrue('test error' in c.error_context[0])
 
     def test_conversion_with_missing_executable(self):
         missing = sys.executable + '.does-not-exist'
@@ -154,6 +228,35 @@ class ConversionManagerTest(base.Test):
         self.assertEqual(c.status, 'finished')
         self.assertEqual(c2.status, 'finished')
 
+    def test_queue_changes(self):
+        self.manager.simultaneous = 1
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        vf = video.VideoFile(filename)
+        c = self.manager.start_conversion(vf, self.converter)
+        c2 = self.manager.get_conversion(vf, self.converter)
+        pending = [c, c2]
+        finish_times = self.manager.estimate_finish_times(pending)
+        # c is running, c2 is counted once, after it
+        self.assertEqual(sorted(finish_times), sorted(pending))
+        changes = self.manager.queue_changes
+        self.assertTrue(changes > 0)
+        # progress doesn't change the queue
+        self.manager.wait_for_notifications(2)
+        self.manager.check_notifications()
+        self.assertEqual(c.status, 'converting')
+        self.assertEqual(self.manager.queue_changes, changes)
+        self.manager.run_conversion(c2)
+        self.assertNotEqual(self.manager.queue_changes, changes)
+        changes = self.manager.queue_changes
+        self.manager.remove(c2)
+        self.assertNotEqual(self.manager.queue_changes, changes)
+        changes = self.manager.queue_changes
+        self.spin(3)
+        self.assertEqual(c.status, 'finished')
+        self.assertNotEqual(self.manager.queue_changes, changes)
+
     def test_unicode_characters(self):
         for filename in (
             u'"TAKE2\'s" REHEARSAL човен поўны вуграмі',
@@ -177,6 +280,161 @@ class ConversionManagerTest(base.Test):
         self.assertEqual(c2.status, 'finished')
         self.assertEqual(c2.output, c.output)
 
+    def test_scratch_directory(self):
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        os.mkdir(scratch_dir)
+        self.manager.scratch_dir = scratch_dir
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        c = self.start_conversion(filename)
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(os.path.dirname(c.temp_output), scratch_dir)
+        self.assertEqual(file(c.output).read(), 'blank')
+        self.assertEqual(os.listdir(scratch_dir), [])
+        self.assertEqual(self.manager.staging, set())
+        self.assertTrue('staging_wait' in c.get_stats()['phases'])
+
+    def test_not_enough_space(self):
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        vf = video.VideoFile(filename)
+        with mock.patch.object(conversion, 'get_available_space',
+                               return_value=0):
+            c = self.manager.start_conversion(vf, self.converter)
+        self.assertEqual(c.status, 'failed')
+        self.assertTrue(c.error.startswith('not enough disk space'))
+        self.assertTrue(c.temp_output is None)
+        self.spin(1)
+        self.assertFalse(self.manager.running)
+
+    def test_wait_for_space(self):
+        self.manager.simultaneous = 2
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename + '2')
+        vf = video.VideoFile(filename)
+        vf2 = video.VideoFile(filename + '2')
+        c = self.manager.start_conversion(vf, self.converter)
+        # only leave room for one conversion
+        space = (conversion.MIN_FREE_SPACE +
+                 int(c.estimate_output_size() * conversion.SPACE_MARGIN))
+        with mock.patch.object(conversion, 'get_available_space',
+                               return_value=space):
+            c2 = self.manager.start_conversion(vf2, self.converter)
+            self.assertEqual(list(self.manager.waiting), [c2])
+            self.assertTrue(c2.waiting_reason.startswith(
+                    'not enough disk space'))
+        self.spin(5)
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c2.status, 'finished')
+        self.assertEqual(c2.waiting_reason, None)
+
+    def test_cpu_groups(self):
+        self.manager.simultaneous = 2
+        self.manager.pin_cpus = True
+        running = mock.Mock(cpu_group=[0, 1])
+        self.manager.in_progress.add(running)
+        with mock.patch.object(conversion.execute, 'get_available_cpus',
+                               return_value=[0, 1, 2, 3]):
+            self.assertEqual(self.manager._choose_cpu_group(), [2, 3])
+            running.cpu_group = None
+            self.assertEqual(self.manager._choose_cpu_group(), [0, 1])
+
+    def wait_for_status(self, c, status, timeout=3):
+        finish_by = time.time() + timeout
+        while time.time() < finish_by and c.status != status:
+            self.manager.wait_for_notifications(0.1)
+            self.manager.check_notifications()
+        self.assertEqual(c.status, status)
+
+    def test_pause_resume(self):
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        vf = video.VideoFile(filename)
+        c = self.manager.start_conversion(vf, self.converter)
+        self.wait_for_status(c, 'converting')
+        self.assertTrue(self.manager.pause(c))
+        self.assertEqual(c.status, 'paused')
+        self.assertEqual(self.manager.in_progress, set())
+        self.assertEqual(self.manager.paused, set([c]))
+        time.sleep(1)
+        self.assertEqual(c.status, 'paused')
+        self.manager.resume(c)
+        self.assertEqual(c.status, 'converting')
+        self.assertEqual(self.manager.in_progress, set([c]))
+        self.spin(3)
+        self.assertEqual(c.status, 'finished')
+        self.assertTrue(c.get_stats()['phases']['paused'] >= 1)
+
+    def test_preempt(self):
+        self.manager.simultaneous = 1
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename + '2')
+        vf = video.VideoFile(filename)
+        vf2 = video.VideoFile(filename + '2')
+        c = self.manager.start_conversion(vf, self.converter)
+        self.wait_for_status(c, 'converting')
+        urgent = self.manager.get_conversion(vf2, self.converter, priority=1)
+        self.manager.run_conversion(urgent)
+        self.assertEqual(c.status, 'paused')
+        self.assertTrue(c.preempted)
+        self.assertEqual(self.manager.in_progress, set([urgent]))
+        self.assertEqual(list(self.manager.waiting), [c])
+        self.wait_for_status(urgent, 'finished')
+        self.assertTrue(c.status in ('converting', 'staging', 'finished'))
+        self.spin(3)
+        self.assertEqual(c.status, 'finished')
+        self.assertTrue(c.finished_at > urgent.finished_at)
+
+    def test_segmented(self):
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        scratch_dir = os.path.join(self.temp_dir, 'scratch')
+        os.mkdir(scratch_dir)
+        self.manager.scratch_dir = scratch_dir
+        seen = []
+        def changed(c):
+            if c.status == 'converting':
+                seen.append(sorted(os.listdir(c.output)))
+        c = self.manager.get_conversion(video.VideoFile(filename),
+                                        FakeSegmentedConverterInfo('Fake'),
+                                        output_dir=self.temp_dir)
+        c.listen(changed)
+        self.manager.run_conversion(c)
+        self.spin(3)
+        self.assertEqual(c.status, 'finished')
+        # segments show up in the destination as they're written, not just
+        # when the conversion is done
+        self.assertEqual(c.temp_output, c.output)
+        self.assertTrue('segment-0' in seen[0])
+        self.assertTrue(len(seen[0]) < 5)
+        self.assertEqual(len(os.listdir(c.output)), 5)
+        self.assertEqual(c.output_bytes, 5 * len('segment'))
+        self.assertEqual(os.listdir(scratch_dir), [])
+
+    def test_segmented_error(self):
+        filename = os.path.join(self.temp_dir, 'error.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        c = self.manager.get_conversion(video.VideoFile(filename),
+                                        FakeSegmentedConverterInfo('Fake'),
+                                        output_dir=self.temp_dir)
+        self.manager.run_conversion(c)
+        self.spin(3)
+        self.assertEqual(c.status, 'failed')
+        self.assertEqual(c.error, 'test error')
+        # partial output is removed
+        self.assertFalse(os.path.exists(c.output))
+
     def test_stop(self):
         filename = os.path.join(self.temp_dir, 'webm-0.webm')
         shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
@@ -188,3 +446,86 @@ class ConversionManagerTest(base.Test):
         self.spin(1)
         self.assertEqual(c.status, 'canceled')
         self.assertEqual(c.error, 'manually stopped')
+
+    def test_stats(self):
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        c = self.start_conversion(filename)
+        stats = c.get_stats()
+        self.assertEqual(stats['status'], 'finished')
+        self.assertEqual(stats['input_bytes'], os.path.getsize(filename))
+        self.assertEqual(stats['output_bytes'], len('blank'))
+        self.assertTrue(stats['phases']['encode'] > 0)
+        self.assertTrue('finalize' in stats['phases'])
+        if hasattr(os, 'wait4'):
+            self.assertTrue(stats['cpu_user'] is not None)
+            self.assertTrue(stats['max_rss'] > 0)
+
+        summary = conversion.summarize_stats([c])
+        self.assertEqual(summary['conversions'], 1)
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(summary['output_bytes'], len('blank'))
+        self.assertEqual(summary['converters'].keys(), ['fake'])
+
+
+class StreamConversionTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        self.manager.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def spin(self, timeout):
+        finish_by = time.time() + timeout
+        while time.time() < finish_by and self.manager.running:
+            self.manager.wait_for_notifications(0.1)
+            self.manager.check_notifications()
+
+    def test_read_head(self):
+        path = os.path.join(self.temp_dir, 'input')
+        with open(path, 'w') as f:
+            f.write('abc' * 100)
+        with open(path) as f:
+            self.assertEqual(streaming.read_head(f, 10), 'abcabcabca')
+            self.assertEqual(streaming.read_head(f, 1000), 'bc' + 'abc' * 96)
+            self.assertEqual(streaming.read_head(f, 1000), '')
+
+    def test_stream(self):
+        input_path = os.path.join(self.temp_dir, 'input')
+        output_path = os.path.join(self.temp_dir, 'output')
+        data = 'streaming data ' * 10000
+        with open(input_path, 'w') as f:
+            f.write(data)
+        input_stream = open(input_path)
+        output_stream = open(output_path, 'w')
+        try:
+            head = streaming.read_head(input_stream, 1000)
+            c = streaming.StreamConversion(
+                FakeStreamVideo(head), FakeStreamConverterInfo('Fake'),
+                self.manager, output_stream, input_stream=input_stream,
+                output_dir=self.temp_dir)
+            self.manager.run_conversion(c)
+            self.spin(5)
+        finally:
+            input_stream.close()
+            output_stream.close()
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.output, '-')
+        with open(output_path) as f:
+            self.assertEqual(f.read(), data.upper())
+        self.assertEqual(c.input_bytes, len(data))
+        self.assertEqual(c.output_bytes, len(data))
+        # nothing else was written
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ['input', 'output'])
+
+    def test_converter_cant_stream(self):
+        self.assertRaises(ValueError, streaming.StreamConversion,
+                          FakeStreamVideo(''), FakeConverterInfo('Fake'),
+                          self.manager, sys.stdout, output_dir=self.temp_dir)
@@ -31,12 +31,15 @@ def make_ffmpeg_arg_parser():
         "-lag-in-frames",
         "-level",
         "-maxrate",
+        "-movflags",
         "-preset",
         "-profile:v",
         "-r",
         "-s",
         "-slices",
+        "-ss",
         "-strict",
+        "-t",
         "-threads",
         "-qmin",
         "-qmax",
@@ -121,6 +124,20 @@ class ConverterInfoTest(base.Test):
                          self.video.duration * self.converter_info.bitrate / 8)
 
 
+    def test_get_output_size_guess_from_parameters(self):
+        converter_info = converter.FFmpegConverterInfo('Bitrate Test')
+        converter_info.parameters = '-b:v 2M -ab 112k'
+        self.assertEqual(converter_info.get_output_size_guess(self.video),
+                         self.video.duration * 2112000 / 8)
+        converter_info.parameters = '-b:v 2M'
+        self.assertEqual(converter_info.get_output_size_guess(self.video),
+                         self.video.duration * (2000000 +
+            converter.FFmpegConverterInfo.DEFAULT_AUDIO_BITRATE) / 8)
+        converter_info.parameters = '-vcodec libx264 -crf 22'
+        self.assertEqual(converter_info.get_output_size_guess(self.video),
+                         None)
+
+
 class ConverterInfoTestMixin(object):
 
     def setUp(self):
@@ -196,19 +213,25 @@ class FFmpegConverterInfoTest(ConverterInfoTestMixin, base.Test):
     def test_process_status_line_progress(self):
         self.assertStatusLineOutput(
             'size=    2697kB time=00:02:52.59 bitrate= 128.0kbits/s ',
-            progress=172.59)
+            progress=172.59, size=2697 * 1024)
 
     def test_process_status_line_progress_with_frame(self):
         self.assertStatusLineOutput(
             'frame=  257 fps= 45 q=27.0 size=    1033kB time=00:00:08.70 '
             'bitrate= 971.4kbits/s ',
-            progress=8.7)
+            progress=8.7, frame=257, size=1033 * 1024)
 
     def test_process_status_line_finished(self):
         self.assertStatusLineOutput(
             'frame=16238 fps= 37 q=-1.0 Lsize=  110266kB time=00:11:16.50 '
             'bitrate=1335.3kbits/s dup=16 drop=0',
-            finished=True)
+            finished=True, frame=16238, size=110266 * 1024)
+
+    def test_process_status_line_progress_size_unknown(self):
+        self.assertStatusLineOutput(
+            'frame=    0 fps=0.0 q=0.0 size=N/A time=00:00:00.00 '
+            'bitrate=N/A ',
+            progress=0.0, frame=0)
 
     def test_process_status_line_error(self):
         line = ('Error while opening encoder for output stream #0:1 - '
@@ -233,6 +256,12 @@ class FFmpegConverterInfoTest(ConverterInfoTestMixin, base.Test):
 class TestConverterDefinitions(base.Test):
     def setUp(self):
         base.Test.setUp(self)
+        # the expected arguments below are for an ffmpeg without faststart
+        # support, see test_faststart() for the others
+        patcher = mock.patch.object(settings, 'ffmpeg_supports_faststart',
+                                    return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.manager = converter.ConverterManager()
         self.manager.startup()
         self.input_path = os.path.join(self.testdata_dir, 'mp4-0.mp4')
@@ -291,6 +320,69 @@ class TestConverterDefinitions(base.Test):
         converter = self.manager.converters[converter_id]
         self.assertEquals(converter.audio_only, True)
 
+    def test_faststart(self):
+        settings.ffmpeg_supports_faststart.return_value = True
+        for converter_id in ('mp4', 'droid', 'ipad', 'dnxhd720p'):
+            converter_obj = self.manager.converters[converter_id]
+            args = self.get_converter_arguments(converter_obj)
+            self.assertEquals(args['movflags'], '+faststart')
+            self.assertFalse(converter_obj.rewrites_output())
+        for converter_id in ('webmhd', 'mp3'):
+            args = self.get_converter_arguments(
+                self.manager.converters[converter_id])
+            self.assertFalse('movflags' in args)
+
+    def test_faststart_fallback(self):
+        self.assertFalse('movflags' in self.get_converter_arguments(
+                self.manager.converters['mp4']))
+        self.assertTrue(self.manager.converters['mp4'].rewrites_output())
+        self.assertFalse(self.manager.converters['droid'].rewrites_output())
+
+    def test_stream_arguments(self):
+        # faststart doesn't work on a pipe, the output is fragmented instead
+        settings.ffmpeg_supports_faststart.return_value = True
+        video_file = mock.Mock(width=542, height=320,
+                               filename=self.input_path, audio_only=False)
+        parser = make_ffmpeg_arg_parser()
+        for converter_id in ('mp4', 'droid', 'dnxhd720p'):
+            args = vars(parser.parse_args(
+                    self.manager.converters[converter_id]
+                    .get_stream_arguments(video_file)))
+            self.assertEquals(args['i'], 'pipe:0')
+            self.assertEquals(args['output_file'], 'pipe:1')
+            self.assertEquals(args['movflags'], 'frag_keyframe+empty_moov')
+        for converter_id in ('webmhd', 'mp3', 'oggvorbis'):
+            args = vars(parser.parse_args(
+                    self.manager.converters[converter_id]
+                    .get_stream_arguments(video_file, self.input_path)))
+            self.assertEquals(args['i'], self.input_path)
+            self.assertEquals(args['output_file'], 'pipe:1')
+            self.assertFalse('movflags' in args)
+        # without -f, ffmpeg can't tell what to write
+        converter_obj = converter.FFmpegConverterInfo('No Format')
+        converter_obj.parameters = '-acodec copy'
+        self.assertRaises(ValueError, converter_obj.get_stream_arguments,
+                          video_file)
+
+    def test_sample_arguments(self):
+        video_file = mock.Mock(width=542, height=320,
+                               filename=self.input_path, audio_only=False)
+        parser = make_ffmpeg_arg_parser()
+        args = vars(parser.parse_args(
+                self.manager.converters['webmhd'].get_sample_arguments(
+                    video_file, self.output_path, 30.0, 5.0)))
+        self.assertEquals(args['ss'], '30.000')
+        self.assertEquals(args['t'], '5.000')
+        self.assertEquals(args['i'], self.input_path)
+        self.assertEquals(args['output_file'], self.output_path)
+        # the input is seeked, rather than decoded up to the start
+        sample_args = self.manager.converters['mp3'].get_sample_arguments(
+            video_file, self.output_path, 30.0, 5.0)
+        self.assertTrue(sample_args.index('-ss') < sample_args.index('-i'))
+        self.assertRaises(NotImplementedError,
+                          self.manager.converters['hls'].get_sample_arguments,
+                          video_file, self.output_path, 30.0, 5.0)
+
     def test_all_converters_checked(self):
         for converter_id in self.manager.converters.keys():
             if not hasattr(self, "test_%s" % converter_id):
@@ -591,6 +683,88 @@ class TestConverterDefinitions(base.Test):
         })
         self.check_uses_input_size('sameformat')
 
+    def get_segmented_arguments(self, converter_id, width=1280, height=720,
+                                audio_codec='aac'):
+        """Get the arguments for a segmented converter.
+
+        :returns: dict mapping options to the list of values they were given
+        with, and the output path under None
+        """
+        video_file = mock.Mock(width=width, height=height,
+                               filename=self.input_path,
+                               audio_only=width is None,
+                               audio_codec=audio_codec, duration=10.0)
+        # the output directory must exist, see Conversion.run()
+        output_dir = self.testdata_dir
+        cmdline_args = self.manager.converters[converter_id].get_arguments(
+            video_file, output_dir)
+        args = {None: cmdline_args[-1]}
+        for option, value in zip(cmdline_args[:-1:2], cmdline_args[1:-1:2]):
+            self.assertTrue(option.startswith('-'), option)
+            args.setdefault(option, []).append(value)
+        return args
+
+    def test_hls(self):
+        args = self.get_segmented_arguments('hls')
+        output_dir = self.testdata_dir
+        self.assertEquals(args['-i'], [self.input_path])
+        # one decode, scaled to each rendition that fits in the input
+        self.assertEquals(args['-filter_complex'], [
+                '[0:v]split=3[v0][v1][v2];[v0]scale=1280:720[v0out];'
+                '[v1]scale=852:480[v1out];[v2]scale=640:360[v2out]'])
+        self.assertEquals(args['-map'], ['[v0out]', '[v1out]', '[v2out]',
+                                         '0:a:0', '0:a:0', '0:a:0'])
+        self.assertEquals(args['-b:v:0'], ['2800000'])
+        self.assertEquals(args['-b:v:2'], ['800000'])
+        self.assertEquals(args['-force_key_frames'],
+                          ['expr:gte(t,n_forced*4)'])
+        self.assertEquals(args['-f'], ['hls'])
+        self.assertEquals(args['-hls_playlist_type'], ['event'])
+        self.assertEquals(args['-var_stream_map'],
+                          ['v:0,a:0 v:1,a:1 v:2,a:2'])
+        self.assertEquals(args['-hls_segment_filename'], [
+                os.path.join(output_dir, 'stream_%v_%05d.ts')])
+        self.assertEquals(args[None], os.path.join(output_dir,
+                                                   'stream_%v.m3u8'))
+        converter_obj = self.manager.converters['hls']
+        self.assertTrue(converter_obj.segmented)
+        self.assertFalse(converter_obj.rewrites_output())
+        self.assertEquals(converter_obj.get_output_filename(
+                mock.Mock(filename='/videos/foo.webm')), 'foo.hls')
+        self.assertRaises(ValueError, converter_obj.get_stream_arguments,
+                          mock.Mock(filename='-'))
+
+        # small inputs get a single rendition, and no audio is mapped when
+        # there is none
+        args = self.get_segmented_arguments('hls', 320, 240, None)
+        self.assertEquals(args['-filter_complex'], [
+                '[0:v]split=1[v0];[v0]scale=320:240[v0out]'])
+        self.assertEquals(args['-map'], ['[v0out]'])
+        self.assertEquals(args['-var_stream_map'], ['v:0'])
+        # audio only
+        args = self.get_segmented_arguments('hls', None, None)
+        self.assertFalse('-filter_complex' in args)
+        self.assertEquals(args['-map'], ['0:a:0'])
+        self.assertEquals(args['-var_stream_map'], ['a:0'])
+
+    def test_dash(self):
+        args = self.get_segmented_arguments('dash', 1920, 1080)
+        self.assertEquals(args['-map'], ['[v0out]', '[v1out]', '[v2out]',
+                                         '[v3out]', '0:a:0'])
+        self.assertEquals(args['-f'], ['dash'])
+        self.assertEquals(args['-adaptation_sets'],
+                          ['id=0,streams=v id=1,streams=a'])
+        self.assertEquals(args[None], os.path.join(self.testdata_dir,
+                                                   'manifest.mpd'))
+        # 5M + 2.8M + 1.4M + 800k of video and 128k of audio, for 10 seconds
+        self.assertEquals(self.manager.converters['dash']
+                          .get_output_size_guess(mock.Mock(
+                    width=1920, height=1080, audio_only=False,
+                    duration=10.0)),
+                          10128000 * 10 / 8)
+        args = self.get_segmented_arguments('dash', None, None)
+        self.assertEquals(args['-adaptation_sets'], ['id=0,streams=a'])
+
     def test_zio(self):
         self.check_ffmpeg_arguments('zio', {
             'ab': '160k',
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from mvc import execute
+
+import base
+import mock
+
+class ExecuteTest(base.Test):
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(execute.parse_cpu_list('0-3,8,10-11\n'),
+                         [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(execute.parse_cpu_list('5'), [5])
+
+    def test_split_cpus(self):
+        self.assertEqual(execute.split_cpus(range(8), 3),
+                         [[0, 1], [2, 3, 4], [5, 6, 7]])
+        self.assertEqual(execute.split_cpus([0, 1], 3), [[], [0], [1]])
+
+    def test_get_available_cpus(self):
+        cpus = execute.get_available_cpus()
+        self.assertTrue(cpus)
+        self.assertEqual(len(set(cpus)), len(cpus))
+
+    def start_waiting(self, commandline):
+        """Start a process that runs commandline once we write a line to
+        its stdin.
+        """
+        return execute.Popen(['sh', '-c', 'read line; ' + commandline],
+                             stdin=subprocess.PIPE)
+
+    @unittest.skipIf(sys.platform == 'win32', 'no nice on windows')
+    def test_nice(self):
+        p = self.start_waiting('%s -c "import os; print os.nice(0)"' % (
+                sys.executable,))
+        execute.set_priority(p.pid, nice=5)
+        stdout, _ = p.communicate('\n')
+        self.assertEqual(int(stdout), os.nice(0) + 5)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'linux only')
+    def test_cpu_affinity(self):
+        cpu = execute.get_available_cpus()[0]
+        p = self.start_waiting('grep Cpus_allowed_list /proc/self/status')
+        execute.set_priority(p.pid, cpus=[cpu])
+        stdout, _ = p.communicate('\n')
+        self.assertEqual(execute.parse_cpu_list(stdout.split(':')[1]), [cpu])
+
+    @unittest.skipIf(sys.platform == 'win32', 'no nice on windows')
+    def test_exited_process(self):
+        p = execute.Popen(['true'])
+        p.wait()
+        # nothing to set it on, but no error either
+        execute.set_priority(p.pid, nice=5, cpus=[0])
+
+    @unittest.skipUnless(hasattr(os, 'wait4'), 'no wait4')
+    def test_wait_reaped_elsewhere(self):
+        p = execute.Popen(['true'])
+        # someone else reaped the process, so there's no status to get
+        os.waitpid(p.pid, 0)
+        self.assertEqual(p.wait(), 0)
+        self.assertEqual(p.rusage, None)
+
+    @unittest.skipUnless(hasattr(os, 'wait4'), 'no wait4')
+    def test_wait_status_set_while_waiting(self):
+        p = execute.Popen(['true'])
+        os.waitpid(p.pid, 0)
+        real_wait4 = os.wait4
+        def wait4(pid, options):
+            # poll() on another thread gets the status first
+            p.returncode = 3
+            p.rusage = 'rusage'
+            return real_wait4(pid, options)
+        with mock.patch.object(os, 'wait4', wait4):
+            self.assertEqual(p.wait(), 3)
+        self.assertEqual(p.rusage, 'rusage')
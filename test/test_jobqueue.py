@@ -0,0 +1,152 @@
+import os.path
+import shutil
+import tempfile
+import time
+
+from mvc import converter
+from mvc import conversion
+from mvc import jobqueue
+from mvc import video
+from mvc.worker import Coordinator, Worker
+
+import base
+from test_conversion import FakeConverterInfo
+
+def make_job(job_id, priority=0):
+    return {'id': job_id, 'filename': '/tmp/%s.webm' % job_id,
+            'converter': 'fake', 'priority': priority}
+
+class JobQueueTestMixin(object):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.queue = self.make_queue()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_claim_order(self):
+        self.queue.submit(make_job('a'))
+        self.queue.submit(make_job('b'))
+        self.queue.submit(make_job('urgent', priority=10))
+        self.assertEqual(self.queue.get('a')['state'], 'pending')
+        self.assertEqual(self.queue.claim('w1')['id'], 'urgent')
+        self.assertEqual(self.queue.claim('w2')['id'], 'a')
+        self.assertEqual(self.queue.claim('w1')['id'], 'b')
+        self.assertEqual(self.queue.claim('w1'), None)
+        record = self.queue.get('a')
+        self.assertEqual(record['state'], 'claimed')
+        self.assertEqual(record['worker'], 'w2')
+
+    def test_update_and_complete(self):
+        self.queue.submit(make_job('a'))
+        self.queue.claim('w1')
+        self.queue.update('a', {'status': 'converting', 'progress': 1.0})
+        self.assertEqual(self.queue.get('a')['report'],
+                         {'status': 'converting', 'progress': 1.0})
+        self.queue.complete('a', {'status': 'finished'})
+        record = self.queue.get('a')
+        self.assertEqual(record['state'], 'done')
+        self.assertEqual(record['report'], {'status': 'finished'})
+        self.assertEqual(self.queue.get('missing'), None)
+
+    def test_cancel(self):
+        self.queue.submit(make_job('a'))
+        self.queue.submit(make_job('b'))
+        self.queue.cancel('a')
+        self.assertEqual(self.queue.get('a')['state'], 'done')
+        self.assertEqual(self.queue.get('a')['report']['status'], 'canceled')
+        self.assertEqual(self.queue.claim('w1')['id'], 'b')
+        self.assertFalse(self.queue.is_canceled('b'))
+        self.queue.cancel('b')
+        self.assertTrue(self.queue.is_canceled('b'))
+
+    def test_requeue_stale(self):
+        self.queue.submit(make_job('a'))
+        self.queue.claim('w1')
+        self.assertEqual(self.queue.requeue_stale(60), [])
+        time.sleep(0.1)
+        self.assertEqual(self.queue.requeue_stale(0.05), ['a'])
+        self.assertEqual(self.queue.get('a')['state'], 'pending')
+        self.assertEqual(self.queue.claim('w2')['id'], 'a')
+
+class DirectoryJobQueueTest(JobQueueTestMixin, base.Test):
+    def setUp(self):
+        base.Test.setUp(self)
+        JobQueueTestMixin.setUp(self)
+
+    def make_queue(self):
+        return jobqueue.DirectoryJobQueue(os.path.join(self.temp_dir, 'q'))
+
+    def test_requeue_before_status_written(self):
+        self.queue.submit(make_job('a'))
+        name = os.listdir(self.queue._path('pending'))[0]
+        long_ago = time.time() - 1000
+        os.utime(self.queue._path('pending', name), (long_ago, long_ago))
+        self.queue.claim('w1')
+        # as if requeue_stale() ran between claim()'s rename and it writing
+        # the status file
+        os.remove(self.queue._path('status', 'a.json'))
+        self.assertEqual(self.queue.requeue_stale(60), [])
+        os.utime(self.queue._path('claimed', name), (long_ago, long_ago))
+        self.assertEqual(self.queue.requeue_stale(60), ['a'])
+
+class SQLiteJobQueueTest(JobQueueTestMixin, base.Test):
+    def setUp(self):
+        base.Test.setUp(self)
+        JobQueueTestMixin.setUp(self)
+
+    def make_queue(self):
+        return jobqueue.SQLiteJobQueue(os.path.join(self.temp_dir, 'q.db'))
+
+class WorkerTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.queue = jobqueue.open_queue(os.path.join(self.temp_dir, 'q'))
+        self.converter = FakeConverterInfo('Fake')
+        self.converter_manager = converter.ConverterManager()
+        self.converter_manager.add_converter(self.converter)
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_run_job(self):
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        coordinator_manager = conversion.ConversionManager()
+        self.addCleanup(coordinator_manager.close)
+        c = coordinator_manager.get_conversion(video.VideoFile(filename),
+                                               self.converter,
+                                               output_dir=self.temp_dir)
+        coordinator = Coordinator(self.queue, poll_interval=0.1)
+        coordinator.submit(c)
+        self.assertEqual(c.status, 'initialized')
+
+        worker_manager = conversion.ConversionManager(1)
+        self.addCleanup(worker_manager.close)
+        worker = Worker(self.queue, self.converter_manager, worker_manager,
+                        poll_interval=0.1)
+        worker.run(exit_when_idle=True)
+        coordinator.wait(coordinator_manager)
+        self.assertEqual(coordinator.jobs, {})
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.output, os.path.join(self.temp_dir,
+                                                'webm-0.fake.fake'))
+        self.assertEqual(file(c.output).read(), 'blank')
+        self.assertEqual(c.get_stats()['output_bytes'], len('blank'))
+
+    def test_unknown_converter(self):
+        self.queue.submit({'id': 'a', 'filename': 'a.webm',
+                           'converter': 'missing'})
+        worker_manager = conversion.ConversionManager(1)
+        self.addCleanup(worker_manager.close)
+        worker = Worker(self.queue, self.converter_manager, worker_manager,
+                        poll_interval=0.1)
+        worker.run(exit_when_idle=True)
+        record = self.queue.get('a')
+        self.assertEqual(record['state'], 'done')
+        self.assertEqual(record['report']['status'], 'failed')
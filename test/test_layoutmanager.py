@@ -0,0 +1,111 @@
+from mvc.widgets.gtk import layoutmanager
+
+import base
+import mock
+
+class FontCacheTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.font_cache = layoutmanager.FontCache(max_size=10)
+        self.context = mock.Mock()
+        self.description = mock.Mock()
+        self.description.get_size.return_value = 10240
+
+    def test_get(self):
+        with mock.patch.object(layoutmanager, 'pango'):
+            font = self.font_cache.get(self.context, self.description, 1.0,
+                                       False, False)
+            self.assertTrue(isinstance(font, layoutmanager.Font))
+            self.assertTrue(self.font_cache.get(
+                    self.context, self.description, 1.0, False, False)
+                            is font)
+            self.assertFalse(self.font_cache.get(
+                    self.context, self.description, 0.8, False, False)
+                             is font)
+            self.assertFalse(self.font_cache.get(
+                    self.context, self.description, 1.0, True, False)
+                             is font)
+        self.assertEqual(self.font_cache.misses, 3)
+        self.assertEqual(self.font_cache.hits, 1)
+
+class LayoutCacheTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        # every pango.Layout() call makes a new layout
+        patcher = mock.patch.object(layoutmanager, 'pango')
+        self.pango = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pango.Layout.side_effect = lambda context: mock.Mock()
+        self.widget = mock.Mock()
+        self.widget.style.font_desc.get_size.return_value = 10240
+        self.manager = layoutmanager.LayoutManager(self.widget)
+
+    def textbox(self, text, width=100):
+        textbox = self.manager.textbox(text)
+        textbox.set_width(width)
+        return textbox
+
+    def test_layout_is_lazy(self):
+        textbox = self.textbox(u'text')
+        textbox.set_wrap_style('char')
+        textbox.set_alignment('center')
+        self.assertEqual(self.pango.Layout.call_count, 0)
+        textbox.get_size()
+        self.assertEqual(self.pango.Layout.call_count, 1)
+        textbox.line_count()
+        self.assertEqual(self.pango.Layout.call_count, 1)
+
+    def test_same_key_reuses_layout(self):
+        layout = self.textbox(u'text').layout
+        self.assertTrue(self.textbox(u'text').layout is layout)
+        self.assertEqual(self.pango.Layout.call_count, 1)
+        # color isn't part of the key, it's only used when drawing
+        self.manager.set_text_color((1, 0, 0))
+        self.assertTrue(self.textbox(u'text').layout is layout)
+        self.assertEqual(self.pango.Layout.call_count, 1)
+
+    def test_different_key_makes_new_layout(self):
+        layout = self.textbox(u'text').layout
+        layouts = [
+            self.textbox(u'other text').layout,
+            self.textbox(u'text', width=50).layout,
+        ]
+        self.manager.set_font(0.8)
+        layouts.append(self.textbox(u'text').layout)
+        self.manager.set_font(1.0, bold=True)
+        layouts.append(self.textbox(u'text').layout)
+        textbox = self.textbox(u'text')
+        textbox.set_wrap_style('truncated-char')
+        layouts.append(textbox.layout)
+        textbox = self.textbox(u'text')
+        textbox.set_alignment('right')
+        layouts.append(textbox.layout)
+        for other in layouts:
+            self.assertFalse(other is layout)
+        self.assertEqual(len(set(id(other) for other in layouts)),
+                         len(layouts))
+        self.assertEqual(self.pango.Layout.call_count, len(layouts) + 1)
+
+    def test_changing_textbox_changes_layout(self):
+        textbox = self.textbox(u'text')
+        layout = textbox.layout
+        textbox.set_width(50)
+        self.assertFalse(textbox.layout is layout)
+        textbox.set_width(100)
+        self.assertTrue(textbox.layout is layout)
+        # cached layouts are never changed
+        self.assertEqual(layout.set_width.call_count, 1)
+
+    def test_style_change_clears_cache(self):
+        layout = self.textbox(u'text').layout
+        self.manager.on_style_set(self.widget, None)
+        self.assertEqual(len(self.manager.layout_cache), 0)
+        self.assertFalse(self.textbox(u'text').layout is layout)
+        self.assertEqual(self.pango.Layout.call_count, 2)
+
+    def test_direction_change_clears_cache(self):
+        layout = self.textbox(u'text').layout
+        self.manager.on_direction_changed(self.widget, None)
+        self.assertFalse(self.textbox(u'text').layout is layout)
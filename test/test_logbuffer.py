@@ -0,0 +1,100 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mvc import logbuffer
+
+import base
+import mock
+
+class BlockingFile(object):
+    """Wraps a file, making writes wait until unblock is set."""
+    def __init__(self, f):
+        self.f = f
+        self.unblock = threading.Event()
+
+    def write(self, data):
+        self.unblock.wait(5)
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+class LogBufferTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fill(self, log, progress_lines):
+        log.append('header 1')
+        log.append('header 2')
+        for i in range(progress_lines):
+            log.append('progress %i' % i, progress=True)
+        log.append('error')
+
+    def test_short_log(self):
+        log = logbuffer.LogBuffer(tail_lines=10)
+        self.fill(log, 3)
+        self.assertEqual(log.get_lines(), ['header 1', 'header 2',
+                                           'progress 0', 'progress 1',
+                                           'progress 2', 'error'])
+
+    def test_long_log(self):
+        log = logbuffer.LogBuffer(tail_lines=3)
+        self.fill(log, 10000)
+        self.assertEqual(len(log), 5)
+        self.assertEqual(log.get_lines(), ['header 1', 'header 2',
+                                           '[... 9998 lines omitted ...]',
+                                           'progress 9998', 'progress 9999',
+                                           'error'])
+
+    def test_header_limit(self):
+        log = logbuffer.LogBuffer(header_lines=1, tail_lines=1)
+        self.fill(log, 0)
+        self.assertEqual(log.get_lines(), ['header 1',
+                                           '[... 1 lines omitted ...]',
+                                           'error'])
+
+    def test_error_context(self):
+        log = logbuffer.LogBuffer(tail_lines=3)
+        self.fill(log, 100)
+        self.assertEqual(log.get_error_context(2), ['header 2', 'error'])
+
+    def test_spill(self):
+        path = os.path.join(self.temp_dir, 'output.log.gz')
+        log = logbuffer.LogBuffer(tail_lines=3, spill_path=path)
+        self.fill(log, 100)
+        log.close()
+        lines = gzip.open(path).read().splitlines()
+        self.assertEqual(len(lines), 103)
+        self.assertEqual(lines[-1], 'error')
+
+    def test_spill_queue_full(self):
+        path = os.path.join(self.temp_dir, 'output.log.gz')
+        with mock.patch.object(logbuffer, 'MAX_SPILL_QUEUED', 5):
+            log = logbuffer.LogBuffer(spill_path=path)
+        log.spill_file = blocking = BlockingFile(log.spill_file)
+        log.append('first')
+        # wait for the spill thread to get stuck writing it
+        finish_by = time.time() + 5
+        while not log.spill_queue.empty() and time.time() < finish_by:
+            time.sleep(0.01)
+        for i in range(10):
+            log.append('line %i' % i)
+        self.assertEqual(log.spill_dropped, 5)
+        # the buffer itself still has every line
+        self.assertEqual(log.get_lines()[-1], 'line 9')
+        blocking.unblock.set()
+        log.close()
+        lines = gzip.open(path).read().splitlines()
+        self.assertEqual(lines, ['first'] +
+                         ['line %i' % i for i in range(5)] +
+                         ['[... 5 lines dropped ...]'])
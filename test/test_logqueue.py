@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+
+from mvc import logqueue
+
+import base
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class FakeConversion(object):
+    def __init__(self, id, status):
+        self.id = id
+        self.status = status
+
+    @logqueue.logs_for_conversion
+    def log(self, logger, message):
+        logger.info(message)
+
+def make_record(msg, args=(), name='mvc.test', level=logging.INFO):
+    return logging.getLogger(name).makeRecord(name, level, __file__, 0, msg,
+                                              args, None)
+
+class LogQueueTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.root = logging.getLogger()
+        self.root_handlers = self.root.handlers[:]
+        self.root_level = self.root.level
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        logqueue.disable()
+        self.root.handlers[:] = self.root_handlers
+        self.root.setLevel(self.root_level)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_listener(self):
+        queue = Queue.Queue()
+        handler = logqueue.QueueHandler(queue)
+        target = ListHandler()
+        listener = logqueue.QueueListener(queue, [target], handler)
+        listener.start()
+        args = ['before']
+        record = make_record('logged %s', (args,))
+        thread = threading.Thread(target=handler.handle, args=(record,))
+        thread.start()
+        thread.join()
+        # the message is formatted when it's logged, not when it's written
+        args[0] = 'after'
+        listener.stop()
+        self.assertEqual([r.getMessage() for r in target.records],
+                         ["logged ['before']"])
+
+    def test_full_queue(self):
+        handler = logqueue.QueueHandler(Queue.Queue(1))
+        for i in range(3):
+            handler.handle(make_record('message %i', (i,)))
+        self.assertEqual(handler.dropped, 2)
+        # the listener reports what was dropped once it catches up
+        target = ListHandler()
+        listener = logqueue.QueueListener(handler.queue, [target], handler)
+        listener.start()
+        listener.stop()
+        self.assertEqual([r.getMessage() for r in target.records],
+                         ['message 0',
+                          'log queue was full, dropped 2 records'])
+
+    def test_context(self):
+        logger = logging.getLogger('mvc.test.context')
+        target = ListHandler()
+        target.addFilter(logqueue.ContextFilter())
+        logger.addHandler(target)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, target)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        conversion = FakeConversion('abc123', 'converting')
+        conversion.log(logger, 'in a conversion')
+        logger.info('outside')
+        self.assertEqual(
+            [(r.conversion_id, r.phase) for r in target.records],
+            [('abc123', 'converting'), (None, None)])
+
+    def test_rate_limit(self):
+        rate_limit = logqueue.RateLimitFilter(burst=2, interval=0.2)
+        passed = [i for i in range(5)
+                  if rate_limit.filter(make_record('error in %i', (i,)))]
+        self.assertEqual(passed, [0, 1])
+        # other messages have their own limit
+        self.assertTrue(rate_limit.filter(make_record('something else')))
+        time.sleep(0.25)
+        record = make_record('error in %i', (5,))
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.suppressed, 3)
+        self.assertEqual(record.getMessage(),
+                         'error in 5 [3 similar messages suppressed]')
+
+    def test_rate_limit_per_conversion(self):
+        rate_limit = logqueue.RateLimitFilter(burst=2, interval=60)
+        passed = []
+        for conversion_id in ('a', 'a', 'a', 'b', 'b', None):
+            record = make_record('error in %i', (1,))
+            record.conversion_id = conversion_id
+            if rate_limit.filter(record):
+                passed.append(conversion_id)
+        self.assertEqual(passed, ['a', 'a', 'b', 'b', None])
+
+    def test_json_formatter(self):
+        record = make_record('hello %s', ('there',), level=logging.WARNING)
+        record.conversion_id = 'abc123'
+        record.phase = 'staging'
+        data = json.loads(logqueue.JSONFormatter().format(record))
+        self.assertEqual(data['message'], 'hello there')
+        self.assertEqual(data['level'], 'WARNING')
+        self.assertEqual(data['logger'], 'mvc.test')
+        self.assertEqual(data['conversion_id'], 'abc123')
+        self.assertEqual(data['phase'], 'staging')
+
+    def test_enable(self):
+        path = os.path.join(self.temp_dir, 'mvc.log')
+        existing = ListHandler()
+        formatter = logging.Formatter('%(message)s')
+        existing.setFormatter(formatter)
+        self.root.handlers[:] = [existing]
+        listener = logqueue.enable(path, json_format=True)
+        self.assertEqual([type(h) for h in self.root.handlers],
+                         [logqueue.QueueHandler])
+        file_handler = listener.handlers[-1]
+        logger = logging.getLogger('mvc.test.enable')
+        FakeConversion('abc123', 'finalize').log(logger, 'queued')
+        logqueue.disable()
+        # the root logger's handlers are back the way they were, and the
+        # file is closed
+        self.assertEqual(self.root.handlers, [existing])
+        self.assertTrue(existing.formatter is formatter)
+        self.assertEqual(file_handler.stream, None)
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[-1]['message'], 'queued')
+        self.assertEqual(records[-1]['conversion_id'], 'abc123')
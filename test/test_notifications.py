@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+from mvc import notifications
+
+import base
+
+class NotificationQueueTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.queue = notifications.NotificationQueue()
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        self.queue.close()
+
+    def test_coalesce(self):
+        self.queue.post('a')
+        self.queue.post('b')
+        self.queue.post('a')
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(self.queue.take(), ['a', 'b'])
+        self.assertEqual(self.queue.take(), [])
+
+    def test_wakeup_callback(self):
+        wakeups = []
+        self.queue.set_wakeup_callback(lambda: wakeups.append(True))
+        self.queue.post('a')
+        self.queue.post('b')
+        self.assertEqual(len(wakeups), 1)
+        self.queue.take()
+        self.queue.post('a')
+        self.assertEqual(len(wakeups), 2)
+
+    def test_wait(self):
+        self.assertFalse(self.queue.wait(0))
+        self.queue.post('a')
+        self.assertTrue(self.queue.wait(0))
+        self.queue.take()
+        self.assertFalse(self.queue.wait(0))
+
+    def test_wait_wakes_up(self):
+        def post():
+            time.sleep(0.1)
+            self.queue.post('a')
+        thread = threading.Thread(target=post)
+        thread.start()
+        start = time.time()
+        self.assertTrue(self.queue.wait(5))
+        self.assertTrue(time.time() - start < 1)
+        thread.join()
+
+    def test_subscribe(self):
+        batches = []
+        self.queue.subscribe(batches.append)
+        self.queue.post('a')
+        self.queue.post('b')
+        self.queue.dispatch(self.queue.take())
+        self.assertEqual(batches, [['a', 'b']])
+
+    def test_close(self):
+        fd = self.queue.fileno()
+        self.queue.close()
+        self.assertEqual(self.queue.fileno(), None)
+        if fd is not None:
+            self.assertRaises(OSError, os.fstat, fd)
+        # late updates from conversion threads don't fail
+        self.queue.post('a')
+        self.assertEqual(self.queue.take(), ['a'])
+        self.queue.close()
+
+    def test_close_while_posting(self):
+        errors = []
+        def post():
+            try:
+                for i in range(2000):
+                    self.queue.post(i)
+                    self.queue.take()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=post) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        self.queue.close()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
@@ -0,0 +1,90 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from mvc import conversion
+from mvc import preflight
+
+import base
+from test_conversion import FakeConverterInfo
+
+class FakeSampleConverterInfo(FakeConverterInfo):
+
+    def get_sample_arguments(self, video, output, start, length):
+        return ['-u', os.path.join(
+                os.path.dirname(__file__), 'testdata', 'fake_sampler.py'),
+                video.filename, output, str(start), str(length)]
+
+class FakeVideo(object):
+    audio_only = False
+
+    def __init__(self, filename, duration):
+        self.filename = filename
+        self.duration = duration
+
+class PreflightTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.manager = conversion.ConversionManager()
+        self.converter = FakeSampleConverterInfo('Fake')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        self.manager.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_conversion(self, filename, duration=100.0, converter=None):
+        return self.manager.get_conversion(
+            FakeVideo(filename, duration), converter or self.converter,
+            output_dir=self.temp_dir)
+
+    def test_sample_points(self):
+        self.assertEqual(preflight.get_sample_points(100.0, 3, 10.0),
+                         [(15.0, 10.0), (45.0, 10.0), (75.0, 10.0)])
+        # short videos are converted whole
+        self.assertEqual(preflight.get_sample_points(12.0, 3, 5.0),
+                         [(0.0, 12.0)])
+        self.assertEqual(preflight.get_sample_points(None, 3, 5.0),
+                         [(0.0, 5.0)])
+
+    def test_estimate(self):
+        estimate = preflight.estimate(self.converter,
+                                      FakeVideo('input', 100.0),
+                                      self.temp_dir, 3, 5.0)
+        self.assertEqual(estimate['samples'], 3)
+        # the sampler writes 1000 bytes for each second
+        self.assertEqual(estimate['output_size'], 100000)
+        self.assertTrue(estimate['speed'] > 0)
+        self.assertAlmostEqual(estimate['encode_time'],
+                               100.0 / estimate['speed'])
+        # the samples are cleaned up
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_estimate_unknown_duration(self):
+        estimate = preflight.estimate(self.converter,
+                                      FakeVideo('input', None),
+                                      self.temp_dir, 3, 5.0)
+        self.assertEqual(estimate['samples'], 1)
+        self.assertEqual(estimate['output_size'], None)
+        self.assertEqual(estimate['encode_time'], None)
+
+    def test_check_conversions(self):
+        good = self.make_conversion('good')
+        bad = self.make_conversion('error')
+        unsampled = self.make_conversion(
+            'unsampled', converter=FakeConverterInfo('Fake'))
+        passed = preflight.check_conversions([good, bad, unsampled], 2,
+                                             length=1.0)
+        self.assertEqual(passed, [good, unsampled])
+        self.assertEqual(unsampled.sample_estimate, None)
+        self.assertEqual(good.status, 'initialized')
+        self.assertEqual(good.estimate_output_size(), 100000)
+        self.assertEqual(
+            self.manager.throughput.predict_remaining(good),
+            good.sample_estimate['encode_time'])
+        self.assertEqual(bad.status, 'failed')
+        self.assertTrue('test error' in bad.error)
+        self.assertTrue('Unrecognized option' in bad.error_context)
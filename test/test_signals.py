@@ -0,0 +1,87 @@
+import gc
+import weakref
+
+from mvc import signals
+
+import base
+
+class Listener(object):
+    def __init__(self):
+        self.calls = []
+
+    def callback(self, emitter, *args):
+        self.calls.append(args)
+
+class SignalEmitterTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.emitter = signals.SignalEmitter('changed')
+        self.calls = []
+
+    def callback(self, emitter, *args):
+        self.calls.append(args)
+
+    def test_emit_in_connection_order(self):
+        self.emitter.connect('changed', lambda e: self.calls.append(1))
+        self.emitter.connect('changed', lambda e: self.calls.append(2))
+        self.emitter.connect('changed', lambda e: self.calls.append(3))
+        self.emitter.emit('changed')
+        self.assertEqual(self.calls, [1, 2, 3])
+
+    def test_extra_args(self):
+        self.emitter.connect('changed', self.callback, 'extra')
+        self.emitter.emit('changed', 'arg')
+        self.assertEqual(self.calls, [('arg', 'extra')])
+
+    def test_duplicate_connect(self):
+        self.emitter.connect('changed', self.callback)
+        self.assertRaises(ValueError, self.emitter.connect, 'changed',
+                          self.callback)
+        self.assertRaises(ValueError, self.emitter.connect_weak, 'changed',
+                          self.callback)
+
+    def test_disconnect(self):
+        handle = self.emitter.connect('changed', self.callback)
+        self.emitter.emit('changed', 1)
+        self.emitter.disconnect(handle)
+        self.emitter.emit('changed', 2)
+        self.assertEqual(self.calls, [(1,)])
+        # we can connect again after disconnecting
+        self.emitter.connect('changed', self.callback)
+        self.emitter.emit('changed', 3)
+        self.assertEqual(self.calls, [(1,), (3,)])
+
+    def test_connect_while_emitting(self):
+        def connect_another(emitter):
+            self.calls.append('first')
+            emitter.connect('changed', lambda e: self.calls.append('new'))
+        self.emitter.connect('changed', connect_another)
+        self.emitter.emit('changed')
+        self.assertEqual(self.calls, ['first'])
+
+    def test_weak_callback_removed(self):
+        listener = Listener()
+        self.emitter.connect_weak('changed', listener.callback)
+        self.emitter.emit('changed', 1)
+        self.assertEqual(listener.calls, [(1,)])
+        del listener
+        gc.collect()
+        self.assertEqual(self.emitter.get_callbacks('changed'), {})
+        # a new listener can reuse the same address without looking like a
+        # duplicate
+        listener = Listener()
+        self.emitter.connect_weak('changed', listener.callback)
+        self.emitter.emit('changed', 2)
+        self.assertEqual(listener.calls, [(2,)])
+
+    def test_weak_callback_doesnt_keep_emitter_alive(self):
+        listener = Listener()
+        self.emitter.connect_weak('changed', listener.callback)
+        emitter_ref = weakref.ref(self.emitter)
+        del self.emitter
+        gc.collect()
+        self.assertEqual(emitter_ref(), None)
+        # the listener outliving the emitter doesn't cause errors
+        del listener
+        gc.collect()
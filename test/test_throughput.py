@@ -0,0 +1,67 @@
+import os.path
+import shutil
+import tempfile
+
+from mvc import throughput
+
+import base
+import mock
+
+def make_video(height=720, duration=100.0, codec='h264'):
+    return mock.Mock(height=height, duration=duration, video_codec=codec,
+                     audio_codec='aac', audio_only=False)
+
+class ThroughputModelTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'throughput.json')
+        self.model = throughput.ThroughputModel(self.path)
+        self.converter = mock.Mock(identifier='mp4')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_no_history(self):
+        self.assertEqual(self.model.predict(self.converter, make_video()),
+                         None)
+
+    def test_predict(self):
+        self.model.record(self.converter, make_video(), 100.0, 50.0)
+        self.assertEqual(self.model.get_speed(self.converter, make_video()),
+                         2.0)
+        self.assertEqual(self.model.predict(self.converter,
+                                            make_video(duration=10.0)),
+                         5.0)
+
+    def test_fallback_keys(self):
+        self.model.record(self.converter, make_video(), 100.0, 50.0)
+        # different resolution, same converter
+        self.assertEqual(self.model.get_speed(self.converter,
+                                              make_video(height=1080)),
+                         2.0)
+        # different converter entirely
+        other = mock.Mock(identifier='webmhd')
+        self.assertEqual(self.model.get_speed(other, make_video()), 2.0)
+
+    def test_persisted(self):
+        self.model.record(self.converter, make_video(), 100.0, 25.0)
+        model = throughput.ThroughputModel(self.path)
+        self.assertEqual(model.get_speed(self.converter, make_video()), 4.0)
+
+    def test_schedule_finish_times(self):
+        running = ['a']
+        queued = ['b', 'c', 'd']
+        remaining = {'a': 10.0, 'b': 5.0, 'c': 20.0, 'd': 1.0}
+        finish_times = throughput.schedule_finish_times(
+            running, queued, 2, remaining.get)
+        self.assertEqual(finish_times, {'a': 10.0, 'b': 5.0, 'c': 25.0,
+                                        'd': 11.0})
+
+    def test_schedule_finish_times_unknown(self):
+        remaining = {'a': 10.0, 'b': None, 'c': 20.0}
+        finish_times = throughput.schedule_finish_times(
+            ['a'], ['b', 'c'], 1, remaining.get)
+        self.assertEqual(finish_times, {'a': 10.0, 'b': None, 'c': None})
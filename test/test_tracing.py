@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+
+from mvc import tracing
+
+import base
+
+class FakeVideo(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+class FakeConversion(object):
+    def __init__(self, filename):
+        self.video = FakeVideo(filename)
+
+class TracingTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        tracing.disable()
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        tracing.disable()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_disabled(self):
+        self.assertEqual(tracing.get_tracer(), None)
+        span = tracing.span('probe', filename='foo')
+        self.assertTrue(span is tracing.span('encode'))
+        with span:
+            pass
+        tracing.record('queued', 1.0, 2.0)
+        self.assertEqual(tracing.get_tracer(), None)
+
+    def test_span(self):
+        tracer = tracing.enable()
+        with tracing.span('probe', filename='foo'):
+            pass
+        self.assertEqual(len(tracer.spans), 1)
+        name, start, end, track, args = tracer.spans[0]
+        self.assertEqual(name, 'probe')
+        self.assertTrue(start <= end)
+        self.assertEqual(args, {'filename': 'foo'})
+
+    def test_span_error(self):
+        tracer = tracing.enable()
+        def fail():
+            with tracing.span('finalize'):
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(tracer.spans[0][4], {'error': 'ValueError'})
+
+    def test_summarize(self):
+        tracer = tracing.enable()
+        tracing.record('encode', 10.0, 12.0)
+        tracing.record('encode', 10.0, 15.0)
+        tracing.record('queued', 0.0, 1.0)
+        self.assertEqual(tracer.summarize(), {
+                'encode': {'count': 2, 'total': 7.0, 'max': 5.0},
+                'queued': {'count': 1, 'total': 1.0, 'max': 1.0},
+                })
+        lines = tracer.format_summary().splitlines()
+        # the biggest total comes first
+        self.assertEqual(lines[1].split()[:2], ['encode', '2'])
+        self.assertEqual(lines[2].split()[:2], ['queued', '1'])
+
+    def test_chrome_trace(self):
+        path = os.path.join(self.temp_dir, 'trace.json')
+        tracer = tracing.enable(path)
+        first = FakeConversion('/videos/first.webm')
+        second = FakeConversion('/videos/second.webm')
+        start = tracer.created_at
+        tracing.record('queued', start, start + 1, first)
+        tracing.record('encode', start + 1, start + 3, first, paused=0.0)
+        tracing.record('queued', start, start + 2, second)
+        tracing.record('notifications', start + 2, start + 2.5)
+        tracer.write_chrome_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        events = trace['traceEvents']
+        names = dict((e['tid'], e['args']['name']) for e in events
+                     if e['ph'] == 'M')
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in spans],
+                         ['queued', 'encode', 'queued', 'notifications'])
+        # the spans for each conversion go on their own track
+        self.assertEqual(spans[0]['tid'], spans[1]['tid'])
+        self.assertNotEqual(spans[0]['tid'], spans[2]['tid'])
+        self.assertEqual(names[spans[0]['tid']], 'first.webm')
+        self.assertEqual(names[spans[2]['tid']], 'second.webm')
+        self.assertEqual(names[spans[3]['tid']], 'MainThread')
+        self.assertEqual(spans[1]['ts'], 1000000)
+        self.assertEqual(spans[1]['dur'], 2000000)
+        self.assertEqual(spans[1]['args'], {'paused': 0.0})
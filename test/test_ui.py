@@ -0,0 +1,152 @@
+from mvc.ui import widgets
+
+import base
+import mock
+
+class FlushUpdatesTest(base.Test):
+
+    def make_app(self):
+        app = mock.Mock()
+        app.dirty_conversions = set(['conversion'])
+        return app
+
+    def test_flush_updates(self):
+        app = self.make_app()
+        widgets.Application.flush_updates.im_func(app)
+        app.model.update_conversions.assert_called_with(set(['conversion']))
+        self.assertEqual(app.dirty_conversions, set())
+        self.assertFalse(app.update_scheduled)
+        # the table has to be told, or OS X doesn't redraw the rows
+        self.assertTrue(app.table.model_changed.called)
+
+class QueueETATest(base.Test):
+
+    def test_only_recomputed_when_queue_changes(self):
+        app = mock.Mock()
+        app.conversion_manager.queue_changes = 1
+        app.conversion_manager.update_queue_estimates.return_value = 60.0
+        app.model.__len__ = lambda self: 2
+        app.queue_eta_key = None
+        get_queue_eta = widgets.Application.get_queue_eta.im_func
+        self.assertEqual(get_queue_eta(app), 60.0)
+        self.assertEqual(get_queue_eta(app), 60.0)
+        self.assertEqual(
+            app.conversion_manager.update_queue_estimates.call_count, 1)
+        app.conversion_manager.queue_changes = 2
+        get_queue_eta(app)
+        self.assertEqual(
+            app.conversion_manager.update_queue_estimates.call_count, 2)
+
+class FakeConversion(object):
+
+    def __init__(self, filename):
+        self.video = mock.Mock()
+        self.video.filename = filename
+        self.video.audio_only = True
+        self.video.get_thumbnail.return_value = None
+        self.converter = mock.Mock()
+        self.converter.name = 'Converter'
+        self.status = 'initialized'
+        self.output_size = self.duration = self.progress = None
+        self.eta = self.queue_eta = None
+
+class ConversionModelTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.model = widgets.ConversionModel()
+
+    def check_model(self, conversions, check_rows=True):
+        # compare the incrementally kept state with a full recount
+        self.assertEqual(len(self.model), len(conversions))
+        self.assertEqual(set(self.model.conversions()), set(conversions))
+        counts = {}
+        for c in conversions:
+            counts[c.status] = counts.get(c.status, 0) + 1
+        self.assertEqual(dict((status, count) for status, count
+                              in self.model.status_counts.items() if count),
+                         counts)
+        for status in ('initialized', 'converting', 'finished', 'failed'):
+            self.assertEqual(self.model.count_status(status),
+                             counts.get(status, 0))
+        self.assertEqual(self.model.all_conversions_done(),
+                         bool(conversions) and all(
+                c.status in ('canceled', 'finished', 'failed')
+                for c in conversions))
+        for c in conversions:
+            self.assertTrue(c in self.model)
+            self.assertTrue(self.model.get_by_filename(c.video.filename) is c)
+            if not check_rows:
+                continue
+            iter_ = self.model.conversion_to_iter[c]
+            self.assertEqual(tuple(self.model[iter_]),
+                             self.model.get_values(c))
+
+    def test_add(self):
+        conversions = [FakeConversion('video%i.mp4' % i) for i in range(5)]
+        for c in conversions:
+            self.model.update_conversion(c)
+        self.check_model(conversions)
+        self.assertEqual(self.model.get_by_filename('missing.mp4'), None)
+        self.assertFalse(FakeConversion('video0.mp4') in self.model)
+
+    def test_update(self):
+        conversions = [FakeConversion('video%i.mp4' % i) for i in range(3)]
+        self.model.update_conversions(conversions)
+        # conversions not in the model are skipped
+        self.check_model([])
+        for c in conversions:
+            self.model.update_conversion(c)
+        conversions[0].status = 'converting'
+        conversions[0].progress = 10.0
+        conversions[0].eta = 30.0
+        conversions[1].queue_eta = 60.0
+        update_value = mock.Mock(wraps=self.model.update_value)
+        with mock.patch.object(self.model, 'update_value', update_value):
+            self.model.update_conversions(conversions)
+            # only the columns that changed are written
+            self.assertEqual(update_value.call_count, 4)
+            self.model.update_conversions(conversions)
+            self.assertEqual(update_value.call_count, 4)
+        self.check_model(conversions)
+
+    def test_change_status(self):
+        conversions = [FakeConversion('video%i.mp4' % i) for i in range(4)]
+        for c in conversions:
+            self.model.update_conversion(c)
+        for status in ('converting', 'finished'):
+            for c in conversions:
+                c.status = status
+                # status counts change before the row is redrawn
+                self.model.note_status(c)
+            self.check_model(conversions, check_rows=False)
+            self.model.update_conversions(conversions)
+            self.check_model(conversions)
+        self.assertTrue(self.model.all_conversions_done())
+        conversions[2].status = 'failed'
+        conversions[3].status = 'initialized'
+        self.model.update_conversions(conversions)
+        self.check_model(conversions)
+        self.assertFalse(self.model.all_conversions_done())
+
+    def test_remove(self):
+        conversions = [FakeConversion('video%i.mp4' % i) for i in range(5)]
+        for c in conversions:
+            self.model.update_conversion(c)
+        conversions[1].status = 'finished'
+        conversions[2].status = 'converting'
+        self.model.update_conversions(conversions)
+        self.model.remove_conversions(conversions[:2])
+        self.check_model(conversions[2:])
+        for c in conversions[:2]:
+            self.assertFalse(c in self.model)
+            self.assertEqual(
+                self.model.get_by_filename(c.video.filename), None)
+        # removing conversions that are already gone does nothing
+        self.model.remove_conversions(conversions[:2])
+        self.model.remove_conversions(conversions[2:])
+        self.check_model([])
+        self.assertFalse(self.model.all_conversions_done())
+        # a removed conversion can be added back
+        self.model.update_conversion(conversions[0])
+        self.check_model(conversions[:1])
@@ -1,3 +1,4 @@
+import os.path
 from StringIO import StringIO
 
 from mvc import utils
@@ -46,3 +47,77 @@ line5"""
         expected = ['line1', 'line2', 'line3', 'line4', 'line5']
         self.assertEqual(list(utils.line_reader(StringIO(lines))), expected)
 
+    def test_parse_bitrate(self):
+        self.assertEqual(utils.parse_bitrate('96k'), 96000)
+        self.assertEqual(utils.parse_bitrate('2M'), 2000000)
+        self.assertEqual(utils.parse_bitrate('1.5M'), 1500000)
+        self.assertEqual(utils.parse_bitrate('10000000'), 10000000)
+        self.assertEqual(utils.parse_bitrate('baseline'), None)
+
+    def test_get_available_space(self):
+        self.assertTrue(utils.get_available_space(self.testdata_dir) > 0)
+        self.assertEqual(utils.get_available_space(
+                os.path.join(self.testdata_dir, 'does-not-exist')), None)
+
+
+class SquareCache(utils.LRUCache):
+    def create_new_value(self, key, invalidator=None):
+        return key * key
+
+class LRUCacheTest(base.Test):
+
+    def test_get_creates_values(self):
+        cache = SquareCache(max_size=10)
+        self.assertEqual(cache.get(3), 9)
+        self.assertEqual(cache.get(3), 9)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(max_size=3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.find('a') # 'b' is now the least recently used
+        cache.set('d', 'd')
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_max_weight(self):
+        cache = utils.LRUCache(max_weight=10, weight=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        self.assertEqual(cache.total_weight, 8)
+        cache.set('c', 'x' * 4)
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertEqual(cache.total_weight, 8)
+        cache.set('c', 'x')
+        self.assertEqual(cache.total_weight, 5)
+        cache.remove('b')
+        self.assertEqual(cache.total_weight, 1)
+
+    def test_invalidator(self):
+        stale = set()
+        cache = SquareCache(max_size=10)
+        self.assertEqual(cache.get(2, invalidator=lambda k: k in stale), 4)
+        self.assertEqual(cache.find(2), 4)
+        stale.add(2)
+        self.assertEqual(cache.find(2), None)
+        self.assertFalse(2 in cache)
+        self.assertEqual(cache.total_weight, 0)
+
+    def test_invalidator_uses_cache(self):
+        # the invalidator is called without the cache's lock held
+        cache = SquareCache(max_size=10)
+        cache.get(2, invalidator=lambda k: cache.find('other') is None)
+        self.assertEqual(cache.find(2), None)
+
+    def test_cache_compatibility(self):
+        class OldSquareCache(utils.Cache):
+            def create_new_value(self, key, invalidator=None):
+                return key * key
+        cache = OldSquareCache(2)
+        self.assertEqual(cache.size, 2)
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual(cache.get(3), 9)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(sorted(cache.keys()), [2, 3])
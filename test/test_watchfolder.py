@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import time
+
+from mvc import conversion
+from mvc import watchfolder
+
+import base
+from test_conversion import FakeConverterInfo
+
+class WatchFolderTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.watch_dir = os.path.join(self.temp_dir, 'watch')
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+        os.mkdir(self.watch_dir)
+        os.mkdir(self.output_dir)
+        self.record_path = os.path.join(self.temp_dir, 'record.json')
+        self.manager = conversion.ConversionManager()
+        self.converter = FakeConverterInfo('Fake')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        # let conversions finish before their files are removed
+        self.spin(5)
+        self.manager.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_watch(self, watcher=None, settle_time=0.3):
+        if watcher is None:
+            watcher = watchfolder.PollingWatcher([self.watch_dir], 0)
+        watch = watchfolder.WatchFolder(self.manager, self.converter,
+                                        [self.watch_dir],
+                                        record_path=self.record_path,
+                                        output_dir=self.output_dir,
+                                        settle_time=settle_time,
+                                        watcher=watcher)
+        self.addCleanup(watch.close)
+        return watch
+
+    def add_file(self, name='webm-0.webm'):
+        path = os.path.join(self.watch_dir, name)
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'), path)
+        return path
+
+    def poll_until(self, watch, timeout):
+        """Poll until something is started, or timeout seconds pass."""
+        finish_by = time.time() + timeout
+        while time.time() < finish_by:
+            started = watch.poll(0.1)
+            if started:
+                return started
+        return []
+
+    def spin(self, timeout):
+        finish_by = time.time() + timeout
+        while time.time() < finish_by and self.manager.running:
+            self.manager.wait_for_notifications(0.1)
+            self.manager.check_notifications()
+
+    def test_is_ignored(self):
+        self.assertFalse(watchfolder.is_ignored('/videos/foo.mp4'))
+        self.assertTrue(watchfolder.is_ignored('/videos/.foo.mp4.Xy12ab'))
+        self.assertTrue(watchfolder.is_ignored('/videos/foo.mp4.part'))
+
+    def test_output_dir(self):
+        self.assertRaises(ValueError, watchfolder.WatchFolder, self.manager,
+                          self.converter, [self.watch_dir],
+                          output_dir=self.watch_dir,
+                          watcher=watchfolder.PollingWatcher([]))
+
+    def test_wait_until_settled(self):
+        path = self.add_file()
+        watch = self.make_watch()
+        start = time.time()
+        self.assertEqual(watch.poll(0), [])
+        self.assertTrue(path in watch.pending)
+        started = self.poll_until(watch, 2)
+        self.assertTrue(time.time() - start >= 0.3)
+        self.assertEqual([c.video.filename for c in started], [path])
+        self.assertEqual(started[0].output_dir, self.output_dir)
+        self.assertEqual(watch.record.get(path)['status'], 'queued')
+        self.spin(3)
+        self.assertEqual(started[0].status, 'finished')
+        self.assertEqual(watch.record.get(path)['status'], 'finished')
+        # we don't convert it again
+        self.assertEqual(self.poll_until(watch, 0.5), [])
+
+    def test_still_writing(self):
+        path = self.add_file()
+        watch = self.make_watch()
+        watch.poll(0)
+        for i in range(3):
+            time.sleep(0.2)
+            with open(path, 'a') as f:
+                f.write('more')
+            self.assertEqual(watch.poll(0), [])
+        self.assertEqual(len(self.poll_until(watch, 2)), 1)
+
+    def test_restart(self):
+        finished = self.add_file('finished.webm')
+        unfinished = self.add_file('unfinished.webm')
+        record = watchfolder.WatchRecord(self.record_path)
+        for path, status in ((finished, 'finished'),
+                             (unfinished, 'queued')):
+            stat = os.stat(path)
+            record.set(path, status=status, size=stat.st_size,
+                       mtime=stat.st_mtime,
+                       converter=self.converter.identifier)
+        watch = self.make_watch()
+        started = self.poll_until(watch, 2)
+        # only the one that was cut short is converted again
+        self.assertEqual([c.video.filename for c in started], [unfinished])
+        self.assertEqual(self.poll_until(watch, 0.5), [])
+
+    def test_stop_conversions(self):
+        path = self.add_file()
+        watch = self.make_watch()
+        started = self.poll_until(watch, 2)
+        # wait for the converter to start
+        finish_by = time.time() + 2
+        while started[0].popen is None and time.time() < finish_by:
+            time.sleep(0.05)
+        self.assertEqual(watch.stop_conversions(), started)
+        started[0].thread.join(3)
+        self.manager.check_notifications()
+        self.assertEqual(started[0].status, 'canceled')
+        self.assertEqual(watch.record.get(path)['status'], 'canceled')
+        watch.close()
+        # it's converted again next time
+        watch = self.make_watch()
+        self.assertEqual(len(self.poll_until(watch, 2)), 1)
+
+    def test_changed_file_converted_again(self):
+        path = self.add_file()
+        stat = os.stat(path)
+        watchfolder.WatchRecord(self.record_path).set(
+            path, status='finished', size=stat.st_size - 1,
+            mtime=stat.st_mtime, converter=self.converter.identifier)
+        watch = self.make_watch()
+        self.assertEqual(len(self.poll_until(watch, 2)), 1)
+
+    def test_inotify(self):
+        try:
+            watcher = watchfolder.InotifyWatcher([self.watch_dir])
+        except (EnvironmentError, AttributeError):
+            return # no inotify on this platform
+        # with a long settle time, only the close tells us the file's done
+        watch = self.make_watch(watcher, settle_time=60)
+        self.assertEqual(watch.poll(0), [])
+        path = self.add_file()
+        started = self.poll_until(watch, 2)
+        self.assertEqual([c.video.filename for c in started], [path])
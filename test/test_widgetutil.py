@@ -0,0 +1,117 @@
+from mvc.widgets import widgetutil
+
+import base
+import mock
+
+THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT = 90, 70
+THUMBNAIL_CACHE_BYTES = 16 * 1024 * 1024
+
+class FakeImage(object):
+    # path -> (width, height) of the images that can be loaded
+    sizes = {}
+    loads = 0
+
+    def __init__(self, path, size=None):
+        if size is None:
+            if path not in self.sizes:
+                raise ValueError('bad image: %r' % path)
+            size = self.sizes[path]
+            FakeImage.loads += 1
+        self.path = path
+        self.width, self.height = size
+
+    def resize_for_space(self, width, height):
+        ratio = min(float(width) / self.width, float(height) / self.height)
+        return FakeImage(self.path, (self.width * ratio, self.height * ratio))
+
+class FakeImageSurface(object):
+    def __init__(self, image):
+        self.image = image
+        self.width = image.width
+        self.height = image.height
+
+class FakeWidgetset(object):
+    Image = FakeImage
+    ImageSurface = FakeImageSurface
+
+class ImageSurfaceCacheTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        patcher = mock.patch.object(widgetutil, 'widgetset', FakeWidgetset)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeImage.sizes = {'default.png': (40, 40)}
+        FakeImage.loads = 0
+        self.cache = widgetutil.ImageSurfaceCache(
+            THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_CACHE_BYTES,
+            'default.png')
+
+    def test_reuses_surface(self):
+        FakeImage.sizes['thumb.png'] = (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+        surface = self.cache.get('thumb.png')
+        self.assertEqual(surface.image.path, 'thumb.png')
+        self.assertTrue(self.cache.get('thumb.png') is surface)
+        self.assertEqual(FakeImage.loads, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # a cache for another size has its own surfaces
+        other = widgetutil.ImageSurfaceCache(
+            THUMBNAIL_WIDTH // 2, THUMBNAIL_HEIGHT // 2,
+            THUMBNAIL_CACHE_BYTES, 'default.png')
+        small = other.get('thumb.png')
+        self.assertFalse(small is surface)
+        self.assertEqual((small.width, small.height),
+                         (THUMBNAIL_WIDTH // 2, THUMBNAIL_HEIGHT // 2))
+
+    def test_prescales_large_images(self):
+        FakeImage.sizes['big.png'] = (THUMBNAIL_WIDTH * 10,
+                                      THUMBNAIL_HEIGHT * 10)
+        FakeImage.sizes['wide.png'] = (THUMBNAIL_WIDTH * 4, THUMBNAIL_HEIGHT)
+        FakeImage.sizes['small.png'] = (THUMBNAIL_WIDTH // 2,
+                                        THUMBNAIL_HEIGHT // 2)
+        surface = self.cache.get('big.png')
+        self.assertEqual((surface.width, surface.height),
+                         (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+        surface = self.cache.get('wide.png')
+        self.assertEqual((surface.width, surface.height),
+                         (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT / 4.0))
+        # images that already fit aren't upscaled
+        surface = self.cache.get('small.png')
+        self.assertEqual((surface.width, surface.height),
+                         (THUMBNAIL_WIDTH // 2, THUMBNAIL_HEIGHT // 2))
+        # the weight is the pixel memory of the scaled surfaces
+        self.assertEqual(self.cache.total_weight,
+                         THUMBNAIL_WIDTH * THUMBNAIL_HEIGHT * 4 +
+                         int(THUMBNAIL_WIDTH * THUMBNAIL_HEIGHT / 4.0 * 4) +
+                         (THUMBNAIL_WIDTH // 2) * (THUMBNAIL_HEIGHT // 2) * 4)
+
+    def test_evicts_by_weight(self):
+        weight = THUMBNAIL_WIDTH * THUMBNAIL_HEIGHT * 4
+        fits = THUMBNAIL_CACHE_BYTES // weight
+        paths = ['thumb%i.png' % i for i in range(fits + 1)]
+        for path in paths:
+            FakeImage.sizes[path] = (THUMBNAIL_WIDTH * 2,
+                                     THUMBNAIL_HEIGHT * 2)
+        for path in paths[:fits]:
+            self.cache.get(path)
+        self.assertEqual(self.cache.total_weight, fits * weight)
+        self.assertEqual(self.cache.evictions, 0)
+        # use the first thumbnail, so that the second one is evicted
+        self.cache.get(paths[0])
+        self.cache.get(paths[-1])
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertTrue(self.cache.total_weight <= THUMBNAIL_CACHE_BYTES)
+        self.assertTrue(paths[0] in self.cache)
+        self.assertFalse(paths[1] in self.cache)
+        # evicted surfaces are reloaded when they're needed again
+        loads = FakeImage.loads
+        self.cache.get(paths[1])
+        self.assertEqual(FakeImage.loads, loads + 1)
+
+    def test_default(self):
+        default = self.cache.get(None)
+        self.assertEqual(default.image.path, 'default.png')
+        # the default surface is drawn at its natural size
+        self.assertEqual((default.width, default.height), (40, 40))
+        self.assertTrue(self.cache.get('missing.png') is default)
+        self.assertTrue(self.cache.get(None) is default)
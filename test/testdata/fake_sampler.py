@@ -0,0 +1,19 @@
+import json
+import sys
+import time
+
+# writes 1000 bytes for each second of the sample
+filename, output, start, length = sys.argv[1:5]
+length = float(length)
+if 'error' in filename:
+    print 'Unrecognized option'
+    print json.dumps({'finished': True, 'error': 'test error'})
+    sys.exit(1)
+
+for i in range(3):
+    print json.dumps({'progress': length * i / 3})
+    time.sleep(0.05)
+
+with open(output, 'w') as f:
+    f.write('x' * int(length * 1000))
+print json.dumps({'finished': True})
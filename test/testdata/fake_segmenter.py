@@ -0,0 +1,22 @@
+import json
+import os
+import sys
+import time
+
+# writes a "segment" into the output directory for each second of input
+filename, output = sys.argv[1:3]
+if not os.path.isdir(output):
+    print json.dumps({'finished': True,
+                      'error': '%r is not a directory' % (output,)})
+    sys.exit(1)
+
+RANGE = 5
+for i in range(RANGE):
+    with file(os.path.join(output, 'segment-%i' % i), 'w') as f:
+        f.write('segment')
+    if 'error' in filename and i == 2:
+        print json.dumps({'finished': True, 'error': 'test error'})
+        sys.exit(1)
+    print json.dumps({'duration': RANGE, 'progress': i + 1})
+    time.sleep(0.1)
+print json.dumps({'finished': True})
@@ -0,0 +1,14 @@
+import json
+import sys
+
+# copies stdin to stdout, upper-cased, and reports progress on stderr
+total = 0
+while True:
+    data = sys.stdin.read(4096)
+    if not data:
+        break
+    sys.stdout.write(data.upper())
+    total += len(data)
+    sys.stderr.write(json.dumps({'size': total}) + '\n')
+sys.stdout.flush()
+sys.stderr.write(json.dumps({'finished': True, 'size': total}) + '\n')